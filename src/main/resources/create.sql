@@ -1,13 +1,21 @@
+DROP TABLE IF EXISTS Notifications;
+DROP TABLE IF EXISTS Waitlist;
 DROP TABLE IF EXISTS Availabilities;
 DROP TABLE IF EXISTS Appointments;
 DROP TABLE IF EXISTS Caregivers;
 DROP TABLE IF EXISTS Patients;
 DROP TABLE IF EXISTS Vaccines;
+DROP TABLE IF EXISTS Id_blocks;
+DROP TABLE IF EXISTS Schema_version;
+DROP TABLE IF EXISTS Daily_summary;
+DROP TABLE IF EXISTS Vaccine_summary;
 
 CREATE TABLE Caregivers (
     Username varchar(255),
     Salt BINARY(16),
     Hash BINARY(16),
+    Hash_algorithm varchar(32),
+    Iterations int,
     PRIMARY KEY (Username)
 );
 
@@ -15,6 +23,8 @@ CREATE TABLE Patients (
     Username varchar(255),
     Salt BINARY(16),
     Hash BINARY(16),
+    Hash_algorithm varchar(32),
+    Iterations int,
     PRIMARY KEY (Username)
 );
 
@@ -26,10 +36,13 @@ CREATE TABLE Vaccines (
 
 CREATE TABLE Availabilities (
     Date date,
-    Caregiver_name varchar(255) REFERENCES Caregivers
+    Caregiver_name varchar(255) REFERENCES Caregivers,
     PRIMARY KEY (date, Caregiver_name)
 );
 
+-- per-caregiver lookups over a date range (upload/remove_availability)
+CREATE INDEX Availabilities_caregiver ON Availabilities (Caregiver_name, Date);
+
 CREATE TABLE Appointments (
     Appointment_id int,
     Date date,
@@ -37,4 +50,65 @@ CREATE TABLE Appointments (
     Caregiver_name varchar(255) REFERENCES Caregivers,
     Vaccine_name varchar(255) REFERENCES Vaccines,
     PRIMARY KEY (Appointment_id)
+);
+
+-- show_appointments reads a patient's or caregiver's appointments in Appointment_id order from
+-- these alone; the trailing columns only make them covering (Migrate.py puts them in INCLUDE on
+-- SQL Server, but this file is also run by SQLite, which has no INCLUDE)
+CREATE INDEX Appointments_patient ON Appointments (Patient_name, Appointment_id, Date, Caregiver_name, Vaccine_name);
+CREATE INDEX Appointments_caregiver ON Appointments (Caregiver_name, Appointment_id, Date, Patient_name, Vaccine_name);
+
+-- next unleased id per table, advanced a block at a time by IdAllocator
+CREATE TABLE Id_blocks (
+    Name varchar(255),
+    Next_id int,
+    PRIMARY KEY (Name)
+);
+
+-- patients waiting for a caregiver and a dose, served by Priority (highest first) then Waitlist_id
+CREATE TABLE Waitlist (
+    Waitlist_id int,
+    Date date,
+    Patient_name varchar(255) REFERENCES Patients,
+    Vaccine_name varchar(255),
+    Priority int,
+    PRIMARY KEY (Waitlist_id),
+    UNIQUE (Patient_name, Date, Vaccine_name)
+);
+
+CREATE INDEX Waitlist_queue ON Waitlist (Date, Vaccine_name, Priority);
+
+-- appointments booked from the waitlist that the patient has not been told about yet
+CREATE TABLE Notifications (
+    Patient_name varchar(255) REFERENCES Patients,
+    Appointment_id int,
+    PRIMARY KEY (Patient_name, Appointment_id)
+);
+
+-- reporting counters kept up to date by the transactions that book, cancel and block (db/Summary.py):
+-- per appointment date, appointments (net of cancellations), cancellations and caregiver-days
+-- blocked without an appointment
+CREATE TABLE Daily_summary (
+    Date date,
+    Appointments int NOT NULL DEFAULT 0,
+    Cancellations int NOT NULL DEFAULT 0,
+    Blocked int NOT NULL DEFAULT 0,
+    PRIMARY KEY (Date)
+);
+
+-- per date and vaccine, doses consumed by that date's appointments and doses added that day
+CREATE TABLE Vaccine_summary (
+    Date date,
+    Vaccine_name varchar(255),
+    Consumed int NOT NULL DEFAULT 0,
+    Added int NOT NULL DEFAULT 0,
+    PRIMARY KEY (Date, Vaccine_name)
+);
+
+-- migrations applied to this database by Migrate.py
+CREATE TABLE Schema_version (
+    Version int,
+    Description varchar(255),
+    Applied_on date,
+    PRIMARY KEY (Version)
 );
\ No newline at end of file
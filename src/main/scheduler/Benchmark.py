@@ -0,0 +1,246 @@
+import argparse
+import contextlib
+import datetime
+import json
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+import Scheduler
+from model.Caregiver import Caregiver
+from model.Patient import Patient
+from model.Vaccine import Vaccine
+from util.Util import Util
+from db.Backend import set_backend
+from db.SqliteBackend import SqliteBackend
+from db.ConnectionManager import ConnectionManager
+from db.InventoryCache import get_inventory_cache
+from db.IdAllocator import get_id_allocator
+
+
+'''
+Per-command benchmark for the scheduler.
+
+For every data size a fresh SQLite database is seeded with synthetic caregivers, patients,
+vaccines, booked caregiver days and appointments, and then each command is timed by calling the
+same functions the command line uses, with their output discarded. Latency percentiles and
+throughput are printed and can be written as JSON to compare runs:
+
+    python Benchmark.py --sizes small,medium --output bench.json
+'''
+
+# caregivers, patients, vaccines, days in the calendar, booked caregiver days, appointments
+SIZES = {
+    "small": {"caregivers": 50, "patients": 500, "vaccines": 3, "days": 30, "booked": 300, "appointments": 200},
+    "medium": {"caregivers": 500, "patients": 5000, "vaccines": 5, "days": 90, "booked": 10000, "appointments": 5000},
+    "large": {"caregivers": 2000, "patients": 20000, "vaccines": 10, "days": 180, "booked": 100000, "appointments": 20000},
+}
+
+COMMANDS = ["create_patient", "login_patient", "search_caregiver_schedule", "reserve", "cancel",
+            "show_appointments", "add_doses"]
+
+PASSWORD = "benchmark"
+FIRST_DAY = datetime.date(2030, 1, 1)
+
+
+def seed(size, rng):
+    # every synthetic user shares one salt and hash so seeding does not pay for PBKDF2
+    salt = Util.generate_salt()
+    hash = Util.generate_hash(PASSWORD, salt)
+    algorithm, iterations = Util.hash_algorithm(), Util.hash_iterations()
+    caregivers = ["caregiver%d" % i for i in range(size["caregivers"])]
+    patients = ["patient%d" % i for i in range(size["patients"])]
+    Caregiver.save_many([Caregiver(u, salt=salt, hash=hash, algorithm=algorithm, iterations=iterations) for u in caregivers])
+    Patient.save_many([Patient(u, salt=salt, hash=hash, algorithm=algorithm, iterations=iterations) for u in patients])
+    vaccines = ["vaccine%d" % i for i in range(size["vaccines"])]
+    for name in vaccines:
+        Vaccine(name, 1000000).save_to_db()
+
+    days = [FIRST_DAY + datetime.timedelta(days=i) for i in range(size["days"])]
+    slots = [(d, c) for d in days for c in caregivers]
+    rng.shuffle(slots)
+    booked = slots[:min(size["booked"] + size["appointments"], len(slots))]
+    appointments = booked[:size["appointments"]]
+    # lease the ids before the seeding transaction takes SQLite's write lock
+    allocator = get_id_allocator("Appointments", "Appointment_id")
+    ids = [allocator.next_id() for _ in appointments]
+
+    cm = ConnectionManager()
+    conn = cm.create_connection()
+    cursor = conn.cursor()
+    try:
+        batch_size = cm.backend.max_batch_rows(2)
+        for i in range(0, len(booked), batch_size):
+            batch = booked[i:i + batch_size]
+            add_availability = "INSERT INTO Availabilities VALUES " + ", ".join(["(%s, %s)"] * len(batch))
+            cursor.execute(add_availability, tuple(v for slot in batch for v in slot))
+        batch_size = cm.backend.max_batch_rows(5)
+        for i in range(0, len(appointments), batch_size):
+            batch = appointments[i:i + batch_size]
+            insert_appointment = "INSERT INTO Appointments (Appointment_id, Date, Patient_name, Caregiver_name, Vaccine_name) VALUES " \
+                                 + ", ".join(["(%s, %s, %s, %s, %s)"] * len(batch))
+            params = []
+            for appointment_id, (d, caregiver) in zip(ids[i:i + batch_size], batch):
+                params.extend((appointment_id, d, rng.choice(patients), caregiver, rng.choice(vaccines)))
+            cursor.execute(insert_appointment, tuple(params))
+        conn.commit()
+    finally:
+        cm.close_connection()
+    get_inventory_cache().invalidate()
+    return caregivers, patients, vaccines, days
+
+
+def appointment_ids():
+    # [(appointment id, patient)]; cancel only accepts the patient's own appointments
+    cm = ConnectionManager()
+    conn = cm.create_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT Appointment_id, Patient_name FROM Appointments")
+        return [(row[0], row[1]) for row in cursor]
+    finally:
+        cm.close_connection()
+
+
+def login_as(patient=None, caregiver=None):
+    session = Scheduler.get_session()
+    session.patient = Patient(patient) if patient is not None else None
+    session.caregiver = Caregiver(caregiver) if caregiver is not None else None
+
+
+def date_token(d):
+    return d.strftime("%m-%d-%Y")
+
+
+def time_command(name, iterations, setup, run):
+    # setup(i) prepares the tokens of iteration i outside the timed region
+    samples = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for i in range(iterations):
+            tokens = setup(i)
+            start = time.perf_counter()
+            run(tokens)
+            samples.append(time.perf_counter() - start)
+    return summarize(name, samples)
+
+
+def percentile(ordered, p):
+    # nearest-rank percentile of an already sorted list
+    rank = math.ceil(p / 100.0 * len(ordered))
+    return ordered[max(rank, 1) - 1]
+
+
+def summarize(name, samples):
+    ordered = sorted(samples)
+    total = sum(samples)
+    return {
+        "command": name,
+        "iterations": len(samples),
+        "mean_ms": total / len(samples) * 1000,
+        "p50_ms": percentile(ordered, 50) * 1000,
+        "p95_ms": percentile(ordered, 95) * 1000,
+        "p99_ms": percentile(ordered, 99) * 1000,
+        "max_ms": ordered[-1] * 1000,
+        "ops_per_s": len(samples) / total if total > 0 else 0.0,
+    }
+
+
+def run_size(size_name, size, iterations, commands, rng):
+    path = os.path.join(tempfile.mkdtemp(prefix="scheduler-bench-"), "bench.db")
+    set_backend(SqliteBackend(path))
+    seed_start = time.perf_counter()
+    caregivers, patients, vaccines, days = seed(size, rng)
+    seed_time = time.perf_counter() - seed_start
+    ids = appointment_ids()
+    rng.shuffle(ids)
+
+    results = []
+    for command in commands:
+        if command == "create_patient":
+            login_as()
+            result = time_command(command, iterations, lambda i: ["create_patient", "newpatient%d" % i, PASSWORD],
+                                  Scheduler.create_patient)
+        elif command == "login_patient":
+            def setup(i):
+                login_as()
+                return ["login_patient", rng.choice(patients), PASSWORD]
+            result = time_command(command, iterations, setup, Scheduler.login_patient)
+        elif command == "search_caregiver_schedule":
+            login_as(patient=patients[0])
+            result = time_command(command, iterations, lambda i: ["search_caregiver_schedule", date_token(rng.choice(days))],
+                                  Scheduler.search_caregiver_schedule)
+        elif command == "reserve":
+            def setup(i):
+                login_as(patient=rng.choice(patients))
+                return ["reserve", date_token(rng.choice(days)), rng.choice(vaccines)]
+            result = time_command(command, iterations, setup, Scheduler.reserve)
+        elif command == "cancel":
+            def setup(i):
+                login_as(patient=ids[i][1])
+                return ["cancel", str(ids[i][0])]
+            result = time_command(command, min(iterations, len(ids)), setup, Scheduler.cancel)
+        elif command == "show_appointments":
+            def setup(i):
+                login_as(patient=rng.choice(patients))
+                return ["show_appointments"]
+            result = time_command(command, iterations, setup, Scheduler.show_appointments)
+        elif command == "add_doses":
+            login_as(caregiver=caregivers[0])
+            result = time_command(command, iterations, lambda i: ["add_doses", rng.choice(vaccines), "10"], Scheduler.add_doses)
+        result["size"] = size_name
+        results.append(result)
+    login_as()
+    return {"size": size_name, "data": size, "seed_s": seed_time, "results": results}
+
+
+def print_report(runs):
+    print(f"{'size':<8}{'command':<28}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>10}")
+    for run in runs:
+        for r in run["results"]:
+            print(f"{run['size']:<8}{r['command']:<28}{r['iterations']:>6}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}"
+                  f"{r['p99_ms']:>10.2f}{r['ops_per_s']:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the scheduler commands on synthetic data")
+    parser.add_argument("--sizes", default="small", help="comma-separated data sizes: " + ", ".join(SIZES))
+    parser.add_argument("--iterations", type=int, default=200, help="timed runs per command and size")
+    parser.add_argument("--commands", default=",".join(COMMANDS), help="comma-separated commands to time")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the synthetic data")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    for field in SIZES["small"]:
+        parser.add_argument("--" + field, type=int, help="override the number of " + field + " for every size")
+    args = parser.parse_args()
+
+    commands = args.commands.split(",")
+    for command in commands:
+        if command not in COMMANDS:
+            parser.error("unknown command " + command)
+    runs = []
+    for size_name in args.sizes.split(","):
+        if size_name not in SIZES:
+            parser.error("unknown size " + size_name)
+        size = dict(SIZES[size_name])
+        for field in size:
+            if getattr(args, field) is not None:
+                size[field] = getattr(args, field)
+        print(f"Running {size_name}: {size}", file=sys.stderr)
+        runs.append(run_size(size_name, size, args.iterations, commands, random.Random(args.seed)))
+
+    print_report(runs)
+    if args.output is not None:
+        report = {
+            "timestamp": datetime.datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "backend": "sqlite",
+            "hash_algorithm": Util.hash_algorithm(),
+            "hash_iterations": Util.hash_iterations(),
+            "iterations": args.iterations,
+            "runs": runs,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,87 @@
+import argparse
+import json
+import os
+import sys
+
+from db import Exporter
+from util.Util import Util
+
+
+'''
+Exports Appointments or Availabilities to a compressed file for analytics.
+
+    python Export.py appointments appointments.csv.gz
+    python Export.py availabilities availabilities.parquet --from 01-01-2025 --to 12-31-2025
+    python Export.py appointments new.parquet --state export_state.json
+
+Names ending in .parquet are written as Parquet (needs pyarrow), names ending in .csv.gz as gzip
+CSV; other names are refused unless --format is given. With --state, an appointments export starts
+after the highest Appointment_id the previous run with the same state file wrote, and records the
+new one once the file is complete, so a nightly run exports only the appointments booked since.
+Ids are leased before an appointment commits, so concurrent reservations commit out of id order;
+each run reads again the last --overlap ids below the watermark and skips those already exported.
+Rows are streamed --batch-size at a time.
+'''
+
+
+# (watermark, ids already exported within the overlap below it) from the state file; older state
+# files kept only the watermark, so the first run after one repeats the overlap
+def read_watermark(state_file, table):
+    if state_file is None or not os.path.exists(state_file):
+        return None, []
+    with open(state_file) as f:
+        entry = json.load(f).get(table)
+    if entry is None or isinstance(entry, int):
+        return entry, []
+    return entry["watermark"], entry["recent"]
+
+
+def write_watermark(state_file, table, watermark, recent):
+    state = {}
+    if os.path.exists(state_file):
+        with open(state_file) as f:
+            state = json.load(f)
+    state[table] = {"watermark": watermark, "recent": recent}
+    with open(state_file + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(state_file + ".tmp", state_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream a table to a gzip CSV or Parquet file")
+    parser.add_argument("table", choices=sorted(Exporter.TABLES))
+    parser.add_argument("output", help="file to write; .parquet for Parquet, .csv.gz for gzip CSV")
+    parser.add_argument("--format", choices=Exporter.FORMATS, help="override the format implied by the file name")
+    parser.add_argument("--from", dest="start", help="only rows dated on or after this date (mm-dd-yyyy)")
+    parser.add_argument("--to", dest="end", help="only rows dated on or before this date (mm-dd-yyyy)")
+    parser.add_argument("--after-id", type=int, help="only appointments with a greater Appointment_id")
+    parser.add_argument("--state", help="JSON file keeping the Appointment_id watermark between runs")
+    parser.add_argument("--overlap", type=int, default=10 * int(os.getenv("IdBlockSize", "100")),
+                        help="ids below the --state watermark read again for late commits (default 10 id blocks)")
+    parser.add_argument("--batch-size", type=int, default=10000, help="rows fetched and written at a time")
+    args = parser.parse_args()
+
+    if args.state is not None and args.table != "appointments":
+        parser.error("--state only applies to appointments")
+    try:
+        start = Util.parse_date(args.start) if args.start else None
+        end = Util.parse_date(args.end) if args.end else None
+    except ValueError:
+        parser.error("dates are mm-dd-yyyy")
+    if args.overlap < 0:
+        parser.error("--overlap cannot be negative")
+    if args.after_id is not None:
+        after, seen, overlap = args.after_id, [], 0
+    else:
+        after, seen = read_watermark(args.state, args.table)
+        overlap = args.overlap
+
+    try:
+        written, watermark, recent = Exporter.export(args.table, args.output, args.format or Exporter.format_for(args.output),
+                                                     start, end, after, args.batch_size, overlap, seen)
+    except ValueError as e:
+        print("Export failed:", e)
+        sys.exit(1)
+    if args.state is not None and watermark is not None:
+        write_watermark(args.state, args.table, watermark, recent)
+    print(f"Exported {written} rows to {args.output}" + (f", up to Appointment_id {watermark}" if watermark is not None else ""))
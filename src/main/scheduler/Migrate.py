@@ -0,0 +1,45 @@
+import argparse
+
+from db import Migrations
+
+
+'''
+Upgrades the scheduler database in place to the current schema.
+
+    python Migrate.py              apply every pending migration
+    python Migrate.py --to 3       apply the pending migrations up to version 3
+    python Migrate.py --status     list the migrations and when each was applied
+    python Migrate.py --explain    print the plan of each hot query before and after migrating
+
+The database is chosen with the same variables as the scheduler (DBBackend, DBFile, Server, ...).
+'''
+
+
+def print_plans(title):
+    print(title)
+    for name, plan in Migrations.explain_hot_queries():
+        print("  " + name)
+        for line in plan:
+            print("    " + line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply the pending schema migrations")
+    parser.add_argument("--to", type=int, help="stop after this version")
+    parser.add_argument("--status", action="store_true", help="list the migrations without applying any")
+    parser.add_argument("--explain", action="store_true", help="print the hot query plans before and after")
+    args = parser.parse_args()
+
+    if args.status:
+        for version, description, applied_on in Migrations.status():
+            print(str(version).rjust(4) + "  " + ("pending" if applied_on is None else str(applied_on)).ljust(10) + "  " + description)
+    else:
+        if args.explain:
+            print_plans("Before:")
+        applied = Migrations.migrate(args.to)
+        for version, description in applied:
+            print("Applied " + str(version) + ": " + description)
+        if len(applied) == 0:
+            print("Nothing to migrate")
+        if args.explain:
+            print_plans("After:")
@@ -1,20 +1,77 @@
 from model.Vaccine import Vaccine
 from model.Caregiver import Caregiver
 from model.Patient import Patient
+from model.Appointment import Appointment
+from model.Waitlist import Waitlist
 from util.Util import Util
+from util.Metrics import get_metrics
+from util.SessionStore import get_session_store
+from db.SqlProfiler import get_sql_profiler
 from db.ConnectionManager import ConnectionManager
-import pymssql
+from db.Backend import DatabaseError
+from db.AsyncExecutor import run_sync
+from db.ScheduleIndex import get_schedule_index
+from db.AvailabilityCalendar import get_availability_calendar
+from db.InventoryCache import get_inventory_cache
+from db.Summary import SummaryDelta, read_summary
+import argparse
+import contextlib
+import contextvars
+import csv
 import datetime
+import os
+import sys
+import time
 
 
 '''
 objects to keep track of the currently logged-in user
-Note: it is always true that at most one of currentCaregiver and currentPatient is not null
-        since only one user can be logged-in at a time
+Note: it is always true that at most one of session.caregiver and session.patient is not null
+        since only one user can be logged-in at a time per session
 '''
-current_patient = None
 
-current_caregiver = None
+
+class Session:
+    # login state of one user of the scheduler: the command line has a single session, the
+    # server keeps one per client connection
+    def __init__(self):
+        self.patient = None
+        self.caregiver = None
+        # token issued at login, so a client can resume the login on another connection
+        self.token = None
+
+
+# the session commands act on; unset means the command line's own session
+current_session = contextvars.ContextVar("current_session", default=None)
+_local_session = Session()
+
+
+def get_session():
+    session = current_session.get()
+    return session if session is not None else _local_session
+
+# labels for the per-command metrics; anything else is recorded as "invalid"
+COMMAND_NAMES = {"create_patient", "create_caregiver", "login_patient", "login_caregiver", "search_caregiver_schedule",
+                 "reserve", "upload_availability", "remove_availability", "cancel", "call_out", "add_doses",
+                 "show_appointments", "logout", "resume", "waitlist", "find_dates", "reserve_series", "report",
+                 "import_users", "metrics", "sql_profile", "quit"}
+
+# most doses reserve_series books at once
+MAX_SERIES_DOSES = 10
+
+# longest range report prints
+MAX_REPORT_DAYS = 366
+
+# commands that act as the logged-in user, run only while the session's token is valid
+SESSION_COMMANDS = {"search_caregiver_schedule", "reserve", "upload_availability", "remove_availability", "cancel",
+                    "call_out", "add_doses", "show_appointments", "waitlist", "find_dates", "reserve_series", "report"}
+
+sql_profiler = get_sql_profiler()
+
+metrics = get_metrics()
+metrics.describe("scheduler_command_duration_seconds", "Time to run one command")
+metrics.describe("scheduler_command_failures_total", "Commands that raised instead of completing")
+metrics.describe("scheduler_password_hash_duration_seconds", "Time to hash one password with PBKDF2")
 
 
 def create_patient(tokens):
@@ -32,15 +89,17 @@ def create_patient(tokens):
         return
 
     salt = Util.generate_salt()
-    hash = Util.generate_hash(password, salt)
+    algorithm = Util.hash_algorithm()
+    iterations = Util.hash_iterations()
+    hash = Util.generate_hash(password, salt, algorithm, iterations)
 
     # create the patient
-    patient = Patient(username, salt=salt, hash=hash)
+    patient = Patient(username, salt=salt, hash=hash, algorithm=algorithm, iterations=iterations)
 
     # save patient information to the database
     try:
         patient.save_to_db()
-    except pymssql.Error as e:
+    except DatabaseError as e:
         print("Failed to create user.")
         print("Db-Error:", e)
         quit()
@@ -62,7 +121,7 @@ def username_exists_patient(username):
         #  returns false if the cursor is not before the first record or if there are no rows in the ResultSet.
         for row in cursor:
             return row['Username'] is not None
-    except pymssql.Error as e:
+    except DatabaseError as e:
         print("Error occurred when checking username")
         print("Db-Error:", e)
         quit()
@@ -90,15 +149,17 @@ def create_caregiver(tokens):
         return
 
     salt = Util.generate_salt()
-    hash = Util.generate_hash(password, salt)
+    algorithm = Util.hash_algorithm()
+    iterations = Util.hash_iterations()
+    hash = Util.generate_hash(password, salt, algorithm, iterations)
 
     # create the caregiver
-    caregiver = Caregiver(username, salt=salt, hash=hash)
+    caregiver = Caregiver(username, salt=salt, hash=hash, algorithm=algorithm, iterations=iterations)
 
     # save to caregiver information to our database
     try:
         caregiver.save_to_db()
-    except pymssql.Error as e:
+    except DatabaseError as e:
         print("Failed to create user.")
         print("Db-Error:", e)
         quit()
@@ -120,7 +181,7 @@ def username_exists_caregiver(username):
         #  returns false if the cursor is not before the first record or if there are no rows in the ResultSet.
         for row in cursor:
             return row['Username'] is not None
-    except pymssql.Error as e:
+    except DatabaseError as e:
         print("Error occurred when checking username")
         print("Db-Error:", e)
         quit()
@@ -132,11 +193,108 @@ def username_exists_caregiver(username):
     return False
 
 
+# rows read from the import file before their usernames are checked, hashed and inserted together
+IMPORT_BATCH_SIZE = 500
+
+
+def import_users(tokens):
+    # import_users <csv file>
+    # Every line of the file is "role,username,password" with role either patient or caregiver;
+    # a header line starting with "role" is skipped. Usernames and passwords are lower-cased just
+    # like the ones typed at the prompt, so imported users can log in normally.
+    if len(tokens) != 2:
+        print("Please try again!")
+        return
+
+    path = tokens[1]
+    imported = {"patient": 0, "caregiver": 0}
+    rejected = []
+    seen = set()
+    rows = 0
+    start_time = time.perf_counter()
+    try:
+        with open(path, newline='') as f:
+            batch = []
+            for line_no, row in enumerate(csv.reader(f), start=1):
+                if line_no == 1 and len(row) > 0 and row[0].strip().lower() == "role":
+                    continue
+                rows += 1
+                if len(row) != 3:
+                    rejected.append((line_no, "expected role,username,password"))
+                    continue
+                role, username, password = (field.strip().lower() for field in row)
+                if role not in imported:
+                    rejected.append((line_no, "unknown role " + role))
+                    continue
+                if username == "" or password == "":
+                    rejected.append((line_no, "missing username or password"))
+                    continue
+                if (role, username) in seen:
+                    rejected.append((line_no, "duplicate username " + username + " in file"))
+                    continue
+                seen.add((role, username))
+                batch.append((line_no, role, username, password))
+                if len(batch) == IMPORT_BATCH_SIZE:
+                    import_batch(batch, imported, rejected)
+                    batch = []
+            if len(batch) > 0:
+                import_batch(batch, imported, rejected)
+    except OSError as e:
+        print("Failed to read", path)
+        print("Error:", e)
+        return
+    except DatabaseError as e:
+        print("Import stopped after a database error.")
+        print("Db-Error:", e)
+
+    elapsed = time.perf_counter() - start_time
+    total = imported["patient"] + imported["caregiver"]
+    print(f"Imported {total} of {rows} users ({imported['patient']} patients, {imported['caregiver']} caregivers) "
+          f"in {elapsed:.2f}s, {rows / elapsed if elapsed > 0 else 0:.0f} rows/s")
+    if len(rejected) > 0:
+        print("Rejected rows:")
+        for line_no, reason in rejected:
+            print(f"line {line_no}: {reason}")
+
+
+def import_batch(batch, imported, rejected):
+    for role, cls in (("patient", Patient), ("caregiver", Caregiver)):
+        rows = [row for row in batch if row[1] == role]
+        if len(rows) == 0:
+            continue
+
+        taken = cls.existing_usernames(row[2] for row in rows)
+        for line_no, _, username, _ in rows:
+            if username in taken:
+                rejected.append((line_no, "username " + username + " taken"))
+        rows = [row for row in rows if row[2] not in taken]
+
+        # hash the whole batch at once in the worker pool
+        algorithm = Util.hash_algorithm()
+        iterations = Util.hash_iterations()
+        salts = [Util.generate_salt() for _ in rows]
+        futures = [Util.submit_hash(row[3], salt, algorithm, iterations) for row, salt in zip(rows, salts)]
+        users = [cls(row[2], salt=salt, hash=future.result(), algorithm=algorithm, iterations=iterations)
+                 for row, salt, future in zip(rows, salts, futures)]
+
+        try:
+            cls.save_many(users)
+            imported[role] += len(users)
+        except DatabaseError:
+            # someone took one of the names since we checked; insert one by one to find out which
+            for (line_no, _, username, _), user in zip(rows, users):
+                try:
+                    user.save_to_db()
+                    imported[role] += 1
+                except DatabaseError as e:
+                    rejected.append((line_no, "could not insert " + username + ": " + str(e)))
+
+
 def login_patient(tokens):
     # login_patient <username> <password>
     # check 1: if someone's already logged-in, they need to log out first
-    global current_patient
-    if current_patient is not None or current_caregiver is not None:
+    session = get_session()
+    if session.patient is not None or session.caregiver is not None:
         print("User already logged in.")
         return
 
@@ -151,7 +309,7 @@ def login_patient(tokens):
     patient = None
     try:
         patient = Patient(username, password=password).get()
-    except pymssql.Error as e:
+    except DatabaseError as e:
         print("Login failed.")
         print("Db-Error:", e)
         quit()
@@ -165,14 +323,29 @@ def login_patient(tokens):
         print("Login failed.")
     else:
         print("Logged in as: " + username)
-        current_patient = patient
+        session.patient = patient
+        session.token = get_session_store().issue(patient)
+        print("Session token: " + session.token)
+        print_notifications(username)
+
+
+def print_notifications(username):
+    # appointments booked from the waitlist since the patient last logged in
+    try:
+        notifications = Waitlist.take_notifications(username)
+    except DatabaseError as e:
+        print("Db-Error:", e)
+        return
+    for appointment_id, d, vaccine_name, caregiver_name in notifications:
+        print(f"Booked from the waitlist: Appointment ID: {appointment_id}, {vaccine_name} on {d.strftime('%m-%d-%Y')}, "
+              f"Caregiver username: {caregiver_name}")
 
 
 def login_caregiver(tokens):
     # login_caregiver <username> <password>
     # check 1: if someone's already logged-in, they need to log out first
-    global current_caregiver
-    if current_caregiver is not None or current_patient is not None:
+    session = get_session()
+    if session.caregiver is not None or session.patient is not None:
         print("User already logged in.")
         return
 
@@ -187,7 +360,7 @@ def login_caregiver(tokens):
     caregiver = None
     try:
         caregiver = Caregiver(username, password=password).get()
-    except pymssql.Error as e:
+    except DatabaseError as e:
         print("Login failed.")
         print("Db-Error:", e)
         quit()
@@ -201,52 +374,151 @@ def login_caregiver(tokens):
         print("Login failed.")
     else:
         print("Logged in as: " + username)
-        current_caregiver = caregiver
+        session.caregiver = caregiver
+        session.token = get_session_store().issue(caregiver)
+        print("Session token: " + session.token)
+
+
+def resume(tokens):
+    # resume <session token>
+    # Logs in with the token printed by login_patient or login_caregiver, checked in memory
+    # without reading the user or hashing the password again.
+    session = get_session()
+    if session.caregiver is not None or session.patient is not None:
+        print("User already logged in.")
+        return
+
+    if len(tokens) != 2:
+        print("Please try again!")
+        return
+
+    user = get_session_store().resume(tokens[1])
+    if user is None:
+        print("Session expired or invalid, please login again.")
+        return
+    if isinstance(user, Patient):
+        session.patient = user
+    else:
+        session.caregiver = user
+    session.token = tokens[1]
+    print("Logged in as: " + user.get_username())
 
 
 def search_caregiver_schedule(tokens):
     # search_caregiver_schedule <date>
+    # search_caregiver_schedule <start_date> <end_date> [count]
 
     # Output the username for the caregivers that are available for the date, along with the number of available doses 
     # left for each vaccine. Order by the username of the caregiver. Separate each attribute with a space.
+    # Given a date range, output the available caregivers (or with "count" just how many there are) for every
+    # date in the range, all fetched with a single query.
 
     # check 1: if no user is logged in, print "Please login first!"
     # both caregiver and patient can search for caregiver schedules
 
-    global current_caregiver
-    global current_patient
+    session = get_session()
 
-    if current_caregiver is None and current_patient is None:
+    if session.caregiver is None and session.patient is None:
         print("Please login first!")
         return
 
-    # check 2: the length for tokens need to be exactly 2 to include all information (with the operation name)
-    if len(tokens) != 2:
+    # check 2: a single date, or a date range optionally followed by "count"
+    count_only = len(tokens) == 4 and tokens[3] == "count"
+    if len(tokens) not in (2, 3) and not count_only:
         print("Please try again!")
         return
 
-    cm = ConnectionManager()
-    conn = cm.create_connection()
-    date = tokens[1]
-    select_caregiver = "SELECT * FROM Caregivers WHERE Username NOT IN (SELECT Caregiver_name FROM Availabilities WHERE Date = %s) ORDER BY Username ASC"
-    cursor = conn.cursor(as_dict=True)
-    cursor.execute(select_caregiver, date)
-    caregivers = cursor.fetchall()
-    if len(caregivers) == 0:
-        print("No Caregiver is available on {}!".format(date))
-    else: 
+    try:
+        dates = parse_date_range(tokens[1:3])
+    except ValueError:
+        print("Please enter a valid date!")
+        return
+
+    try:
+        calendar = get_availability_calendar()
+        if count_only and calendar.covers(dates[0], dates[-1]):
+            # counts over a range come straight from the calendar's bit matrix
+            counts = calendar.free_counts(dates[0], dates[-1])
+            schedule = {d: counts[(d - dates[0]).days] for d in dates}
+            vaccines = Vaccine.all()
+        else:
+            # the caregivers and the dose counts are independent, so they are fetched concurrently
+            schedule, vaccines = run_sync(Caregiver.search_schedule_async(dates, count_only))
+    except DatabaseError as e:
+        print("Please try again!")
+        print("Db-Error:", e)
+        return
+
+    if len(tokens) == 2:
+        caregivers = schedule[dates[0]]
+        if len(caregivers) == 0:
+            print("No Caregiver is available on {}!".format(tokens[1]))
+        else: 
+            print("Available caregivers:")
+            for username in caregivers:
+                print(username)
+    else:
         print("Available caregivers:")
-        for row in caregivers:
-            print(row['Username'])
+        for d in dates:
+            if count_only:
+                print(d.strftime("%m-%d-%Y"), schedule[d])
+            elif len(schedule[d]) == 0:
+                print(d.strftime("%m-%d-%Y"), "none")
+            else:
+                print(d.strftime("%m-%d-%Y"), " ".join(schedule[d]))
     print("######################")
-    select_vaccine = "SELECT * FROM Vaccines ORDER BY Name ASC"
-    cursor.execute(select_vaccine)
     print("Available vaccines in doses:")
-    for row in cursor:
-        print(row['Name'], row['Doses'])
+    for name, doses in vaccines:
+        print(name, doses)
     return
 
 
+def find_dates(tokens):
+    # find_dates <start_date> <end_date> <min_free> [limit]
+    # Print the dates in the range with at least min_free caregivers free, and how many are free,
+    # at most limit of them. Answered from the availability calendar, which covers the next
+    # CalendarDays days.
+    session = get_session()
+    if session.caregiver is None and session.patient is None:
+        print("Please login first!")
+        return
+
+    if len(tokens) not in (4, 5):
+        print("Please try again!")
+        return
+
+    try:
+        start = Util.parse_date(tokens[1])
+        end = Util.parse_date(tokens[2])
+    except ValueError:
+        print("Please enter a valid date!")
+        return
+    try:
+        min_free = int(tokens[3])
+        limit = int(tokens[4]) if len(tokens) == 5 else None
+    except ValueError:
+        print("Please try again!")
+        return
+
+    calendar = get_availability_calendar()
+    try:
+        first, last = calendar.span()
+        if not calendar.covers(start, end) or start > end:
+            print(f"Please enter dates from {first.strftime('%m-%d-%Y')} to {last.strftime('%m-%d-%Y')}!")
+            return
+        found = calendar.available_dates(start, end, min_free, limit)
+    except DatabaseError as e:
+        print("Please try again!")
+        print("Db-Error:", e)
+        return
+
+    if len(found) == 0:
+        print(f"No dates with {min_free} free caregivers!")
+        return
+    for d, free in found:
+        print(d.strftime("%m-%d-%Y"), free)
+
+
 def reserve(tokens):
     # reserve <date> <vaccine>
     
@@ -257,14 +529,13 @@ def reserve(tokens):
     # If no user is logged in, print “Please login first!”. If the current user logged in is not a patient, print “Please login as a patient!”.
     # For all other errors, print "Please try again!".
     
-    global current_patient
-    global current_caregiver
+    session = get_session()
     
-    if current_caregiver is None and current_patient is None:
+    if session.caregiver is None and session.patient is None:
         print("Please login first!")
         return
 
-    if current_patient is None:
+    if session.patient is None:
         print("Please login as a patient!")
         return
     
@@ -272,68 +543,124 @@ def reserve(tokens):
         print("Please try again!")
         return
     
-    date = tokens[1]
+    try:
+        date = Util.parse_date(tokens[1])
+    except ValueError:
+        print("Please enter a valid date!")
+        return
     vaccine = tokens[2]
     
-    cm = ConnectionManager()
-    conn = cm.create_connection()
-    
-    # Check if there are available caregivers for the given date
-    select_caregiver = "SELECT * FROM Caregivers WHERE Username NOT IN (SELECT Caregiver_name FROM Availabilities WHERE Date = %s) ORDER BY Username ASC"
-    cursor = conn.cursor(as_dict=True)
-    cursor.execute(select_caregiver, date)
-    caregivers = cursor.fetchall()
-    
-    if len(caregivers) == 0:
+    # Pick the caregiver, take the dose and book the appointment in one transaction
+    appointment = Appointment(None, date, session.patient.username, vaccine_name=vaccine)
+    try:
+        status = appointment.reserve()
+    except DatabaseError as e:
+        print("Please try again!")
+        print("Db-Error:", e)
+        return
+    except Exception as e:
+        print("Please try again!")
+        print("Error:", e)
+        return
+
+    if status == Appointment.NO_CAREGIVER:
         print("No Caregiver is available!")
         return
-    
-    # Check if there are enough vaccine doses available
-    select_vaccine = "SELECT * FROM Vaccines WHERE Name = %s"
-    cursor.execute(select_vaccine, vaccine)
-    vaccine_info = cursor.fetchone()
-    
-    if vaccine_info['Doses'] == 0:
+
+    if status == Appointment.NO_DOSES:
         print("Not enough available doses!")
         return
-    
-    # Reserve the appointment
-    caregiver_username = caregivers[0]['Username']
-    appointment_id = str(int(int(datetime.datetime.now().timestamp()*1e6)%1e8)).zfill(8)
-    
-    insert_appointment = "INSERT INTO Appointments (Appointment_id, Date, Patient_name, Caregiver_name, Vaccine_name) VALUES (%s, %s, %s, %s, %s)"
-    cursor.execute(insert_appointment, (appointment_id, date, current_patient.username, caregiver_username, vaccine))
-    conn.commit()
-    
-    Caregiver(caregiver_username).upload_availability(date)
-    Vaccine(vaccine, vaccine_info['Doses']).decrease_available_doses(1)
-    
-    print(f"Appointment ID: {appointment_id}, Caregiver username: {caregiver_username}")
+
+    print(f"Appointment ID: {appointment.get_appointment_id()}, Caregiver username: {appointment.get_caregiver_name()}")
+
+
+def reserve_series(tokens):
+    # reserve_series <start_date> <vaccine> <doses> <interval_days>
+    # Reserve every dose of a multi-dose vaccine, interval_days apart, on the earliest dates from
+    # start_date on where each dose has a free caregiver. All doses are booked or none are.
+    session = get_session()
+    if session.caregiver is None and session.patient is None:
+        print("Please login first!")
+        return
+
+    if session.patient is None:
+        print("Please login as a patient!")
+        return
+
+    if len(tokens) != 5:
+        print("Please try again!")
+        return
+
+    try:
+        start = Util.parse_date(tokens[1])
+    except ValueError:
+        print("Please enter a valid date!")
+        return
+    vaccine = tokens[2]
+    try:
+        doses = int(tokens[3])
+        interval = int(tokens[4])
+    except ValueError:
+        print("Please try again!")
+        return
+    if doses < 1 or doses > MAX_SERIES_DOSES or interval < 1:
+        print(f"Please enter 1 to {MAX_SERIES_DOSES} doses at least one day apart!")
+        return
+
+    try:
+        status, appointments = Appointment.reserve_series(session.patient.username, start, vaccine, doses, interval)
+    except DatabaseError as e:
+        print("Please try again!")
+        print("Db-Error:", e)
+        return
+    except ValueError:
+        # the start date is outside the availability calendar
+        first, last = get_availability_calendar().span()
+        print(f"Please enter a start date from {first.strftime('%m-%d-%Y')} to {last.strftime('%m-%d-%Y')}!")
+        return
+
+    if status == Appointment.NO_CAREGIVER:
+        print("No Caregiver is available!")
+        return
+
+    if status == Appointment.NO_DOSES:
+        print("Not enough available doses!")
+        return
+
+    for appointment in appointments:
+        print(f"Appointment ID: {appointment.get_appointment_id()}, Caregiver username: {appointment.get_caregiver_name()}, "
+              f"Date: {appointment.date.strftime('%m-%d-%Y')}")
+
+
+def parse_date_range(tokens):
+    # <date> | <start_date> <end_date> [daily|weekdays|weekends|mon,wed,...]
+    start = Util.parse_date(tokens[0])
+    if len(tokens) == 1:
+        return [start]
+    end = Util.parse_date(tokens[1])
+    rule = tokens[2] if len(tokens) == 3 else "daily"
+    return Util.expand_dates(start, end, rule)
 
 
 def upload_availability(tokens):
     #  upload_availability <date>
+    #  upload_availability <start_date> <end_date> [daily|weekdays|weekends|mon,wed,...]
     #  check 1: check if the current logged-in user is a caregiver
-    global current_caregiver
-    if current_caregiver is None:
+    session = get_session()
+    if session.caregiver is None:
         print("Please login as a caregiver first!")
         return
 
-    # check 2: the length for tokens need to be exactly 2 to include all information (with the operation name)
-    if len(tokens) != 2:
+    # check 2: a single date, or a date range with an optional recurrence rule
+    if len(tokens) < 2 or len(tokens) > 4:
         print("Please try again!")
         return
 
-    date = tokens[1]
-    # assume input is hyphenated in the format mm-dd-yyyy
-    date_tokens = date.split("-")
-    month = int(date_tokens[0])
-    day = int(date_tokens[1])
-    year = int(date_tokens[2])
     try:
-        d = datetime.datetime(year, month, day)
-        current_caregiver.upload_availability(d)
-    except pymssql.Error as e:
+        dates = parse_date_range(tokens[1:])
+        # every date goes in with one transaction; dates already uploaded are skipped
+        uploaded = session.caregiver.upload_availabilities(dates)
+    except DatabaseError as e:
         print("Upload Availability Failed")
         print("Db-Error:", e)
         quit()
@@ -344,9 +671,43 @@ def upload_availability(tokens):
         print("Error occurred when uploading availability")
         print("Error:", e)
         return
+    if len(tokens) > 2:
+        print(f"Uploaded {uploaded} of {len(dates)} dates, {len(dates) - uploaded} were already uploaded.")
     print("Availability uploaded!")
 
 
+def remove_availability(tokens):
+    #  remove_availability <date>
+    #  remove_availability <start_date> <end_date> [daily|weekdays|weekends|mon,wed,...]
+    #  dates that already have an appointment stay in place
+    session = get_session()
+    if session.caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    if len(tokens) < 2 or len(tokens) > 4:
+        print("Please try again!")
+        return
+
+    try:
+        dates = parse_date_range(tokens[1:])
+        removed = session.caregiver.remove_availabilities(dates)
+    except DatabaseError as e:
+        print("Remove Availability Failed")
+        print("Db-Error:", e)
+        quit()
+    except ValueError:
+        print("Please enter a valid date!")
+        return
+    except Exception as e:
+        print("Error occurred when removing availability")
+        print("Error:", e)
+        return
+    print(f"Removed availability for {removed} of {len(dates)} dates.")
+    if removed > 0:
+        allocate_waitlist(dates[0], dates[-1])
+
+
 def cancel(tokens):
     # cancel <appointment_id>
     
@@ -356,10 +717,9 @@ def cancel(tokens):
     # If no user is logged in, print "Please login first!".
     # For all other errors, print "Please try again!".
     
-    global current_caregiver
-    global current_patient
+    session = get_session()
 
-    if current_caregiver is None and current_patient is None:
+    if session.caregiver is None and session.patient is None:
         print("Please login first!")
         return
 
@@ -367,36 +727,158 @@ def cancel(tokens):
         print("Please try again!")
         return
 
-    appointment_id = tokens[1]
+    try:
+        appointment_id = int(tokens[1])
+    except ValueError:
+        print("Please try again!")
+        return
+    # users can only cancel their own appointments
+    if session.caregiver is None:
+        owner_column, owner = "Patient_name", session.patient.username
+    else:
+        owner_column, owner = "Caregiver_name", session.caregiver.username
+
     cm = ConnectionManager()
     conn = cm.create_connection()
     cursor = conn.cursor()
 
-    # add one dose back to the vaccine
-    select_appointment = "SELECT * FROM Appointments WHERE Appointment_id = %s"
-    cursor.execute(select_appointment, appointment_id)
-    vaccine_name = cursor.fetchone()[-1]
-    select_vaccine = "SELECT * FROM Vaccines WHERE Name = %s"
-    cursor.execute(select_vaccine, vaccine_name)
-    vaccine_info = cursor.fetchone()
-    Vaccine(vaccine_name, vaccine_info[-1]).increase_available_doses(1)
-
-    delete_availability = "DELETE FROM Availabilities WHERE Date = (SELECT Date FROM Appointments WHERE Appointment_id = %s)"
-    cursor.execute(delete_availability, appointment_id)
-    delete_appointment = "DELETE FROM Appointments WHERE Appointment_id = %s"
-    cursor.execute(delete_appointment, appointment_id)
-    
-    conn.commit()
-    
+    try:
+        select_appointment = "SELECT Date, Caregiver_name, Vaccine_name FROM Appointments WHERE Appointment_id = %d AND " + \
+                             owner_column + " = %s"
+        cursor.execute(select_appointment, (appointment_id, owner))
+        row = cursor.fetchone()
+        if row is None:
+            print("Please try again!")
+            return
+        date, caregiver_name, vaccine_name = row[0], row[1], row[2]
+        # deleted first: a concurrent cancel of the same appointment finds nothing to delete and
+        # stops before it returns the dose a second time
+        delete_appointment = "DELETE FROM Appointments WHERE Appointment_id = %d AND " + owner_column + " = %s"
+        cursor.execute(delete_appointment, (appointment_id, owner))
+        if cursor.rowcount == 0:
+            conn.rollback()
+            print("Please try again!")
+            return
+        # the dose goes back in the same transaction; the increment is relative to the stored count
+        return_dose = "UPDATE Vaccines SET Doses = Doses + 1 WHERE Name = %s"
+        cursor.execute(return_dose, vaccine_name)
+
+        # only the appointment's own caregiver is freed, not everyone booked that day
+        delete_availability = "DELETE FROM Availabilities WHERE Date = %s AND Caregiver_name = %s"
+        cursor.execute(delete_availability, (date, caregiver_name))
+        summary = SummaryDelta()
+        summary.canceled(date, vaccine_name)
+        summary.write(cm.backend, cursor)
+        conn.commit()
+    except DatabaseError as e:
+        conn.rollback()
+        print("Please try again!")
+        print("Db-Error:", e)
+        return
+    finally:
+        cm.close_connection()
+    get_inventory_cache().invalidate()
+    get_schedule_index().canceled(date, caregiver_name)
+    get_availability_calendar().mark_free([date], caregiver_name)
+
     print("Appointment canceled!")
-    return
+    # the caregiver and the dose are free again for whoever waits for that date
+    allocate_waitlist(date, date)
+
+
+def call_out(tokens):
+    # call_out <date> | <start_date> <end_date>
+    # The logged-in caregiver cannot work these days. Each of their appointments on them is moved
+    # to another caregiver free that day, or canceled when nobody is; the days are blocked.
+    session = get_session()
+    if session.caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    if len(tokens) not in (2, 3):
+        print("Please try again!")
+        return
+
+    try:
+        start = Util.parse_date(tokens[1])
+        end = Util.parse_date(tokens[2]) if len(tokens) == 3 else start
+    except ValueError:
+        print("Please enter a valid date!")
+        return
+    if end < start:
+        print("Please enter a valid date!")
+        return
+
+    try:
+        moved, canceled, blocked = session.caregiver.call_out(start, end)
+    except DatabaseError as e:
+        print("Please try again!")
+        print("Db-Error:", e)
+        return
+
+    for appointment_id, d, caregiver in moved:
+        print(f"Appointment ID: {appointment_id} on {d.strftime('%m-%d-%Y')} moved to Caregiver username: {caregiver}")
+    for appointment_id, d in canceled:
+        print(f"Appointment ID: {appointment_id} on {d.strftime('%m-%d-%Y')} canceled, no caregiver is available")
+    print(f"Moved {len(moved)} and canceled {len(canceled)} of {len(moved) + len(canceled)} appointments, "
+          f"blocked {blocked} more days.")
+    if len(canceled) > 0:
+        # the returned doses may serve patients waiting for other dates
+        allocate_waitlist()
+
+
+def report(tokens):
+    # report <date> | <start_date> <end_date>
+    # Appointments, cancellations, blocked caregivers, caregiver utilization and doses used and
+    # added for each day, read from the summary tables rather than counted from the live tables.
+    # Utilization is the share of the caregivers not blocked that day who have an appointment.
+    session = get_session()
+    if session.caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    if len(tokens) not in (2, 3):
+        print("Please try again!")
+        return
+
+    try:
+        start = Util.parse_date(tokens[1])
+        end = Util.parse_date(tokens[2]) if len(tokens) == 3 else start
+    except ValueError:
+        print("Please enter a valid date!")
+        return
+    if end < start or (end - start).days >= MAX_REPORT_DAYS:
+        print(f"Please enter a range of 1 to {MAX_REPORT_DAYS} days!")
+        return
+
+    try:
+        daily, vaccines, caregivers = read_summary(start, end)
+    except DatabaseError as e:
+        print("Please try again!")
+        print("Db-Error:", e)
+        return
+
+    days = {d: (appointments, cancellations, blocked) for d, appointments, cancellations, blocked in daily}
+    doses = {}
+    for d, vaccine_name, consumed, added in vaccines:
+        doses.setdefault(d, []).append((vaccine_name, consumed, added))
+    print("Date | Appointments | Cancellations | Blocked | Utilization")
+    d = start
+    while d <= end:
+        appointments, cancellations, blocked = days.get(d, (0, 0, 0))
+        working = caregivers - blocked
+        utilization = f"{100 * appointments / working:.1f}%" if working > 0 else "-"
+        print(f"{d.strftime('%m-%d-%Y')} {appointments} {cancellations} {blocked} {utilization}")
+        for vaccine_name, consumed, added in doses.get(d, []):
+            print(f"    {vaccine_name}: {consumed} doses used, {added} added")
+        d += datetime.timedelta(days=1)
 
 
 def add_doses(tokens):
     #  add_doses <vaccine> <number>
     #  check 1: check if the current logged-in user is a caregiver
-    global current_caregiver
-    if current_caregiver is None:
+    session = get_session()
+    if session.caregiver is None:
         print("Please login as a caregiver first!")
         return
 
@@ -410,7 +892,7 @@ def add_doses(tokens):
     vaccine = None
     try:
         vaccine = Vaccine(vaccine_name, doses).get()
-    except pymssql.Error as e:
+    except DatabaseError as e:
         print("Error occurred when adding doses")
         print("Db-Error:", e)
         quit()
@@ -425,7 +907,7 @@ def add_doses(tokens):
         vaccine = Vaccine(vaccine_name, doses)
         try:
             vaccine.save_to_db()
-        except pymssql.Error as e:
+        except DatabaseError as e:
             print("Error occurred when adding doses")
             print("Db-Error:", e)
             quit()
@@ -437,7 +919,7 @@ def add_doses(tokens):
         # if the vaccine is not null, meaning that the vaccine already exists in our table
         try:
             vaccine.increase_available_doses(doses)
-        except pymssql.Error as e:
+        except DatabaseError as e:
             print("Error occurred when adding doses")
             print("Db-Error:", e)
             quit()
@@ -446,67 +928,163 @@ def add_doses(tokens):
             print("Error:", e)
             return
     print("Doses updated!")
+    allocate_waitlist(vaccine=vaccine_name)
+
+
+def waitlist(tokens):
+    # waitlist                                     (patients: the dates and vaccines you wait for)
+    # waitlist <date> <vaccine>                    (patients: wait for a caregiver and a dose)
+    # waitlist                                     (caregivers: waiting patients per date and vaccine)
+    # waitlist <date> <vaccine> <patient> <priority>   (caregivers: add a patient, higher priority first)
+    session = get_session()
+    if session.caregiver is None and session.patient is None:
+        print("Please login first!")
+        return
+
+    if len(tokens) == 1:
+        try:
+            if session.patient is not None:
+                entries = Waitlist.entries_for(session.patient.username)
+            else:
+                entries = Waitlist.demand()
+        except DatabaseError as e:
+            print("Please try again!")
+            print("Db-Error:", e)
+            return
+        if len(entries) == 0:
+            print("No one is waiting!" if session.caregiver is not None else "You are not on the waitlist!")
+        for d, vaccine_name, value in entries:
+            if session.patient is not None:
+                print(d.strftime("%m-%d-%Y"), vaccine_name)
+            else:
+                print(d.strftime("%m-%d-%Y"), vaccine_name, value)
+        return
+
+    if session.patient is not None and len(tokens) == 3:
+        patient_name, priority = session.patient.username, 0
+    elif session.caregiver is not None and len(tokens) == 5:
+        patient_name = tokens[3]
+        try:
+            priority = int(tokens[4])
+        except ValueError:
+            print("Please try again!")
+            return
+    else:
+        print("Please try again!")
+        return
+
+    try:
+        date = Util.parse_date(tokens[1])
+    except ValueError:
+        print("Please enter a valid date!")
+        return
+
+    entry = Waitlist(None, date, patient_name, tokens[2], priority)
+    try:
+        if session.caregiver is not None and len(Patient.existing_usernames([patient_name])) == 0:
+            print("No such patient!")
+            return
+        if entry.exists():
+            print("Already on the waitlist!")
+            return
+        entry.save_to_db()
+    except DatabaseError as e:
+        print("Please try again!")
+        print("Db-Error:", e)
+        return
+    print("Added to the waitlist!")
+    # capacity may be there already, e.g. freed while the patient was deciding
+    allocate_waitlist(date, date, tokens[2])
+
+
+def allocate_waitlist(start=None, end=None, vaccine=None):
+    # books waiting patients on capacity that was just added; the command itself already succeeded
+    try:
+        booked = Waitlist.allocate(start, end, vaccine)
+    except DatabaseError as e:
+        print("Waitlist allocation failed, it will run again when capacity is added.")
+        print("Db-Error:", e)
+        return
+    if len(booked) > 0:
+        print(f"Booked {len(booked)} waiting patients from the waitlist!")
 
 
 def show_appointments(tokens):
-    # show_appointments
+    # show_appointments [from=<date>] [to=<date>] [vaccine=<name>] [after=<appointment_id>] [page=<size>]
 
     # Output the scheduled appointments for the current user (both patients and caregivers). 
     # For caregivers, you should print the appointment ID, vaccine name, date, and patient name. Order by the appointment ID. Separate each attribute with a space.
     # For patients, you should print the appointment ID, vaccine name, date, and caregiver name. Order by the appointment ID. Separate each attribute with a space.
     # If no user is logged in, print “Please login first!”.
     # For all other errors, print "Please try again!".
+    # At most page appointments are printed (AppointmentPageSize by default); when there are more,
+    # the command for the next page is printed last. Rows are streamed, not loaded all at once.
     
-    global current_caregiver
-    global current_patient
+    session = get_session()
 
-    if current_caregiver is None and current_patient is None:
+    if session.caregiver is None and session.patient is None:
         print("Please login first!")
         return
-    
-    if len(tokens) != 1:
+
+    options = {}
+    for token in tokens[1:]:
+        name, sep, value = token.partition("=")
+        if sep == "" or name not in ("from", "to", "vaccine", "after", "page") or name in options or value == "":
+            print("Please try again!")
+            return
+        options[name] = value
+    try:
+        start = Util.parse_date(options["from"]) if "from" in options else None
+        end = Util.parse_date(options["to"]) if "to" in options else None
+    except ValueError:
+        print("Please enter a valid date!")
+        return
+    try:
+        after = int(options["after"]) if "after" in options else None
+        page = int(options.get("page", os.getenv("AppointmentPageSize", "50")))
+    except ValueError:
+        print("Please try again!")
+        return
+    if page < 1:
         print("Please try again!")
         return
 
-    if current_caregiver is None:
-        # Show appointments for patients
-        select_appointments = "SELECT * FROM Appointments WHERE Patient_name = %s ORDER BY Appointment_id ASC"
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor(as_dict=True)
-        cursor.execute(select_appointments, current_patient.username)
-        appointments = cursor.fetchall()
-        if len(appointments) == 0:
-            print("No appointments found!")
-            return
-        else:
-            print("Appointment ID | Vaccine Name | Date | Caregiver Name")
-            for row in appointments:
-                print(f"{row['Appointment_id']} {row['Vaccine_name']} {row['Date']} {row['Caregiver_name']}")
+    if session.caregiver is None:
+        role, username, other = "patient", session.patient.username, "Caregiver Name"
     else:
-        # Show appointments for caregivers
-        select_appointments = "SELECT * FROM Appointments WHERE Caregiver_name = %s ORDER BY Appointment_id ASC"
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor(as_dict=True)
-        cursor.execute(select_appointments, current_caregiver.username)
-        appointments = cursor.fetchall()
-        if len(appointments) == 0:
-            print("No appointments found!")
-            return
-        else:
-            print("Appointment ID | Vaccine Name | Date | Patient Name")
-            for row in appointments:
-                print(f"{row['Appointment_id']} {row['Vaccine_name']} {row['Date']} {row['Patient_name']}")
+        role, username, other = "caregiver", session.caregiver.username, "Patient Name"
+    # one row past the page tells whether there is a next one
+    appointments = Appointment.appointments_for(role, username, start, end, options.get("vaccine"), after, page + 1)
+    shown = 0
+    last = None
+    try:
+        for appointment in appointments:
+            if shown == page:
+                next_page = ["show_appointments"] + [name + "=" + value for name, value in options.items() if name != "after"]
+                print("More appointments: " + " ".join(next_page + ["after=" + str(last)]))
+                break
+            if shown == 0:
+                print("Appointment ID | Vaccine Name | Date | " + other)
+            name = appointment.caregiver_name if role == "patient" else appointment.patient_name
+            print(f"{appointment.appointment_id} {appointment.vaccine_name} {appointment.date} {name}")
+            shown += 1
+            last = appointment.appointment_id
+    except DatabaseError as e:
+        print("Please try again!")
+        print("Db-Error:", e)
+        return
+    finally:
+        appointments.close()
+    if shown == 0:
+        print("No appointments found!")
 
 
 def logout(tokens):
     # logout
 
-    global current_caregiver
-    global current_patient
+    session = get_session()
 
-    if current_caregiver is None and current_patient is None:
+    if session.caregiver is None and session.patient is None:
         print("Please login first.")
         return
 
@@ -514,11 +1092,48 @@ def logout(tokens):
         print("Please try again!")
         return
 
-    current_caregiver = None
-    current_patient = None
+    if session.token is not None:
+        get_session_store().revoke(session.token)
+    session.caregiver = None
+    session.patient = None
+    session.token = None
     print("Successfully logged out!")
 
 
+def show_metrics(tokens):
+    # metrics
+    # Print latency histograms and counters for commands, SQL statements, hashing and the
+    # connection pool in the Prometheus text format.
+    if len(tokens) != 1:
+        print("Please try again!")
+        return
+    print(metrics.render(), end='')
+
+
+def show_sql_profile(tokens):
+    # sql_profile [reset]
+    # Print how many statements (round trips) each command issued on average, and for every
+    # statement how often it ran, the rows it returned and the time spent executing and fetching.
+    if len(tokens) == 2 and tokens[1] == "reset":
+        sql_profiler.reset()
+        print("SQL profile reset!")
+        return
+    if len(tokens) != 1:
+        print("Please try again!")
+        return
+
+    summary = sql_profiler.summary()
+    if len(summary) == 0:
+        print("No statements recorded yet!")
+        return
+    for command, calls, statements in summary:
+        total = sum(s[1] for s in statements)
+        per_call = f"{total / calls:.1f} round trips per call" if calls > 0 else "outside any command"
+        print(f"{command}: {calls} calls, {total} statements, {per_call}")
+        for statement, count, rows, execute_time, fetch_time in statements:
+            print(f"    {statement:<44}{count:>8} x{rows:>10} rows{execute_time * 1000:>10.1f} ms exec{fetch_time * 1000:>10.1f} ms fetch")
+
+
 def start():
     stop = False
     print()
@@ -527,13 +1142,23 @@ def start():
     print("> create_caregiver <username> <password>")
     print("> login_patient <username> <password>")  # // TODO: implement login_patient (Part 1)
     print("> login_caregiver <username> <password>")
-    print("> search_caregiver_schedule <date>")  # // TODO: implement search_caregiver_schedule (Part 2)
+    print("> search_caregiver_schedule <date> | <start_date> <end_date> [count]")  # // TODO: implement search_caregiver_schedule (Part 2)
+    print("> find_dates <start_date> <end_date> <min_free> [limit]")
     print("> reserve <date> <vaccine>")  # // TODO: implement reserve (Part 2)
-    print("> upload_availability <date>")
+    print("> reserve_series <start_date> <vaccine> <doses> <interval_days>")
+    print("> upload_availability <date> | <start_date> <end_date> [daily|weekdays|weekends|mon,wed,...]")
+    print("> remove_availability <date> | <start_date> <end_date> [daily|weekdays|weekends|mon,wed,...]")
     print("> cancel <appointment_id>")  # // TODO: implement cancel (extra credit)
+    print("> call_out <date> | <start_date> <end_date>")
+    print("> report <date> | <start_date> <end_date>")
     print("> add_doses <vaccine> <number>")
-    print("> show_appointments")  # // TODO: implement show_appointments (Part 2)
+    print("> show_appointments [from=<date>] [to=<date>] [vaccine=<name>] [after=<appointment_id>] [page=<size>]")  # // TODO: implement show_appointments (Part 2)
     print("> logout")  # // TODO: implement logout (Part 2)
+    print("> resume <session token>")
+    print("> waitlist [<date> <vaccine>] | [<date> <vaccine> <patient> <priority>]")
+    print("> import_users <csv file>")
+    print("> metrics")
+    print("> sql_profile [reset]")
     print("> Quit")
     print()
     while not stop:
@@ -546,39 +1171,138 @@ def start():
             print("Please try again!")
             break
 
-        response = response.lower()
-        tokens = response.split(" ")
-        if len(tokens) == 0:
-            ValueError("Please try again!")
-            continue
-        operation = tokens[0]
-        if operation == "create_patient":
-            create_patient(tokens)
-        elif operation == "create_caregiver":
-            create_caregiver(tokens)
-        elif operation == "login_patient":
-            login_patient(tokens)
-        elif operation == "login_caregiver":
-            login_caregiver(tokens)
-        elif operation == "search_caregiver_schedule":
-            search_caregiver_schedule(tokens)
-        elif operation == "reserve":
-            reserve(tokens)
-        elif operation == "upload_availability":
-            upload_availability(tokens)
-        elif operation == "cancel":
-            cancel(tokens)
-        elif operation == "add_doses":
-            add_doses(tokens)
-        elif operation == "show_appointments":
-            show_appointments(tokens)
-        elif operation == "logout":
-            logout(tokens)
-        elif operation == "quit":
-            print("Bye!")
-            stop = True
-        else:
-            print("Invalid operation name!")
+        stop = not run_command(response)
+
+
+def run_command(response):
+    # runs one command line and records its latency; returns False once the user asked to quit
+    operation = response.lower().split(" ")[0]
+    label = operation if operation in COMMAND_NAMES else "invalid"
+    start = time.perf_counter()
+    try:
+        with sql_profiler.command(label):
+            return dispatch(response)
+    except BaseException:
+        metrics.inc("scheduler_command_failures_total", command=label)
+        raise
+    finally:
+        metrics.observe("scheduler_command_duration_seconds", time.perf_counter() - start, command=label)
+
+
+def check_session():
+    # drops a login whose token expired or was revoked (by a logout on another connection);
+    # returns False when it did
+    session = get_session()
+    if session.token is None or get_session_store().validate(session.token) is not None:
+        return True
+    session.patient = None
+    session.caregiver = None
+    session.token = None
+    print("Session expired or invalid, please login again.")
+    return False
+
+
+def dispatch(response):
+    tokens = response.lower().split(" ")
+    if len(tokens) == 0:
+        ValueError("Please try again!")
+        return True
+    operation = tokens[0]
+    if operation in SESSION_COMMANDS and not check_session():
+        return True
+    if operation == "create_patient":
+        create_patient(tokens)
+    elif operation == "create_caregiver":
+        create_caregiver(tokens)
+    elif operation == "login_patient":
+        login_patient(tokens)
+    elif operation == "login_caregiver":
+        login_caregiver(tokens)
+    elif operation == "search_caregiver_schedule":
+        search_caregiver_schedule(tokens)
+    elif operation == "find_dates":
+        find_dates(tokens)
+    elif operation == "reserve":
+        reserve(tokens)
+    elif operation == "reserve_series":
+        reserve_series(tokens)
+    elif operation == "upload_availability":
+        upload_availability(tokens)
+    elif operation == "remove_availability":
+        remove_availability(tokens)
+    elif operation == "cancel":
+        cancel(tokens)
+    elif operation == "call_out":
+        call_out(tokens)
+    elif operation == "report":
+        report(tokens)
+    elif operation == "add_doses":
+        add_doses(tokens)
+    elif operation == "show_appointments":
+        show_appointments(tokens)
+    elif operation == "logout":
+        logout(tokens)
+    elif operation == "resume":
+        resume(tokens)
+    elif operation == "waitlist":
+        waitlist(tokens)
+    elif operation == "import_users":
+        # file names keep their case
+        import_users(response.split(" "))
+    elif operation == "metrics":
+        show_metrics(tokens)
+    elif operation == "sql_profile":
+        show_sql_profile(tokens)
+    elif operation == "quit":
+        print("Bye!")
+        return False
+    else:
+        print("Invalid operation name!")
+    return True
+
+
+def run_batch(lines, quiet=False):
+    # Runs commands from an iterable of lines without prompting. Blank lines and lines starting
+    # with # are skipped. A command that fails (or calls quit() on a database error) is counted
+    # and the batch moves on to the next one. Prints a summary with per-command timings at the end.
+    timings = {}
+    errors = {}
+    total = 0
+    start_time = time.perf_counter()
+    output = open(os.devnull, "w") if quiet else sys.stdout
+    try:
+        for line in lines:
+            response = line.strip()
+            if response == "" or response.startswith("#"):
+                continue
+            operation = response.split(" ")[0].lower()
+            total += 1
+            command_start = time.perf_counter()
+            keep_going = True
+            try:
+                with contextlib.redirect_stdout(output):
+                    keep_going = run_command(response)
+            except (Exception, SystemExit) as e:
+                errors[operation] = errors.get(operation, 0) + 1
+                print(f"Command {total} ({operation}) failed: {e!r}", file=sys.stderr)
+            timings.setdefault(operation, []).append(time.perf_counter() - command_start)
+            if not keep_going:
+                break
+    finally:
+        if quiet:
+            output.close()
+    print_batch_summary(timings, errors, total, time.perf_counter() - start_time)
+
+
+def print_batch_summary(timings, errors, total, elapsed):
+    print()
+    print(f"Ran {total} commands in {elapsed:.3f}s ({total / elapsed if elapsed > 0 else 0:.1f} commands/s), "
+          f"{sum(errors.values())} failed")
+    print(f"{'command':<28}{'count':>8}{'errors':>8}{'total ms':>12}{'mean ms':>10}{'max ms':>10}")
+    for operation in sorted(timings):
+        times = timings[operation]
+        print(f"{operation:<28}{len(times):>8}{errors.get(operation, 0):>8}{sum(times) * 1000:>12.1f}"
+              f"{sum(times) / len(times) * 1000:>10.2f}{max(times) * 1000:>10.2f}")
 
 
 if __name__ == "__main__":
@@ -589,8 +1313,21 @@ if __name__ == "__main__":
     // and then construct a map of vaccineName -> vaccineObject
     '''
 
-    # start command line
-    print()
-    print("Welcome to the COVID-19 Vaccine Reservation Scheduling Application!")
+    parser = argparse.ArgumentParser(description="COVID-19 Vaccine Reservation Scheduling Application")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="run the commands in FILE (- for stdin) without prompting and print a timing summary")
+    parser.add_argument("--quiet", action="store_true", help="in batch mode, hide the output of the commands")
+    args = parser.parse_args()
+
+    if args.batch is not None:
+        if args.batch == "-":
+            run_batch(sys.stdin, args.quiet)
+        else:
+            with open(args.batch) as f:
+                run_batch(f, args.quiet)
+    else:
+        # start command line
+        print()
+        print("Welcome to the COVID-19 Vaccine Reservation Scheduling Application!")
 
-    start()
+        start()
@@ -0,0 +1,163 @@
+import argparse
+import asyncio
+import concurrent.futures
+import contextvars
+import io
+import os
+import sys
+
+import Scheduler
+
+
+'''
+Network server for the scheduler.
+
+Clients connect over TCP and send the same commands the command line accepts, one per line.
+The output of each command is sent back followed by a line holding a single "." (output lines
+that start with "." get a second one, as in SMTP). Every connection has its own Session, so many
+users can be logged in at once:
+
+    python Server.py --port 7000
+    printf 'login_patient alice secret\\nshow_appointments\\n' | nc localhost 7000
+
+Commands block on the database and on password hashing, so they run on two bounded thread pools
+while the event loop only reads and writes sockets: ServerWorkers threads (default PoolSize, so
+no command waits on the connection pool) for ordinary commands, and ServerHashWorkers threads
+for the commands that hash passwords, so a burst of logins cannot hold up reservations.
+ServerMaxClients caps the number of open connections; clients over the cap wait to be served.
+
+Operator commands (LOCAL_COMMANDS) read files on the server, create accounts in bulk or expose
+and reset the metrics and SQL profile; they are refused here and only run from the command line.
+'''
+
+# commands that spend most of their time in PBKDF2
+HASH_COMMANDS = {"create_patient", "create_caregiver", "login_patient", "login_caregiver"}
+
+# commands that trust whoever runs them as the operator, so network clients may not
+LOCAL_COMMANDS = {"import_users", "metrics", "sql_profile"}
+
+# the buffer collecting the output of the command running in this context
+current_output = contextvars.ContextVar("current_output", default=None)
+
+
+class SessionOutput:
+    # Stands in for sys.stdout so that print() inside a command goes to the output buffer of the
+    # command's own context and everything else to the real stdout.
+
+    def __init__(self, stdout):
+        self.stdout = stdout
+
+    def write(self, text):
+        output = current_output.get()
+        if output is None:
+            return self.stdout.write(text)
+        return output.write(text)
+
+    def flush(self):
+        if current_output.get() is None:
+            self.stdout.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stdout, name)
+
+
+def execute(session, response):
+    # runs one command line for a session on an executor thread; returns (keep going, output)
+    output = io.StringIO()
+    current_session_token = Scheduler.current_session.set(session)
+    current_output_token = current_output.set(output)
+    keep_going = True
+    try:
+        keep_going = Scheduler.run_command(response)
+    except SystemExit:
+        # commands quit() on database errors; only this command is lost
+        print("Please try again!")
+    except Exception as e:
+        print("Please try again!")
+        print(f"Command failed: {e!r}", file=sys.stderr)
+    finally:
+        current_output.reset(current_output_token)
+        Scheduler.current_session.reset(current_session_token)
+    return keep_going, output.getvalue()
+
+
+class SchedulerServer:
+
+    def __init__(self, workers, hash_workers, max_clients):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scheduler")
+        self.hash_executor = concurrent.futures.ThreadPoolExecutor(max_workers=hash_workers,
+                                                                   thread_name_prefix="scheduler-hash")
+        self.max_clients = max_clients
+        self.clients = 0
+        self.slots = None
+
+    async def serve(self, host, port):
+        if not isinstance(sys.stdout, SessionOutput):
+            sys.stdout = SessionOutput(sys.stdout)
+        self.slots = asyncio.Semaphore(self.max_clients)
+        server = await asyncio.start_server(self.handle, host, port)
+        print("Serving on " + ", ".join(str(s.getsockname()) for s in server.sockets), file=sys.stderr)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=False)
+            self.hash_executor.shutdown(wait=False)
+
+    async def handle(self, reader, writer):
+        async with self.slots:
+            self.clients += 1
+            session = Scheduler.Session()
+            loop = asyncio.get_running_loop()
+            try:
+                while True:
+                    line = await reader.readline()
+                    if line == b"":
+                        break
+                    response = line.decode("utf-8", errors="replace").strip()
+                    if response == "":
+                        continue
+                    operation = response.split(" ")[0].lower()
+                    if operation in LOCAL_COMMANDS:
+                        writer.write(frame(operation + " is only available from the command line."))
+                        await writer.drain()
+                        continue
+                    executor = self.hash_executor if operation in HASH_COMMANDS else self.executor
+                    # a fresh context per command keeps sessions from seeing each other's state
+                    context = contextvars.Context()
+                    keep_going, output = await loop.run_in_executor(executor, context.run, execute, session, response)
+                    writer.write(frame(output))
+                    await writer.drain()
+                    if not keep_going:
+                        break
+            except ConnectionError:
+                pass
+            finally:
+                self.clients -= 1
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except ConnectionError:
+                    pass
+
+
+def frame(output):
+    lines = output.splitlines()
+    lines = ["." + line if line.startswith(".") else line for line in lines]
+    lines.append(".")
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the vaccine scheduler commands over TCP")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=int(os.getenv("ServerPort", "7000")), help="port to listen on")
+    args = parser.parse_args()
+
+    server = SchedulerServer(workers=int(os.getenv("ServerWorkers", os.getenv("PoolSize", "10"))),
+                             hash_workers=int(os.getenv("ServerHashWorkers", str(os.cpu_count() or 1))),
+                             max_clients=int(os.getenv("ServerMaxClients", "500")))
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
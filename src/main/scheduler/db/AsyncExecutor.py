@@ -0,0 +1,52 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import os
+import threading
+
+
+class AsyncExecutor:
+    # Runs blocking model calls on a bounded thread pool so coroutines can await them and overlap
+    # independent queries. The pool is no larger than the connection pool by default, so awaiting
+    # many calls at once queues them here instead of timing out on a connection. Each call runs in
+    # a copy of the caller's context, so the session and the command being profiled carry over.
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scheduler-db")
+
+    async def run(self, fn, *args, **kwargs):
+        context = contextvars.copy_context()
+        call = functools.partial(context.run, fn, *args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, call)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_async_executor():
+    # AsyncWorkers bounds the number of model calls running at once (default PoolSize)
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = AsyncExecutor(int(os.getenv("AsyncWorkers", os.getenv("PoolSize", "10"))))
+    return _executor
+
+
+async def run_blocking(fn, *args, **kwargs):
+    return await get_async_executor().run(fn, *args, **kwargs)
+
+
+_loops = threading.local()
+
+
+def run_sync(coroutine):
+    # Runs a coroutine to completion from blocking code, such as a command. Every thread keeps
+    # one event loop for this instead of paying for a new one on each call like asyncio.run.
+    loop = getattr(_loops, "loop", None)
+    if loop is None or loop.is_closed():
+        loop = _loops.loop = asyncio.new_event_loop()
+    return loop.run_until_complete(coroutine)
@@ -0,0 +1,326 @@
+import datetime
+import os
+import threading
+import time
+from db.ConnectionManager import ConnectionManager
+from db.Backend import get_backend
+from util.Metrics import get_metrics
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class _IntBits:
+    # one Python int per day, bit i set when caregiver i is booked; popcount is int.bit_count()
+
+    def __init__(self, days):
+        self.rows = [0] * days
+
+    def set(self, day, i):
+        self.rows[day] |= 1 << i
+
+    def clear(self, day, i):
+        self.rows[day] &= ~(1 << i)
+
+    def clear_days(self, start, end):
+        for day in range(start, end):
+            self.rows[day] = 0
+
+    def busy_counts(self, start, end):
+        return [row.bit_count() for row in self.rows[start:end]]
+
+    def busy(self, day):
+        row = self.rows[day]
+        return [i for i in range(row.bit_length()) if row >> i & 1]
+
+    def nbytes(self):
+        return sum((row.bit_length() + 7) // 8 for row in self.rows)
+
+
+class _NumpyBits:
+    # a days x caregivers bit matrix packed eight caregivers to a byte, rows a multiple of 8 bytes
+    # wide so they can be counted as 64-bit words (bitwise_count is new in NumPy 2; older versions
+    # look the bytes up in a table)
+
+    POPCOUNT = numpy.array([bin(i).count("1") for i in range(256)], dtype=numpy.uint16) if numpy is not None else None
+
+    def __init__(self, days):
+        self.matrix = numpy.zeros((days, 8), dtype=numpy.uint8)
+
+    def set(self, day, i):
+        if i >> 3 >= self.matrix.shape[1]:
+            # room for at least twice as many caregivers
+            width = max(2 * self.matrix.shape[1], ((i >> 6) + 1) * 8)
+            self.matrix = numpy.pad(self.matrix, ((0, 0), (0, width - self.matrix.shape[1])))
+        self.matrix[day, i >> 3] |= 1 << (i & 7)
+
+    def clear(self, day, i):
+        if i >> 3 < self.matrix.shape[1]:
+            self.matrix[day, i >> 3] &= ~numpy.uint8(1 << (i & 7))
+
+    def clear_days(self, start, end):
+        self.matrix[start:end] = 0
+
+    def busy_counts(self, start, end):
+        if hasattr(numpy, "bitwise_count"):
+            return numpy.bitwise_count(self.matrix[start:end].view(numpy.uint64)).sum(axis=1, dtype=numpy.int64)
+        return self.POPCOUNT[self.matrix[start:end]].sum(axis=1, dtype=numpy.int64)
+
+    def busy(self, day):
+        return numpy.nonzero(numpy.unpackbits(self.matrix[day], bitorder="little"))[0].tolist()
+
+    def nbytes(self):
+        return self.matrix.nbytes
+
+
+class AvailabilityCalendar:
+    # Caregiver x day bit matrix of the Availabilities table over the next `horizon` days, so
+    # questions over whole ranges (free caregivers per day, the next dates with enough of them)
+    # are answered from memory with one pass over packed bits instead of one query per date.
+    # A set bit means the caregiver is booked or blocked that day, as a row in Availabilities does.
+    # The matrix is loaded in one query, kept current by the changes made through this process
+    # and reloaded after ttl seconds, which bounds how long other processes' changes go unseen.
+    # Uses NumPy when it is installed and plain integers otherwise; 2000 caregivers over two years
+    # take about 180 KB either way.
+
+    def __init__(self, horizon=730, ttl=300):
+        self.horizon = horizon
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.first = None
+        self.bits = None
+        self.loaded_at = 0
+        self.backend = None
+        # caregivers in the order they got their bit
+        self.caregivers = []
+        self.positions = {}
+        # days changed in a way the calendar cannot apply itself, reloaded on the next query
+        self.stale = set()
+
+        # statistics
+        self.loads = 0
+
+    # (first, last) dates the calendar answers for
+    def span(self):
+        self._ensure_loaded()
+        with self.lock:
+            return self.first, self.first + datetime.timedelta(days=self.horizon - 1)
+
+    def covers(self, start, end):
+        first, last = self.span()
+        return first <= start and end <= last
+
+    # [number of free caregivers] for every date from start to end
+    def free_counts(self, start, end):
+        a, b = self._days(start, end)
+        with self.lock:
+            return [len(self.caregivers) - int(n) for n in self.bits.busy_counts(a, b)]
+
+    # caregivers free on one date, by name
+    def free_caregivers(self, d):
+        a, b = self._days(d, d)
+        with self.lock:
+            busy = set(self.bits.busy(a))
+            return sorted(c for i, c in enumerate(self.caregivers) if i not in busy)
+
+    # [(date, free caregivers)] of the first `limit` dates from start to end with at least min_free
+    def available_dates(self, start, end, min_free=1, limit=None):
+        a, b = self._days(start, end)
+        with self.lock:
+            total = len(self.caregivers)
+            counts = self.bits.busy_counts(a, b)
+            if numpy is not None:
+                free = total - counts
+                days = numpy.nonzero(free >= min_free)[0]
+                if limit is not None:
+                    days = days[:limit]
+                return [(self.first + datetime.timedelta(days=a + int(day)), int(free[day])) for day in days]
+            result = []
+            for day, busy in enumerate(counts):
+                if total - busy >= min_free:
+                    result.append((self.first + datetime.timedelta(days=a + day), total - busy))
+                    if limit is not None and len(result) >= limit:
+                        break
+            return result
+
+    # The first `limit` dates d from start to end such that d, d + interval, ... (doses dates in all)
+    # each have a free caregiver. Every candidate start is tested at once: the free days shifted by
+    # k * interval are and-ed together, one vector operation per dose.
+    def series_starts(self, start, end, doses, interval, limit=None):
+        first, last = self.span()
+        span = (doses - 1) * interval
+        end = min(end, last - datetime.timedelta(days=span))
+        if end < start:
+            return []
+        n = (end - start).days + 1
+        a, b = self._days(start, end + datetime.timedelta(days=span))
+        with self.lock:
+            total = len(self.caregivers)
+            counts = self.bits.busy_counts(a, b)
+            if numpy is not None:
+                free = counts < total
+                feasible = free[:n].copy()
+                for k in range(1, doses):
+                    feasible &= free[k * interval:k * interval + n]
+                days = numpy.nonzero(feasible)[0]
+                if limit is not None:
+                    days = days[:limit]
+                return [start + datetime.timedelta(days=int(day)) for day in days]
+            free = [busy < total for busy in counts]
+            result = []
+            for day in range(n):
+                if all(free[day + k * interval] for k in range(doses)):
+                    result.append(start + datetime.timedelta(days=day))
+                    if limit is not None and len(result) >= limit:
+                        break
+            return result
+
+    # the caregiver is booked or blocked on these dates
+    def mark_busy(self, dates, caregiver):
+        with self.lock:
+            for day, i in self._cells(dates, caregiver):
+                self.bits.set(day, i)
+
+    # the caregiver's appointment or blocked day on these dates is gone
+    def mark_free(self, dates, caregiver):
+        with self.lock:
+            for day, i in self._cells(dates, caregiver):
+                self.bits.clear(day, i)
+
+    def add_caregiver(self, caregiver):
+        with self.lock:
+            if self.bits is None or caregiver in self.positions:
+                return
+            self.positions[caregiver] = len(self.caregivers)
+            self.caregivers.append(caregiver)
+
+    # reload these dates on the next query
+    def invalidate(self, dates):
+        with self.lock:
+            if self.bits is None:
+                return
+            for d in dates:
+                day = (d - self.first).days
+                if 0 <= day < self.horizon:
+                    self.stale.add(day)
+
+    def stats(self):
+        with self.lock:
+            return {"loads": self.loads, "bytes": self.bits.nbytes() if self.bits is not None else 0,
+                    "caregivers": len(self.caregivers)}
+
+    def _cells(self, dates, caregiver):
+        if self.bits is None or caregiver not in self.positions:
+            return []
+        i = self.positions[caregiver]
+        cells = []
+        for d in dates:
+            day = (d - self.first).days
+            if 0 <= day < self.horizon:
+                cells.append((day, i))
+        return cells
+
+    def _days(self, start, end):
+        self._ensure_loaded()
+        with self.lock:
+            a = (start - self.first).days
+            b = (end - self.first).days + 1
+            if a < 0 or b > self.horizon or a >= b:
+                raise ValueError("Dates outside the calendar: " + str(start) + " to " + str(end))
+            stale = sorted(day for day in self.stale if a <= day < b)
+        if len(stale) > 0:
+            self._reload_days(stale[0], stale[-1] + 1)
+        return a, b
+
+    def _ensure_loaded(self):
+        with self.lock:
+            if self.bits is not None and self.backend is get_backend() and time.monotonic() - self.loaded_at < self.ttl \
+                    and self.first == datetime.date.today():
+                return
+        self._load()
+
+    def _load(self):
+        first = datetime.date.today()
+        last = first + datetime.timedelta(days=self.horizon - 1)
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        select_caregivers = "SELECT Username FROM Caregivers"
+        select_busy = "SELECT Date, Caregiver_name FROM Availabilities WHERE Date BETWEEN %s AND %s"
+        try:
+            cursor.execute(select_caregivers)
+            caregivers = [row[0] for row in cursor]
+            positions = {c: i for i, c in enumerate(caregivers)}
+            bits = _NumpyBits(self.horizon) if numpy is not None else _IntBits(self.horizon)
+            cursor.execute(select_busy, (first, last))
+            for d, caregiver in cursor:
+                i = positions.get(caregiver)
+                if i is not None:
+                    bits.set((d - first).days, i)
+        finally:
+            cm.close_connection()
+
+        with self.lock:
+            self.first = first
+            self.bits = bits
+            self.caregivers = caregivers
+            self.positions = positions
+            self.stale = set()
+            self.loaded_at = time.monotonic()
+            self.backend = get_backend()
+            self.loads += 1
+
+    def _reload_days(self, a, b):
+        with self.lock:
+            first = self.first
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        select_busy = "SELECT Date, Caregiver_name FROM Availabilities WHERE Date BETWEEN %s AND %s"
+        try:
+            cursor.execute(select_busy, (first + datetime.timedelta(days=a), first + datetime.timedelta(days=b - 1)))
+            rows = cursor.fetchall()
+        finally:
+            cm.close_connection()
+
+        with self.lock:
+            if self.first != first:
+                return
+            self.bits.clear_days(a, b)
+            for d, caregiver in rows:
+                i = self.positions.get(caregiver)
+                if i is not None:
+                    self.bits.set((d - first).days, i)
+            self.stale = set(day for day in self.stale if not a <= day < b)
+
+
+_calendar = None
+_calendar_lock = threading.Lock()
+
+
+def get_availability_calendar():
+    # CalendarDays is the horizon from today in days; CalendarTTL how often it is reloaded in full
+    global _calendar
+    if _calendar is None:
+        with _calendar_lock:
+            if _calendar is None:
+                _calendar = AvailabilityCalendar(horizon=int(os.getenv("CalendarDays", "730")),
+                                                 ttl=float(os.getenv("CalendarTTL", "300")))
+    return _calendar
+
+
+def _calendar_collector():
+    if _calendar is None:
+        return []
+    stats = _calendar.stats()
+    return [
+        ("scheduler_calendar_loads_total", "counter", {}, stats["loads"]),
+        ("scheduler_calendar_bytes", "gauge", {}, stats["bytes"]),
+    ]
+
+
+get_metrics().register_collector(_calendar_collector)
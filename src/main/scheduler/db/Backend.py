@@ -0,0 +1,104 @@
+import os
+import sqlite3
+
+try:
+    import pymssql
+except ImportError:
+    pymssql = None
+
+
+# exception types any of the supported drivers can raise; catch this instead of a driver's own Error
+if pymssql is not None:
+    DatabaseError = (pymssql.Error, sqlite3.Error)
+else:
+    DatabaseError = (sqlite3.Error,)
+
+
+class Backend:
+    # A storage backend knows how to open connections for one database engine and holds the few
+    # statements that cannot be written portably. Everything else is plain SQL using the pymssql
+    # parameter style (%s, %d, %(name)s) and cursor(as_dict=...) on the connections it returns.
+    name = None
+    # most bind parameters one statement may carry
+    max_params = 999
+
+    def connect(self):
+        raise NotImplementedError
+
+    # True if the error means the transaction lost a race and can simply be run again
+    def is_retryable(self, e):
+        return False
+
+    # how many rows of the given width fit in one multi-row INSERT
+    def max_batch_rows(self, columns):
+        return max(1, min(1000, self.max_params // columns))
+
+    # Book the first free caregiver on params["date"] (or params["caregiver"] if set; if they are
+    # taken the insert fails on the Availabilities primary key) and take one dose of params["vaccine"].
+    # Runs inside the caller's transaction and returns {"Status": ..., "Caregiver_name": ...}
+    # where Status is "ok", "no_caregiver" or "no_doses"; the caller commits or rolls back.
+    def reserve(self, conn, params):
+        raise NotImplementedError
+
+    # query, a SELECT, returning at most n rows
+    def limit(self, query, n):
+        raise NotImplementedError
+
+    # Adds counts, [(column, change)], to the row of table with the given key, [(column, value)],
+    # creating the row (counters default to 0) if there is none. Atomic, so concurrent
+    # transactions adding to the same row never lose an update.
+    def increment(self, cursor, table, key, counts):
+        raise NotImplementedError
+
+    # schema inspection and DDL for the migrations in db/Migrations.py
+
+    # start a transaction explicitly, so it also covers the reads and DDL before the first write
+    def begin(self, cursor):
+        pass
+
+    def has_table(self, cursor, table):
+        cursor.execute("SELECT 1 FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_NAME = %s", table)
+        return cursor.fetchone() is not None
+
+    def has_column(self, cursor, table, column):
+        cursor.execute("SELECT 1 FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME = %s AND COLUMN_NAME = %s", (table, column))
+        return cursor.fetchone() is not None
+
+    def has_index(self, cursor, table, index):
+        raise NotImplementedError
+
+    def add_column(self, cursor, table, column, column_type):
+        raise NotImplementedError
+
+    # an index on keys that also carries the include columns, so the queries it serves never
+    # have to read the table itself
+    def create_index(self, cursor, index, table, keys, include=()):
+        raise NotImplementedError
+
+    # the engine's plan for a query, one line per step
+    def explain(self, cursor, query, params):
+        raise NotImplementedError
+
+
+_backend = None
+
+
+def get_backend():
+    # the backend is picked once from the DBBackend environment variable (mssql or sqlite)
+    global _backend
+    if _backend is None:
+        name = os.getenv("DBBackend", "mssql").lower()
+        if name == "sqlite":
+            from db.SqliteBackend import SqliteBackend
+            _backend = SqliteBackend(os.getenv("DBFile", "scheduler.db"))
+        elif name == "mssql":
+            from db.MssqlBackend import MssqlBackend
+            _backend = MssqlBackend()
+        else:
+            raise ValueError("Unknown database backend: " + name)
+    return _backend
+
+
+def set_backend(backend):
+    global _backend
+    _backend = backend
@@ -1,29 +1,229 @@
-import pymssql
 import os
+import threading
+import time
+from db.Backend import DatabaseError, get_backend
+from db.InstrumentedConnection import InstrumentedConnection
+from util.Metrics import get_metrics
+
+
+class PoolTimeout(RuntimeError):
+    pass
+
+
+class ConnectionPool:
+
+    def __init__(self, connect, max_size=10, max_idle=300, validate_after=5, timeout=30):
+        # connect: zero-argument callable opening a new DB-API connection
+        # max_size: upper bound on open connections (idle + checked out)
+        # max_idle: seconds an idle connection is kept before it is closed
+        # validate_after: connections idle longer than this are health-checked on checkout
+        # timeout: seconds acquire() waits for a free connection before giving up
+        self.connect = connect
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.validate_after = validate_after
+        self.timeout = timeout
+        self.cond = threading.Condition()
+        # idle connections as (conn, returned_at); the most recently returned is last
+        self.idle = []
+        self.size = 0
+
+        # statistics
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.evictions = 0
+        self.failed_checks = 0
+
+    def acquire(self):
+        while True:
+            conn, returned_at = self._checkout()
+            if conn is None:
+                # no idle connection, but _checkout reserved a slot for a new one
+                try:
+                    return self.connect()
+                except Exception:
+                    self._release_slot()
+                    raise
+            if time.monotonic() - returned_at < self.validate_after or self._healthy(conn):
+                return conn
+            with self.cond:
+                self.failed_checks += 1
+            self._discard(conn)
+
+    def release(self, conn):
+        # end whatever transaction the borrower left open so the next one starts clean
+        try:
+            conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+        with self.cond:
+            self.idle.append((conn, time.monotonic()))
+            self.cond.notify()
+
+    def close_all(self):
+        with self.cond:
+            idle = self.idle
+            self.idle = []
+            self.size -= len(idle)
+            self.cond.notify_all()
+        for conn, _ in idle:
+            self._close(conn)
+
+    def stats(self):
+        with self.cond:
+            return {
+                "size": self.size,
+                "idle": len(self.idle),
+                "in_use": self.size - len(self.idle),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "waits": self.waits,
+                "wait_time": self.wait_time,
+                "evictions": self.evictions,
+                "failed_checks": self.failed_checks,
+            }
+
+    def _checkout(self):
+        expired = []
+        try:
+            with self.cond:
+                deadline = None
+                while True:
+                    expired.extend(self._evict_idle())
+                    if self.idle:
+                        self.hits += 1
+                        return self.idle.pop()
+                    if self.size < self.max_size:
+                        self.size += 1
+                        self.misses += 1
+                        return None, None
+                    # pool exhausted, wait for a connection to be released
+                    now = time.monotonic()
+                    if deadline is None:
+                        deadline = now + self.timeout
+                        self.waits += 1
+                    if now >= deadline:
+                        raise PoolTimeout("Timed out waiting for a database connection")
+                    self.cond.wait(deadline - now)
+                    self.wait_time += time.monotonic() - now
+        finally:
+            for conn in expired:
+                self._close(conn)
+
+    def _evict_idle(self):
+        # the oldest connections sit at the front of the idle list
+        cutoff = time.monotonic() - self.max_idle
+        expired = []
+        while self.idle and self.idle[0][1] < cutoff:
+            expired.append(self.idle.pop(0)[0])
+        self.size -= len(expired)
+        self.evictions += len(expired)
+        return expired
+
+    def _healthy(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn):
+        self._close(conn)
+        self._release_slot()
+
+    def _release_slot(self):
+        with self.cond:
+            self.size -= 1
+            self.cond.notify()
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+# process-wide pool shared by every ConnectionManager
+_pool = None
+_pool_lock = threading.Lock()
+
+metrics = get_metrics()
+metrics.describe("scheduler_connection_acquire_duration_seconds", "Time to check a connection out of the pool, including connecting")
+
+
+def _pool_collector():
+    if _pool is None:
+        return []
+    stats = _pool.stats()
+    return [
+        ("scheduler_pool_connections", "gauge", {"state": "idle"}, stats["idle"]),
+        ("scheduler_pool_connections", "gauge", {"state": "in_use"}, stats["in_use"]),
+        ("scheduler_pool_checkouts_total", "counter", {"result": "hit"}, stats["hits"]),
+        ("scheduler_pool_checkouts_total", "counter", {"result": "miss"}, stats["misses"]),
+        ("scheduler_pool_waits_total", "counter", {}, stats["waits"]),
+        ("scheduler_pool_wait_seconds_total", "counter", {}, stats["wait_time"]),
+        ("scheduler_pool_evictions_total", "counter", {}, stats["evictions"]),
+        ("scheduler_pool_failed_checks_total", "counter", {}, stats["failed_checks"]),
+    ]
+
+
+metrics.register_collector(_pool_collector)
+
+
+def get_pool(connect):
+    global _pool
+    if _pool is None or _pool.connect != connect:
+        with _pool_lock:
+            if _pool is not None and _pool.connect != connect:
+                # the backend was switched, drop the connections to the old one
+                _pool.close_all()
+                _pool = None
+            if _pool is None:
+                _pool = ConnectionPool(connect,
+                                       max_size=int(os.getenv("PoolSize", "10")),
+                                       max_idle=float(os.getenv("PoolMaxIdle", "300")),
+                                       validate_after=float(os.getenv("PoolValidateAfter", "5")),
+                                       timeout=float(os.getenv("PoolTimeout", "30")))
+    return _pool
 
 
 class ConnectionManager:
 
     def __init__(self):
-        self.server_name = os.getenv("Server") + ".database.windows.net"
-        self.db_name = os.getenv("DBName")
-        self.user = os.getenv("UserID")
-        self.password = os.getenv("Password")
+        self.backend = get_backend()
         self.conn = None
 
     def create_connection(self):
         try:
-            self.conn = pymssql.connect(server=self.server_name, user=self.user, password=self.password, database=self.db_name)
-        except pymssql.Error as db_err:
+            with metrics.timer("scheduler_connection_acquire_duration_seconds"):
+                self.conn = InstrumentedConnection(get_pool(self.backend.connect).acquire())
+        except DatabaseError + (PoolTimeout,) as db_err:
             print("Database Programming Error in SQL connection processing! ")
             print(db_err)
             quit()
         return self.conn
 
     def close_connection(self):
+        # hands the connection back to the pool; safe to call more than once
+        if self.conn is None:
+            return
+        conn = self.conn
+        self.conn = None
         try:
-            self.conn.close()
-        except pymssql.Error as db_err:
+            get_pool(self.backend.connect).release(conn.conn)
+        except DatabaseError as db_err:
             print("Database Programming Error in SQL connection processing! ")
             print(db_err)
             quit()
+
+    @staticmethod
+    def pool_stats():
+        if _pool is None:
+            return None
+        return _pool.stats()
@@ -0,0 +1,150 @@
+import collections
+import csv
+import gzip
+import os
+from db.ConnectionManager import ConnectionManager
+from db.Backend import DatabaseError
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+# Streams a table to a file for analytics. Rows are read from one cursor batch_size at a time and
+# written out before the next batch is fetched, so memory use depends on the batch size and not
+# on the size of the table. The file is written under a temporary name and renamed when complete,
+# so a failed export never leaves a truncated file where the last good one was.
+
+CSV = "csv"
+PARQUET = "parquet"
+FORMATS = (CSV, PARQUET)
+
+# table -> (columns, Arrow types, order); the order is the keyset the watermarks refer to
+TABLES = {
+    "appointments": (("Appointment_id", "Date", "Patient_name", "Caregiver_name", "Vaccine_name"),
+                     ("int64", "date32", "string", "string", "string"), "Appointment_id"),
+    "availabilities": (("Date", "Caregiver_name"), ("date32", "string"), "Date, Caregiver_name"),
+}
+
+
+class _CsvFile:
+    # gzip-compressed CSV with a header row
+
+    def __init__(self, path, columns, types):
+        self.file = gzip.open(path, "wt", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class _ParquetFile:
+    # one zstd-compressed row group per batch
+
+    def __init__(self, path, columns, types):
+        self.columns = columns
+        self.schema = pyarrow.schema([(c, getattr(pyarrow, t)()) for c, t in zip(columns, types)])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression="zstd")
+
+    def write(self, rows):
+        arrays = [pyarrow.array([row[i] for row in rows], type=field.type) for i, field in enumerate(self.schema)]
+        self.writer.write_batch(pyarrow.record_batch(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+# csv for names ending in .csv.gz, parquet for .parquet; anything else is refused rather than
+# written in a format its name does not say
+def format_for(path):
+    if path.endswith(".parquet"):
+        return PARQUET
+    if path.endswith(".csv.gz"):
+        return CSV
+    raise ValueError("Output names end in .csv.gz or .parquet: " + path)
+
+
+# Writes the rows of table ("appointments" or "availabilities") to path in fmt, only those dated
+# from start to end (either may be None) and, for appointments, with an id greater than after.
+#
+# Ids are leased in blocks before the reservation commits, so appointments do not commit in id
+# order: a concurrent reservation, in this process or another, can commit a lower id after a
+# higher one has been exported. With overlap, the export reads again from after - overlap and
+# skips the ids in seen, the ones earlier exports already wrote from that window; an id that
+# commits more than overlap ids behind the newest exported one is still missed.
+#
+# Returns (rows written, watermark, recent): the highest Appointment_id exported so far (after if
+# nothing new) and the exported ids within overlap of it, to pass as after and seen next time.
+def export(table, path, fmt=CSV, start=None, end=None, after=None, batch_size=10000, overlap=0, seen=()):
+    if table not in TABLES:
+        raise ValueError("Unknown table: " + table)
+    if fmt not in FORMATS:
+        raise ValueError("Unknown format: " + fmt)
+    if fmt == PARQUET and pyarrow is None:
+        raise ValueError("Parquet export needs pyarrow installed")
+    columns, types, order = TABLES[table]
+    if after is not None and "Appointment_id" not in columns:
+        raise ValueError("Only appointments have an id watermark")
+
+    seen = set(seen)
+    filters = []
+    params = []
+    if after is not None:
+        filters.append("Appointment_id > %d")
+        params.append(after - overlap)
+    if start is not None:
+        filters.append("Date >= %s")
+        params.append(start)
+    if end is not None:
+        filters.append("Date <= %s")
+        params.append(end)
+    select_rows = "SELECT " + ", ".join(columns) + " FROM " + table.capitalize()
+    if len(filters) > 0:
+        select_rows += " WHERE " + " AND ".join(filters)
+    select_rows += " ORDER BY " + order
+
+    temporary = path + ".tmp"
+    cm = ConnectionManager()
+    conn = cm.create_connection()
+    cursor = conn.cursor()
+    written = 0
+    watermark = after
+    # ids written in this run within overlap of the newest, oldest first
+    recent = collections.deque()
+    try:
+        out = (_ParquetFile if fmt == PARQUET else _CsvFile)(temporary, columns, types)
+        try:
+            cursor.execute(select_rows, tuple(params))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if len(rows) == 0:
+                    break
+                if "Appointment_id" in columns:
+                    rows = [row for row in rows if row[0] not in seen]
+                    if len(rows) == 0:
+                        continue
+                    watermark = max(watermark, rows[-1][0]) if watermark is not None else rows[-1][0]
+                    recent.extend(row[0] for row in rows)
+                    while len(recent) > 0 and recent[0] <= watermark - overlap:
+                        recent.popleft()
+                out.write(rows)
+                written += len(rows)
+        finally:
+            out.close()
+        os.replace(temporary, path)
+        if watermark is None:
+            return written, None, []
+        recent = sorted(set(recent) | set(i for i in seen if i > watermark - overlap))
+        return written, watermark, recent
+    except DatabaseError:
+        raise
+    finally:
+        cm.close_connection()
+        if os.path.exists(temporary):
+            os.remove(temporary)
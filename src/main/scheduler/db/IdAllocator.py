@@ -0,0 +1,71 @@
+import os
+import threading
+from db.ConnectionManager import ConnectionManager
+from db.Backend import DatabaseError, get_backend
+
+
+class IdAllocator:
+    # Hands out unique integer ids for one table using hi-lo block leasing. A process leases a
+    # block of block_size ids by advancing the table's row in Id_blocks inside one transaction,
+    # then gives ids out of that block from memory, so only one reservation in block_size pays a
+    # round trip. The row update is serialized by the database, so blocks leased by different
+    # scheduler processes never overlap. Ids left in a block when the process exits are skipped.
+
+    def __init__(self, table, column, block_size=100):
+        self.table = table
+        self.column = column
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        self.next = 0
+        self.end = 0
+        self.backend = None
+
+    def next_id(self):
+        with self.lock:
+            if self.backend is not get_backend():
+                # a block leased from another database means nothing here
+                self.backend = get_backend()
+                self.next = self.end = 0
+            if self.next >= self.end:
+                self.next, self.end = self._lease()
+            allocated = self.next
+            self.next += 1
+            return allocated
+
+    def _lease(self):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        update_block = "UPDATE Id_blocks SET Next_id = Next_id + %d WHERE Name = %s"
+        # the first lease for a table starts after the highest id already in use
+        insert_block = "INSERT INTO Id_blocks (Name, Next_id) SELECT %s, COALESCE(MAX(" + self.column + "), 0) + 1 + %d FROM " + self.table
+        select_block = "SELECT Next_id FROM Id_blocks WHERE Name = %s"
+        try:
+            for attempt in range(2):
+                try:
+                    cursor.execute(update_block, (self.block_size, self.table))
+                    if cursor.rowcount == 0:
+                        cursor.execute(insert_block, (self.table, self.block_size))
+                    cursor.execute(select_block, self.table)
+                    end = cursor.fetchone()[0]
+                    conn.commit()
+                    return end - self.block_size, end
+                except DatabaseError as e:
+                    # another process created the row first; the UPDATE will find it now
+                    conn.rollback()
+                    if attempt == 1 or not cm.backend.is_retryable(e):
+                        raise
+        finally:
+            cm.close_connection()
+
+
+_allocators = {}
+_allocators_lock = threading.Lock()
+
+
+def get_id_allocator(table, column):
+    with _allocators_lock:
+        if table not in _allocators:
+            _allocators[table] = IdAllocator(table, column, block_size=int(os.getenv("IdBlockSize", "100")))
+        return _allocators[table]
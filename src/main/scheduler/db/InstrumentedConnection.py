@@ -0,0 +1,163 @@
+import functools
+import re
+import time
+from util.Metrics import get_metrics
+from db.SqlProfiler import get_sql_profiler
+
+
+metrics = get_metrics()
+metrics.describe("scheduler_sql_duration_seconds", "Time spent in cursor.execute by statement")
+metrics.describe("scheduler_sql_commit_duration_seconds", "Time spent committing transactions")
+metrics.describe("scheduler_sql_errors_total", "Statements that raised a database error")
+
+profiler = get_sql_profiler()
+
+_tables = re.compile(r"\b(?:FROM|JOIN|INTO|UPDATE|MERGE(?:\s+INTO)?)\s+(\w+)", re.IGNORECASE)
+
+# words the pattern above can capture that are not tables, e.g. the SET of an upsert's
+# "DO UPDATE SET" or "WHEN MATCHED THEN UPDATE SET", or a derived table's "FROM (SELECT"
+_keywords = {"SET", "SELECT", "WITH", "VALUES", "WHERE", "USING", "AS", "ON", "INTO", "DEFAULT"}
+
+
+@functools.lru_cache(maxsize=512)
+def statement_name(operation):
+    # A short, low-cardinality label for a statement: its verb and the tables it touches, e.g.
+    # "SELECT Caregivers,Availabilities". Multi-row INSERTs of any length share one label.
+    words = operation.split(None, 1)
+    if len(words) == 0:
+        return "EMPTY"
+    verb = words[0].upper()
+    if verb in ("SET", "DECLARE", "BEGIN"):
+        verb = "BATCH"
+    tables = []
+    for table in _tables.findall(operation):
+        if table.upper() in _keywords:
+            continue
+        table = table.capitalize()
+        if table not in tables:
+            tables.append(table)
+    return verb + " " + ",".join(tables) if len(tables) > 0 else verb
+
+
+class InstrumentedCursor:
+    # Times every execute for the metrics and hands it to the SQL profiler together with the
+    # rows fetched afterwards and the time spent fetching them.
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.profile_key = None
+
+    def execute(self, operation, params=None):
+        name = statement_name(operation)
+        start = time.perf_counter()
+        try:
+            if params is None:
+                self.cursor.execute(operation)
+            else:
+                self.cursor.execute(operation, params)
+        except Exception:
+            metrics.inc("scheduler_sql_errors_total", statement=name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.observe("scheduler_sql_duration_seconds", elapsed, statement=name)
+            self.profile_key = profiler.record_execute(name, operation, params, elapsed)
+        return self
+
+    def executemany(self, operation, seq_of_params):
+        name = statement_name(operation)
+        start = time.perf_counter()
+        try:
+            self.cursor.executemany(operation, seq_of_params)
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.observe("scheduler_sql_duration_seconds", elapsed, statement=name)
+            self.profile_key = profiler.record_execute(name, operation, None, elapsed)
+        return self
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = self.cursor.fetchone()
+        self._fetched(0 if row is None else 1, start)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        if size is None:
+            rows = self.cursor.fetchmany()
+        else:
+            rows = self.cursor.fetchmany(size)
+        self._fetched(len(rows), start)
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = self.cursor.fetchall()
+        self._fetched(len(rows), start)
+        return rows
+
+    # moves to the next result set of a batch that returns several, e.g. SHOWPLAN output
+    def nextset(self):
+        return self.cursor.nextset()
+
+    def close(self):
+        self.cursor.close()
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    def __iter__(self):
+        key = self.profile_key
+        rows = 0
+        elapsed = 0.0
+        iterator = iter(self.cursor)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    row = next(iterator)
+                except StopIteration:
+                    elapsed += time.perf_counter() - start
+                    return
+                elapsed += time.perf_counter() - start
+                rows += 1
+                yield row
+        finally:
+            if key is not None:
+                profiler.record_fetch(key, rows, elapsed)
+
+    def _fetched(self, rows, start):
+        if self.profile_key is not None:
+            profiler.record_fetch(self.profile_key, rows, time.perf_counter() - start)
+
+
+class InstrumentedConnection:
+    # Wraps a pooled connection so every statement and commit made through it is timed and profiled.
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def cursor(self, as_dict=False):
+        if as_dict:
+            return InstrumentedCursor(self.conn.cursor(as_dict=True))
+        return InstrumentedCursor(self.conn.cursor())
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            self.conn.commit()
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.observe("scheduler_sql_commit_duration_seconds", elapsed)
+            profiler.record_execute("COMMIT", "COMMIT", None, elapsed)
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,108 @@
+import os
+import threading
+import time
+from db.ConnectionManager import ConnectionManager
+from util.Metrics import get_metrics
+
+
+class InventoryCache:
+    # In-process copy of the Vaccines table. The table is tiny and only changes through the
+    # Vaccine model and reservations, which invalidate it, so reads are served from memory and
+    # the whole table is reloaded on the first read after an invalidation or once the TTL runs out.
+    # The TTL bounds how long writes made by other scheduler processes can go unseen.
+
+    def __init__(self, ttl=5):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.doses = None
+        self.loaded_at = 0
+        # bumped by every invalidation so a load that raced with a write is not kept
+        self.version = 0
+
+        # statistics
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    # doses left for one vaccine, or None if there is no such vaccine
+    def get(self, name):
+        return self._snapshot().get(name)
+
+    # [(name, doses)] for every vaccine, ordered by name
+    def all(self):
+        return sorted(self._snapshot().items())
+
+    # True when the next read is served from memory without a query
+    def fresh(self):
+        with self.lock:
+            return self.doses is not None and time.monotonic() - self.loaded_at < self.ttl
+
+    def invalidate(self):
+        with self.lock:
+            self.doses = None
+            self.version += 1
+            self.invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+            }
+
+    def _snapshot(self):
+        with self.lock:
+            if self.doses is not None and time.monotonic() - self.loaded_at < self.ttl:
+                self.hits += 1
+                return self.doses
+            self.misses += 1
+            version = self.version
+
+        doses = self._load()
+        with self.lock:
+            if self.version == version:
+                self.doses = doses
+                self.loaded_at = time.monotonic()
+        return doses
+
+    def _load(self):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        select_vaccines = "SELECT Name, Doses FROM Vaccines"
+        try:
+            cursor.execute(select_vaccines)
+            return {row[0]: row[1] for row in cursor}
+        finally:
+            cm.close_connection()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_inventory_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = InventoryCache(ttl=float(os.getenv("InventoryTTL", "5")))
+    return _cache
+
+
+def _cache_collector():
+    if _cache is None:
+        return []
+    stats = _cache.stats()
+    return [
+        ("scheduler_inventory_cache_lookups_total", "counter", {"result": "hit"}, stats["hits"]),
+        ("scheduler_inventory_cache_lookups_total", "counter", {"result": "miss"}, stats["misses"]),
+        ("scheduler_inventory_cache_invalidations_total", "counter", {}, stats["invalidations"]),
+    ]
+
+
+get_metrics().register_collector(_cache_collector)
@@ -0,0 +1,170 @@
+import datetime
+from db.ConnectionManager import ConnectionManager
+from db.Backend import DatabaseError
+
+
+# Versioned schema migrations. resources/create.sql builds a new database from scratch (and drops
+# whatever was there); the migrations below bring an existing database up to the same schema in
+# place, without touching its data. Each one runs in its own transaction and is recorded in
+# Schema_version when it commits, so the runner can be stopped and rerun at any point. Every step
+# checks the catalog before changing anything, which makes them safe on a database created from
+# the current create.sql as well: they find their work done and are only recorded.
+# Append new migrations at the end with the next version number; never renumber or edit old ones.
+
+
+def _password_hash_columns(backend, cursor):
+    for table in ("Caregivers", "Patients"):
+        if not backend.has_column(cursor, table, "Hash_algorithm"):
+            backend.add_column(cursor, table, "Hash_algorithm", "varchar(32)")
+        if not backend.has_column(cursor, table, "Iterations"):
+            backend.add_column(cursor, table, "Iterations", "int")
+
+
+def _id_blocks(backend, cursor):
+    if not backend.has_table(cursor, "Id_blocks"):
+        cursor.execute("CREATE TABLE Id_blocks (Name varchar(255), Next_id int, PRIMARY KEY (Name))")
+
+
+def _availabilities_caregiver_index(backend, cursor):
+    # upload/remove_availability look up one caregiver's dates; the primary key leads with Date
+    if not backend.has_index(cursor, "Availabilities", "Availabilities_caregiver"):
+        backend.create_index(cursor, "Availabilities_caregiver", "Availabilities", ("Caregiver_name", "Date"))
+
+
+def _waitlist(backend, cursor):
+    if not backend.has_table(cursor, "Waitlist"):
+        cursor.execute("CREATE TABLE Waitlist (Waitlist_id int, Date date, Patient_name varchar(255) REFERENCES Patients, "
+                       "Vaccine_name varchar(255), Priority int, PRIMARY KEY (Waitlist_id), UNIQUE (Patient_name, Date, Vaccine_name))")
+    if not backend.has_index(cursor, "Waitlist", "Waitlist_queue"):
+        backend.create_index(cursor, "Waitlist_queue", "Waitlist", ("Date", "Vaccine_name", "Priority"))
+    if not backend.has_table(cursor, "Notifications"):
+        cursor.execute("CREATE TABLE Notifications (Patient_name varchar(255) REFERENCES Patients, Appointment_id int, "
+                       "PRIMARY KEY (Patient_name, Appointment_id))")
+
+
+def _appointments_patient_index(backend, cursor):
+    # show_appointments for a patient: rows in Appointment_id order straight from the index
+    if not backend.has_index(cursor, "Appointments", "Appointments_patient"):
+        backend.create_index(cursor, "Appointments_patient", "Appointments", ("Patient_name", "Appointment_id"),
+                             include=("Date", "Caregiver_name", "Vaccine_name"))
+
+
+def _appointments_caregiver_index(backend, cursor):
+    # show_appointments for a caregiver, and the per-caregiver appointment counts of ScheduleIndex
+    if not backend.has_index(cursor, "Appointments", "Appointments_caregiver"):
+        backend.create_index(cursor, "Appointments_caregiver", "Appointments", ("Caregiver_name", "Appointment_id"),
+                             include=("Date", "Patient_name", "Vaccine_name"))
+
+
+def _summary_tables(backend, cursor):
+    # the counters start from what the live tables hold now; cancellations and doses added before
+    # the tables existed are not known
+    if not backend.has_table(cursor, "Daily_summary"):
+        cursor.execute("CREATE TABLE Daily_summary (Date date, Appointments int NOT NULL DEFAULT 0, Cancellations int NOT NULL DEFAULT 0, "
+                       "Blocked int NOT NULL DEFAULT 0, PRIMARY KEY (Date))")
+        cursor.execute("INSERT INTO Daily_summary (Date, Appointments, Cancellations, Blocked) "
+                       "SELECT v.Date, COUNT(a.Appointment_id), 0, COUNT(*) - COUNT(a.Appointment_id) FROM Availabilities v "
+                       "LEFT JOIN Appointments a ON a.Date = v.Date AND a.Caregiver_name = v.Caregiver_name GROUP BY v.Date")
+    if not backend.has_table(cursor, "Vaccine_summary"):
+        cursor.execute("CREATE TABLE Vaccine_summary (Date date, Vaccine_name varchar(255), Consumed int NOT NULL DEFAULT 0, "
+                       "Added int NOT NULL DEFAULT 0, PRIMARY KEY (Date, Vaccine_name))")
+        cursor.execute("INSERT INTO Vaccine_summary (Date, Vaccine_name, Consumed, Added) "
+                       "SELECT Date, Vaccine_name, COUNT(*), 0 FROM Appointments GROUP BY Date, Vaccine_name")
+
+
+# (version, description, step)
+MIGRATIONS = [
+    (1, "Hash_algorithm and Iterations on Caregivers and Patients", _password_hash_columns),
+    (2, "Id_blocks table for IdAllocator", _id_blocks),
+    (3, "Availabilities_caregiver index", _availabilities_caregiver_index),
+    (4, "Waitlist and Notifications tables", _waitlist),
+    (5, "Appointments_patient covering index", _appointments_patient_index),
+    (6, "Appointments_caregiver covering index", _appointments_caregiver_index),
+    (7, "Daily_summary and Vaccine_summary reporting tables", _summary_tables),
+]
+
+
+# (name, query, sample parameters) of the queries the scheduler runs most, for explain_hot_queries
+HOT_QUERIES = [
+    ("show_appointments (patient)", "SELECT Appointment_id, Date, Patient_name, Caregiver_name, Vaccine_name FROM Appointments "
+     "WHERE Patient_name = %s AND Appointment_id > %d ORDER BY Appointment_id ASC", ("p1", 0)),
+    ("show_appointments (caregiver)", "SELECT Appointment_id, Date, Patient_name, Caregiver_name, Vaccine_name FROM Appointments "
+     "WHERE Caregiver_name = %s AND Appointment_id > %d ORDER BY Appointment_id ASC", ("c1", 0)),
+    ("cancel (patient)", "SELECT Date, Caregiver_name, Vaccine_name FROM Appointments WHERE Appointment_id = %d AND Patient_name = %s",
+     (1, "p1")),
+    ("cancel (caregiver)", "SELECT Date, Caregiver_name, Vaccine_name FROM Appointments WHERE Appointment_id = %d AND Caregiver_name = %s",
+     (1, "c1")),
+    ("caregiver loads", "SELECT Caregiver_name, COUNT(*) FROM Appointments GROUP BY Caregiver_name", None),
+    ("busy caregivers on a date", "SELECT Caregiver_name FROM Availabilities WHERE Date = %s", datetime.date(2024, 1, 1)),
+    ("busy caregivers over a range", "SELECT Date, Caregiver_name FROM Availabilities WHERE Date BETWEEN %s AND %s",
+     (datetime.date(2024, 1, 1), datetime.date(2024, 12, 31))),
+    ("caregiver's blocked dates", "SELECT Date FROM Availabilities WHERE Caregiver_name = %s AND Date BETWEEN %s AND %s",
+     ("c1", datetime.date(2024, 1, 1), datetime.date(2024, 12, 31))),
+]
+
+
+def _ensure_version_table(backend, cursor, conn):
+    if not backend.has_table(cursor, "Schema_version"):
+        cursor.execute("CREATE TABLE Schema_version (Version int, Description varchar(255), Applied_on date, PRIMARY KEY (Version))")
+        conn.commit()
+
+
+# {version: date applied} of the migrations recorded in the database
+def applied_versions():
+    cm = ConnectionManager()
+    conn = cm.create_connection()
+    cursor = conn.cursor()
+    try:
+        _ensure_version_table(cm.backend, cursor, conn)
+        cursor.execute("SELECT Version, Applied_on FROM Schema_version")
+        return {row[0]: row[1] for row in cursor}
+    except DatabaseError:
+        raise
+    finally:
+        cm.close_connection()
+
+
+# [(version, description, date applied or None)] for every known migration
+def status():
+    applied = applied_versions()
+    return [(version, description, applied.get(version)) for version, description, step in MIGRATIONS]
+
+
+# Applies the pending migrations up to target (all of them by default) in version order.
+# Returns the [(version, description)] applied.
+def migrate(target=None):
+    applied = applied_versions()
+    done = []
+    for version, description, step in MIGRATIONS:
+        if version in applied or target is not None and version > target:
+            continue
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+        record = "INSERT INTO Schema_version (Version, Description, Applied_on) VALUES (%d, %s, %s)"
+        try:
+            cm.backend.begin(cursor)
+            step(cm.backend, cursor)
+            # a runner that got here first makes this fail on the primary key, undoing the step
+            cursor.execute(record, (version, description, datetime.date.today()))
+            conn.commit()
+        except DatabaseError:
+            conn.rollback()
+            raise
+        finally:
+            cm.close_connection()
+        done.append((version, description))
+    return done
+
+
+# [(name, [plan lines])] for each of HOT_QUERIES as the database would run it now
+def explain_hot_queries():
+    cm = ConnectionManager()
+    conn = cm.create_connection()
+    cursor = conn.cursor()
+    try:
+        return [(name, cm.backend.explain(cursor, query, params)) for name, query, params in HOT_QUERIES]
+    except DatabaseError:
+        raise
+    finally:
+        cm.close_connection()
@@ -0,0 +1,102 @@
+import pymssql
+import os
+from db.Backend import Backend
+
+
+class MssqlBackend(Backend):
+    name = "mssql"
+    max_params = 2000
+
+    # deadlock victim, unique index violation, primary key violation
+    RETRYABLE_ERRORS = (1205, 2601, 2627)
+
+    # Picks the first free caregiver (unless params["caregiver"] names one), takes a dose only if one is left and books both in a single batch.
+    # The Availabilities primary key stops two patients from getting the same caregiver, and the
+    # conditional UPDATE stops the last dose from being handed out twice; whoever loses either race
+    # gets an error that rolls the whole batch back and is retried.
+    reserve_batch = """
+        SET NOCOUNT ON;
+        SET XACT_ABORT ON;
+        DECLARE @caregiver varchar(255) = %(caregiver)s, @status varchar(16) = 'ok';
+        IF @caregiver IS NULL
+            SELECT TOP 1 @caregiver = Username FROM Caregivers
+                WHERE Username NOT IN (SELECT Caregiver_name FROM Availabilities WHERE Date = %(date)s)
+                ORDER BY Username ASC;
+        IF @caregiver IS NULL
+            SET @status = 'no_caregiver';
+        ELSE
+        BEGIN
+            UPDATE Vaccines SET Doses = Doses - 1 WHERE Name = %(vaccine)s AND Doses > 0;
+            IF @@ROWCOUNT = 0
+                SET @status = 'no_doses';
+            ELSE
+            BEGIN
+                INSERT INTO Availabilities VALUES (%(date)s, @caregiver);
+                INSERT INTO Appointments (Appointment_id, Date, Patient_name, Caregiver_name, Vaccine_name)
+                    VALUES (%(id)s, %(date)s, %(patient)s, @caregiver, %(vaccine)s);
+            END
+        END
+        SELECT @status AS Status, @caregiver AS Caregiver_name;
+    """
+
+    reset_session = "SET NOCOUNT OFF; SET XACT_ABORT OFF;"
+
+    def __init__(self):
+        self.server_name = os.getenv("Server") + ".database.windows.net"
+        self.db_name = os.getenv("DBName")
+        self.user = os.getenv("UserID")
+        self.password = os.getenv("Password")
+
+    def connect(self):
+        return pymssql.connect(server=self.server_name, user=self.user, password=self.password, database=self.db_name)
+
+    def is_retryable(self, e):
+        return isinstance(e, pymssql.Error) and len(e.args) > 0 and e.args[0] in self.RETRYABLE_ERRORS
+
+    def limit(self, query, n):
+        return "SELECT TOP " + str(int(n)) + query[len("SELECT"):]
+
+    def increment(self, cursor, table, key, counts):
+        # HOLDLOCK keeps two transactions from both taking the NOT MATCHED branch
+        statement = "MERGE " + table + " WITH (HOLDLOCK) AS t USING (SELECT " + ", ".join("%s AS " + c for c, v in key) + ") AS s" \
+                    " ON " + " AND ".join("t." + c + " = s." + c for c, v in key) + \
+                    " WHEN MATCHED THEN UPDATE SET " + ", ".join(c + " = t." + c + " + %d" for c, n in counts) + \
+                    " WHEN NOT MATCHED THEN INSERT (" + ", ".join([c for c, v in key] + [c for c, n in counts]) + ")" \
+                    " VALUES (" + ", ".join(["s." + c for c, v in key] + ["%d"] * len(counts)) + ");"
+        params = [v for c, v in key] + [n for c, n in counts] * 2
+        cursor.execute(statement, tuple(params))
+
+    def has_index(self, cursor, table, index):
+        cursor.execute("SELECT 1 FROM sys.indexes WHERE object_id = OBJECT_ID(%s) AND name = %s", (table, index))
+        return cursor.fetchone() is not None
+
+    def add_column(self, cursor, table, column, column_type):
+        cursor.execute("ALTER TABLE " + table + " ADD " + column + " " + column_type)
+
+    def create_index(self, cursor, index, table, keys, include=()):
+        statement = "CREATE INDEX " + index + " ON " + table + " (" + ", ".join(keys) + ")"
+        if len(include) > 0:
+            statement += " INCLUDE (" + ", ".join(include) + ")"
+        cursor.execute(statement)
+
+    def explain(self, cursor, query, params):
+        # SHOWPLAN returns the estimated plan instead of running the query
+        cursor.execute("SET SHOWPLAN_TEXT ON")
+        try:
+            cursor.execute(query, params)
+            # the first result set echoes the statement, the second one is the plan
+            cursor.nextset()
+            return [row[0].rstrip() for row in cursor]
+        finally:
+            cursor.execute("SET SHOWPLAN_TEXT OFF")
+
+    def reserve(self, conn, params):
+        cursor = conn.cursor(as_dict=True)
+        try:
+            cursor.execute(self.reserve_batch, dict(params, caregiver=params.get("caregiver")))
+            return cursor.fetchone()
+        finally:
+            # Both are session settings: left on, they would outlive the batch on the pooled
+            # connection and make rowcount -1 for every later statement. Reset here rather than at
+            # the end of the batch, which XACT_ABORT cuts short on an error.
+            conn.cursor().execute(self.reset_session)
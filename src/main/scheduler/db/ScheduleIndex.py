@@ -0,0 +1,223 @@
+import bisect
+import collections
+import os
+import threading
+import time
+from db.ConnectionManager import ConnectionManager
+from db.Backend import get_backend
+from util.Metrics import get_metrics
+
+
+# how reserve picks among the caregivers free on a date
+ALPHABETICAL = "alphabetical"
+LEAST_LOADED = "least_loaded"
+ROUND_ROBIN = "round_robin"
+STRATEGIES = (ALPHABETICAL, LEAST_LOADED, ROUND_ROBIN)
+
+
+class ScheduleIndex:
+    # In-process index of the caregivers free on each date, so reserve can pick a caregiver by
+    # load or in turn without asking the database who is free. A date is loaded with one query the
+    # first time it is asked for and then kept up to date by the reservations, cancellations and
+    # availability changes made through this process. Entries expire after ttl seconds, which
+    # bounds how long changes made by other scheduler processes go unseen; a pick that turns out to
+    # be taken fails on the Availabilities primary key and the date is reloaded. At most max_dates
+    # dates are kept, least recently used evicted first.
+
+    # the caregiver list and the appointment counts are reloaded this often
+    REFRESH = 60
+
+    def __init__(self, ttl=5, max_dates=366):
+        self.ttl = ttl
+        self.max_dates = max_dates
+        self.lock = threading.Lock()
+        # date -> (loaded at, set of free caregivers), least recently used first
+        self.free = collections.OrderedDict()
+        # every caregiver, sorted, and caregiver -> appointments booked
+        self.caregivers = None
+        self.loads = {}
+        self.refreshed_at = 0
+        self.backend = None
+        # round robin position: the caregiver picked last
+        self.last = None
+
+        # statistics
+        self.hits = 0
+        self.misses = 0
+        self.conflicts = 0
+
+    # A caregiver free on date chosen by strategy (LEAST_LOADED or ROUND_ROBIN), or None if
+    # nobody is free. The caregiver is taken out of the date's free set and counted as booked right
+    # away so concurrent reservations spread over different caregivers; give it back with
+    # release() if the reservation does not go through.
+    def pick(self, date, strategy):
+        self._refresh()
+        free = self._free_on(date)
+        with self.lock:
+            if len(free) == 0:
+                return None
+            if strategy == LEAST_LOADED:
+                caregiver = min(free, key=lambda c: (self.loads.get(c, 0), c))
+            else:
+                # the next free caregiver after the last one picked, wrapping around
+                start = 0 if self.last is None else bisect.bisect_right(self.caregivers, self.last)
+                caregiver = None
+                for i in range(len(self.caregivers)):
+                    candidate = self.caregivers[(start + i) % len(self.caregivers)]
+                    if candidate in free:
+                        caregiver = candidate
+                        break
+                if caregiver is None:
+                    caregiver = min(free)
+                self.last = caregiver
+            free.discard(caregiver)
+            self.loads[caregiver] = self.loads.get(caregiver, 0) + 1
+            return caregiver
+
+    # a picked caregiver was not booked after all; with taken, because someone else booked them
+    def release(self, date, caregiver, taken=False):
+        with self.lock:
+            if self.loads.get(caregiver, 0) > 0:
+                self.loads[caregiver] -= 1
+            if taken:
+                # the index thought the caregiver was free, so the date is loaded again
+                self.conflicts += 1
+                self.free.pop(date, None)
+                return
+            entry = self.free.get(date)
+            if entry is not None:
+                entry[1].add(caregiver)
+
+    # the caregiver now has an appointment on date, booked without pick()
+    def booked(self, date, caregiver):
+        with self.lock:
+            self._discard(date, caregiver)
+            self.loads[caregiver] = self.loads.get(caregiver, 0) + 1
+
+    # the caregiver's appointment on date was canceled
+    def canceled(self, date, caregiver):
+        with self.lock:
+            entry = self.free.get(date)
+            if entry is not None:
+                entry[1].add(caregiver)
+            if self.loads.get(caregiver, 0) > 0:
+                self.loads[caregiver] -= 1
+
+    # the caregiver blocked out these dates
+    def blocked(self, dates, caregiver):
+        with self.lock:
+            for d in dates:
+                self._discard(d, caregiver)
+
+    def add_caregiver(self, caregiver):
+        with self.lock:
+            if self.caregivers is not None and caregiver not in self.caregivers:
+                bisect.insort(self.caregivers, caregiver)
+                for loaded_at, free in self.free.values():
+                    free.add(caregiver)
+
+    # forget what is known about these dates, e.g. after a pick turned out to be taken
+    def invalidate(self, dates):
+        with self.lock:
+            for d in dates:
+                self.free.pop(d, None)
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "conflicts": self.conflicts, "dates": len(self.free)}
+
+    def _discard(self, date, caregiver):
+        entry = self.free.get(date)
+        if entry is not None:
+            entry[1].discard(caregiver)
+
+    def _free_on(self, date):
+        with self.lock:
+            entry = self.free.get(date)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self.free.move_to_end(date)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            caregivers = self.caregivers
+
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+        select_busy = "SELECT Caregiver_name FROM Availabilities WHERE Date = %s"
+        try:
+            cursor.execute(select_busy, date)
+            free = set(caregivers) - set(row[0] for row in cursor)
+        finally:
+            cm.close_connection()
+
+        with self.lock:
+            self.free[date] = (time.monotonic(), free)
+            self.free.move_to_end(date)
+            while len(self.free) > self.max_dates:
+                self.free.popitem(last=False)
+        return free
+
+    def _refresh(self):
+        with self.lock:
+            if self.backend is get_backend() and time.monotonic() - self.refreshed_at < self.REFRESH:
+                return
+
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+        select_caregivers = "SELECT Username FROM Caregivers"
+        select_loads = "SELECT Caregiver_name, COUNT(*) FROM Appointments GROUP BY Caregiver_name"
+        try:
+            cursor.execute(select_caregivers)
+            caregivers = sorted(row[0] for row in cursor)
+            cursor.execute(select_loads)
+            loads = {row[0]: row[1] for row in cursor}
+        finally:
+            cm.close_connection()
+
+        with self.lock:
+            self.caregivers = caregivers
+            self.loads = loads
+            self.refreshed_at = time.monotonic()
+            self.backend = get_backend()
+            # free sets were computed against the old caregiver list
+            self.free.clear()
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_schedule_index():
+    # ScheduleIndexTTL is in seconds; ScheduleIndexDates bounds the number of dates kept
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = ScheduleIndex(ttl=float(os.getenv("ScheduleIndexTTL", "5")),
+                                       max_dates=int(os.getenv("ScheduleIndexDates", "366")))
+    return _index
+
+
+def assign_strategy():
+    # AssignStrategy picks how reserve chooses a caregiver; alphabetical is the original behavior
+    strategy = os.getenv("AssignStrategy", ALPHABETICAL).lower()
+    if strategy not in STRATEGIES:
+        raise ValueError("Unknown assignment strategy: " + strategy)
+    return strategy
+
+
+def _index_collector():
+    if _index is None:
+        return []
+    stats = _index.stats()
+    return [
+        ("scheduler_schedule_index_lookups_total", "counter", {"result": "hit"}, stats["hits"]),
+        ("scheduler_schedule_index_lookups_total", "counter", {"result": "miss"}, stats["misses"]),
+        ("scheduler_schedule_index_conflicts_total", "counter", {}, stats["conflicts"]),
+        ("scheduler_schedule_index_dates", "gauge", {}, stats["dates"]),
+    ]
+
+
+get_metrics().register_collector(_index_collector)
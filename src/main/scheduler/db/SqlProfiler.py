@@ -0,0 +1,127 @@
+import contextvars
+import logging
+import os
+import threading
+
+
+# command the current thread (or task) is running, used to attribute statements
+current_command = contextvars.ContextVar("current_command", default="(none)")
+
+slow_log = logging.getLogger("scheduler.slow_sql")
+
+
+class _Profile:
+
+    def __init__(self):
+        self.count = 0
+        self.rows = 0
+        self.execute_time = 0.0
+        self.fetch_time = 0.0
+
+
+class SqlProfiler:
+    # Counts the statements each command issues, with rows returned and time spent executing
+    # and fetching, so the round trips behind one command (and any N+1 or repeated read) show up
+    # in summary(). Statements slower than slow_threshold seconds are logged without their
+    # parameter values.
+
+    def __init__(self, slow_threshold=0.1):
+        self.slow_threshold = slow_threshold
+        self.lock = threading.Lock()
+        # command -> number of times it ran
+        self.calls = {}
+        # (command, statement) -> _Profile
+        self.profiles = {}
+
+    def command(self, name):
+        return _CommandScope(self, name)
+
+    def record_execute(self, statement, operation, params, elapsed):
+        key = (current_command.get(), statement)
+        with self.lock:
+            profile = self.profiles.get(key)
+            if profile is None:
+                profile = self.profiles[key] = _Profile()
+            profile.count += 1
+            profile.execute_time += elapsed
+        if elapsed >= self.slow_threshold:
+            slow_log.warning("slow statement (%.1f ms) in %s: %s params=%s", elapsed * 1000, key[0],
+                             " ".join(operation.split()), redact(params))
+        return key
+
+    def record_fetch(self, key, rows, elapsed):
+        with self.lock:
+            profile = self.profiles.get(key)
+            if profile is not None:
+                profile.rows += rows
+                profile.fetch_time += elapsed
+
+    def reset(self):
+        with self.lock:
+            self.calls = {}
+            self.profiles = {}
+
+    # [(command, calls, [(statement, count, rows, execute seconds, fetch seconds)])], busiest first
+    def summary(self):
+        with self.lock:
+            calls = dict(self.calls)
+            profiles = [(key, p.count, p.rows, p.execute_time, p.fetch_time) for key, p in self.profiles.items()]
+        by_command = {}
+        for (command, statement), count, rows, execute_time, fetch_time in profiles:
+            by_command.setdefault(command, []).append((statement, count, rows, execute_time, fetch_time))
+        result = []
+        for command, statements in by_command.items():
+            statements.sort(key=lambda s: -s[1])
+            result.append((command, calls.get(command, 0), statements))
+        result.sort(key=lambda c: -sum(s[1] for s in c[2]))
+        return result
+
+    def _enter(self, name):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        return current_command.set(name)
+
+
+class _CommandScope:
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.token = self.profiler._enter(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        current_command.reset(self.token)
+        return False
+
+
+def redact(params):
+    # keep the shape of the parameters, never their values
+    if params is None:
+        return "()"
+    if isinstance(params, dict):
+        return "{" + ", ".join(f"{k}: <{type(v).__name__}>" for k, v in params.items()) + "}"
+    if not isinstance(params, (tuple, list)):
+        params = (params,)
+    return "(" + ", ".join(f"<{type(v).__name__}>" for v in params) + ")"
+
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+
+def get_sql_profiler():
+    # SlowQueryMs sets the slow statement threshold; SlowQueryLog sends the slow log to a file
+    global _profiler
+    if _profiler is None:
+        with _profiler_lock:
+            if _profiler is None:
+                _profiler = SqlProfiler(slow_threshold=float(os.getenv("SlowQueryMs", "100")) / 1000)
+                if os.getenv("SlowQueryLog"):
+                    handler = logging.FileHandler(os.getenv("SlowQueryLog"))
+                    handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+                    slow_log.addHandler(handler)
+                    slow_log.propagate = False
+    return _profiler
@@ -0,0 +1,211 @@
+import sqlite3
+import datetime
+import functools
+import os
+import re
+import threading
+from db.Backend import Backend
+
+
+# store dates the way the Date columns are declared and hand them back as datetime.date
+sqlite3.register_adapter(datetime.date, lambda d: d.isoformat())
+sqlite3.register_adapter(datetime.datetime, lambda d: d.date().isoformat())
+sqlite3.register_converter("date", lambda b: datetime.date.fromisoformat(b.decode()))
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "resources", "create.sql")
+
+_named_param = re.compile(r"%\((\w+)\)[sd]")
+_positional_param = re.compile(r"%[sd]")
+
+
+@functools.lru_cache(maxsize=256)
+def translate(operation):
+    # pymssql placeholders -> sqlite3 placeholders
+    operation = _named_param.sub(r":\1", operation)
+    operation = _positional_param.sub("?", operation)
+    return operation.replace("%%", "%")
+
+
+def _dict_row(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+class SqliteCursor:
+    # Accepts the pymssql calling conventions used throughout the scheduler: %s/%d/%(name)s
+    # placeholders, a bare value instead of a one-element tuple, and dict rows with as_dict=True.
+
+    def __init__(self, cursor, as_dict=False):
+        self.cursor = cursor
+        if as_dict:
+            self.cursor.row_factory = _dict_row
+
+    def execute(self, operation, params=None):
+        self.cursor.execute(translate(operation), self._params(params))
+        return self
+
+    def executemany(self, operation, seq_of_params):
+        self.cursor.executemany(translate(operation), [self._params(p) for p in seq_of_params])
+        return self
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchmany(self, size=None):
+        if size is None:
+            return self.cursor.fetchmany()
+        return self.cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    # sqlite3 returns one result set per statement
+    def nextset(self):
+        return None
+
+    def close(self):
+        self.cursor.close()
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def _params(self, params):
+        if params is None:
+            return ()
+        if isinstance(params, (tuple, list, dict)):
+            return params
+        return (params,)
+
+
+class SqliteConnection:
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def cursor(self, as_dict=False):
+        return SqliteCursor(self.conn.cursor(), as_dict)
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
+
+
+class SqliteBackend(Backend):
+    # Embedded backend for single-site installs, offline load tests and benchmarks.
+    # The database file is created from resources/create.sql the first time it is opened.
+    name = "sqlite"
+    # SQLITE_MAX_VARIABLE_NUMBER was raised from 999 in 3.32
+    max_params = 32766 if sqlite3.sqlite_version_info >= (3, 32, 0) else 999
+
+    def __init__(self, path="scheduler.db"):
+        self.path = path
+        self.lock = threading.Lock()
+        self.initialized = False
+        self.anchor = None
+        if path == ":memory:":
+            # a plain :memory: database is private to one connection; share one per backend instead
+            self.path = "file:scheduler-%d?mode=memory&cache=shared" % id(self)
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, uri=self.path.startswith("file:"), timeout=30,
+                               detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute("PRAGMA busy_timeout = 30000")
+        if "mode=memory" not in self.path:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+        with self.lock:
+            if not self.initialized:
+                self._create_schema(conn)
+                if "mode=memory" in self.path:
+                    # keeps the shared in-memory database alive while pooled connections come and go
+                    self.anchor = conn
+                    conn = sqlite3.connect(self.path, uri=True, timeout=30,
+                                           detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+                    conn.execute("PRAGMA foreign_keys = ON")
+                self.initialized = True
+        return SqliteConnection(conn)
+
+    def _create_schema(self, conn):
+        existing = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'Caregivers'").fetchone()
+        if existing is not None:
+            return
+        with open(SCHEMA_FILE) as f:
+            conn.executescript(f.read())
+        conn.commit()
+
+    def is_retryable(self, e):
+        if isinstance(e, sqlite3.IntegrityError):
+            return True
+        return isinstance(e, sqlite3.OperationalError) and "locked" in str(e)
+
+    def limit(self, query, n):
+        return query + " LIMIT " + str(int(n))
+
+    def increment(self, cursor, table, key, counts):
+        columns = [c for c, v in key] + [c for c, n in counts]
+        statement = "INSERT INTO " + table + " (" + ", ".join(columns) + ") VALUES (" + ", ".join(["%s"] * len(columns)) + ")" \
+                    " ON CONFLICT (" + ", ".join(c for c, v in key) + ") DO UPDATE SET " \
+                    + ", ".join(c + " = " + c + " + excluded." + c for c, n in counts)
+        cursor.execute(statement, tuple(v for c, v in key) + tuple(n for c, n in counts))
+
+    def begin(self, cursor):
+        # sqlite3 only opens transactions implicitly before DML, so reads and DDL need an explicit one
+        cursor.execute("BEGIN")
+
+    def has_table(self, cursor, table):
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", table)
+        return cursor.fetchone() is not None
+
+    def has_column(self, cursor, table, column):
+        cursor.execute("SELECT 1 FROM pragma_table_info(%s) WHERE name = %s", (table, column))
+        return cursor.fetchone() is not None
+
+    def has_index(self, cursor, table, index):
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND name = %s", (table, index))
+        return cursor.fetchone() is not None
+
+    def add_column(self, cursor, table, column, column_type):
+        cursor.execute("ALTER TABLE " + table + " ADD COLUMN " + column + " " + column_type)
+
+    def create_index(self, cursor, index, table, keys, include=()):
+        # no INCLUDE in SQLite; trailing key columns cover the query just the same
+        cursor.execute("CREATE INDEX " + index + " ON " + table + " (" + ", ".join(list(keys) + list(include)) + ")")
+
+    def explain(self, cursor, query, params):
+        cursor.execute("EXPLAIN QUERY PLAN " + query, params)
+        return [row[-1] for row in cursor]
+
+    def reserve(self, conn, params):
+        cursor = conn.cursor(as_dict=True)
+        # take the write lock up front so the caregiver we pick cannot be taken before we insert
+        cursor.execute("BEGIN IMMEDIATE")
+        caregiver = params.get("caregiver")
+        if caregiver is None:
+            select_caregiver = "SELECT Username FROM Caregivers WHERE Username NOT IN (SELECT Caregiver_name FROM Availabilities WHERE Date = %(date)s) ORDER BY Username ASC LIMIT 1"
+            cursor.execute(select_caregiver, params)
+            row = cursor.fetchone()
+            if row is None:
+                return {"Status": "no_caregiver", "Caregiver_name": None}
+            caregiver = row["Username"]
+
+        cursor.execute("UPDATE Vaccines SET Doses = Doses - 1 WHERE Name = %(vaccine)s AND Doses > 0", params)
+        if cursor.rowcount == 0:
+            return {"Status": "no_doses", "Caregiver_name": caregiver}
+
+        cursor.execute("INSERT INTO Availabilities VALUES (%s, %s)", (params["date"], caregiver))
+        insert_appointment = "INSERT INTO Appointments (Appointment_id, Date, Patient_name, Caregiver_name, Vaccine_name) VALUES (%s, %s, %s, %s, %s)"
+        cursor.execute(insert_appointment, (params["id"], params["date"], params["patient"], caregiver, params["vaccine"]))
+        return {"Status": "ok", "Caregiver_name": caregiver}
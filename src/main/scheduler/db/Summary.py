@@ -0,0 +1,72 @@
+import datetime
+from db.ConnectionManager import ConnectionManager
+from db.Backend import DatabaseError
+
+
+class SummaryDelta:
+    # Changes to the reporting tables made by one transaction. The code that books, cancels or
+    # blocks records what it did here and calls write() with its own cursor before committing, so
+    # the summaries move together with the rows they count and reports never aggregate the live
+    # tables. Changes to the same row are summed first, so a batch pays one statement per date.
+    #   Daily_summary (Date): Appointments on the date (net of cancellations), Cancellations of
+    #       appointments on the date, and Blocked caregiver-days with no appointment
+    #   Vaccine_summary (Date, Vaccine_name): doses Consumed by appointments on the date (net of
+    #       cancellations) and doses Added by add_doses that day
+
+    def __init__(self):
+        # date -> {column: change}
+        self.daily = {}
+        # (date, vaccine name) -> {column: change}
+        self.vaccines = {}
+
+    def booked(self, d, vaccine_name, n=1):
+        self._add(self.daily, d, "Appointments", n)
+        self._add(self.vaccines, (d, vaccine_name), "Consumed", n)
+
+    def canceled(self, d, vaccine_name, n=1):
+        self._add(self.daily, d, "Appointments", -n)
+        self._add(self.daily, d, "Cancellations", n)
+        self._add(self.vaccines, (d, vaccine_name), "Consumed", -n)
+
+    # n caregiver-days blocked on d without an appointment (negative when unblocked)
+    def blocked(self, d, n=1):
+        self._add(self.daily, d, "Blocked", n)
+
+    def added(self, vaccine_name, n):
+        self._add(self.vaccines, (datetime.date.today(), vaccine_name), "Added", n)
+
+    def write(self, backend, cursor):
+        for d, counts in sorted(self.daily.items()):
+            backend.increment(cursor, "Daily_summary", (("Date", d),), sorted(counts.items()))
+        for (d, vaccine_name), counts in sorted(self.vaccines.items()):
+            backend.increment(cursor, "Vaccine_summary", (("Date", d), ("Vaccine_name", vaccine_name)), sorted(counts.items()))
+
+    def _add(self, table, key, column, n):
+        counts = table.setdefault(key, {})
+        counts[column] = counts.get(column, 0) + n
+
+
+# ([(date, appointments, cancellations, blocked)], [(date, vaccine name, consumed, added)], caregivers)
+# for the dates from start to end that had any activity: two range reads on the summary primary
+# keys, whatever the number of appointments behind them
+def read_summary(start, end):
+    cm = ConnectionManager()
+    conn = cm.create_connection()
+    cursor = conn.cursor()
+
+    select_daily = "SELECT Date, Appointments, Cancellations, Blocked FROM Daily_summary WHERE Date BETWEEN %s AND %s ORDER BY Date"
+    select_vaccines = "SELECT Date, Vaccine_name, Consumed, Added FROM Vaccine_summary WHERE Date BETWEEN %s AND %s " \
+                      "ORDER BY Date, Vaccine_name"
+    count_caregivers = "SELECT COUNT(*) FROM Caregivers"
+    try:
+        cursor.execute(select_daily, (start, end))
+        daily = [(row[0], row[1], row[2], row[3]) for row in cursor]
+        cursor.execute(select_vaccines, (start, end))
+        vaccines = [(row[0], row[1], row[2], row[3]) for row in cursor]
+        cursor.execute(count_caregivers)
+        caregivers = cursor.fetchone()[0]
+        return daily, vaccines, caregivers
+    except DatabaseError:
+        raise
+    finally:
+        cm.close_connection()
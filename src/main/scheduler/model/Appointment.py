@@ -0,0 +1,232 @@
+import sys
+sys.path.append("../db/*")
+from db.ConnectionManager import ConnectionManager
+from db.Backend import DatabaseError
+from db.InventoryCache import get_inventory_cache
+from db.IdAllocator import get_id_allocator
+from db.ScheduleIndex import get_schedule_index, assign_strategy, ALPHABETICAL
+from db.AvailabilityCalendar import get_availability_calendar
+from db.Summary import SummaryDelta
+import datetime
+import random
+import time
+
+
+class Appointment:
+    # outcomes of reserve()
+    RESERVED = "ok"
+    NO_CAREGIVER = "no_caregiver"
+    NO_DOSES = "no_doses"
+
+    MAX_ATTEMPTS = 5
+    # how far past the requested date reserve_series looks for the first dose
+    SERIES_SEARCH_DAYS = 180
+    # rows read from the cursor at a time by appointments_for
+    FETCH_ROWS = 100
+
+    def __init__(self, appointment_id, date, patient_name, caregiver_name=None, vaccine_name=None):
+        self.appointment_id = appointment_id
+        self.date = date
+        self.patient_name = patient_name
+        self.caregiver_name = caregiver_name
+        self.vaccine_name = vaccine_name
+
+    def get_appointment_id(self):
+        return self.appointment_id
+
+    def get_caregiver_name(self):
+        return self.caregiver_name
+
+    # unique across threads and scheduler processes; see IdAllocator
+    @staticmethod
+    def generate_id():
+        return get_id_allocator("Appointments", "Appointment_id").next_id()
+
+    # Reserve a caregiver and a dose for this appointment in one transaction.
+    # Returns one of RESERVED, NO_CAREGIVER or NO_DOSES; losing a race is retried internally.
+    # The caregiver is the alphabetically first free one, or with AssignStrategy set to
+    # least_loaded or round_robin the one the schedule index picks.
+    def reserve(self):
+        strategy = assign_strategy()
+        index = get_schedule_index()
+        for attempt in range(self.MAX_ATTEMPTS):
+            # the id lease and the schedule index may open connections of their own, so both run
+            # before this one is taken: holding a pooled connection while waiting for another can
+            # starve a saturated pool
+            if self.appointment_id is None:
+                self.appointment_id = self.generate_id()
+            caregiver = None
+            if strategy != ALPHABETICAL:
+                caregiver = index.pick(self.date, strategy)
+                if caregiver is None:
+                    return self.NO_CAREGIVER
+            params = {"date": self.date, "vaccine": self.vaccine_name, "caregiver": caregiver,
+                      "id": self.appointment_id, "patient": self.patient_name}
+            cm = ConnectionManager()
+            conn = cm.create_connection()
+            try:
+                try:
+                    row = cm.backend.reserve(conn, params)
+                    if row['Status'] == self.RESERVED:
+                        # counted in the transaction that books it
+                        summary = SummaryDelta()
+                        summary.booked(self.date, self.vaccine_name)
+                        summary.write(cm.backend, conn.cursor())
+                except DatabaseError as e:
+                    conn.rollback()
+                    if caregiver is not None:
+                        index.release(self.date, caregiver, taken=True)
+                    if not cm.backend.is_retryable(e) or attempt == self.MAX_ATTEMPTS - 1:
+                        raise
+                    row = None
+
+                if row is not None and row['Status'] != self.RESERVED:
+                    conn.rollback()
+                    if caregiver is not None:
+                        index.release(self.date, caregiver)
+                    return row['Status']
+                if row is not None:
+                    conn.commit()
+            finally:
+                cm.close_connection()
+
+            if row is None:
+                # back off a little so the competing reservations can finish
+                time.sleep(random.uniform(0, 0.01 * (2 ** attempt)))
+                continue
+            get_inventory_cache().invalidate()
+            self.caregiver_name = row['Caregiver_name']
+            if caregiver is None:
+                index.booked(self.date, self.caregiver_name)
+            get_availability_calendar().mark_busy([self.date], self.caregiver_name)
+            return self.RESERVED
+
+    # Reserve `doses` appointments for the patient, `interval` days apart, on the earliest series
+    # starting within SERIES_SEARCH_DAYS of start whose dates all have a free caregiver. The
+    # doses for the whole series are taken up front and every appointment is booked in the same
+    # transaction, so the patient gets all of them or none.
+    # Returns (status, [Appointment]) with status RESERVED, NO_CAREGIVER or NO_DOSES.
+    @staticmethod
+    def reserve_series(patient_name, start, vaccine_name, doses, interval):
+        strategy = assign_strategy()
+        index = get_schedule_index()
+        calendar = get_availability_calendar()
+        end = start + datetime.timedelta(days=Appointment.SERIES_SEARCH_DAYS - 1)
+        for attempt in range(Appointment.MAX_ATTEMPTS):
+            starts = calendar.series_starts(start, end, doses, interval, limit=1)
+            if len(starts) == 0:
+                return Appointment.NO_CAREGIVER, []
+            dates = [starts[0] + datetime.timedelta(days=k * interval) for k in range(doses)]
+            if strategy == ALPHABETICAL:
+                caregivers = [calendar.free_caregivers(d)[0] for d in dates]
+            else:
+                caregivers = [index.pick(d, strategy) for d in dates]
+                if None in caregivers:
+                    Appointment._release(dates, caregivers, False)
+                    calendar.invalidate(dates)
+                    continue
+            # ids are leased before the transaction takes the write lock
+            appointments = [Appointment(Appointment.generate_id(), d, patient_name, c, vaccine_name)
+                            for d, c in zip(dates, caregivers)]
+
+            cm = ConnectionManager()
+            conn = cm.create_connection()
+            cursor = conn.cursor()
+            try:
+                take_doses = "UPDATE Vaccines SET Doses = Doses - %d WHERE Name = %s AND Doses >= %d"
+                cursor.execute(take_doses, (doses, vaccine_name, doses))
+                if cursor.rowcount == 0:
+                    conn.rollback()
+                    Appointment._release(dates, caregivers, False)
+                    return Appointment.NO_DOSES, []
+                # the Availabilities primary key rejects a caregiver booked since the calendar saw them free
+                add_availability = "INSERT INTO Availabilities VALUES " + ", ".join(["(%s, %s)"] * doses)
+                params = []
+                for a in appointments:
+                    params.extend((a.date, a.caregiver_name))
+                cursor.execute(add_availability, tuple(params))
+                insert_appointments = "INSERT INTO Appointments (Appointment_id, Date, Patient_name, Caregiver_name, Vaccine_name) VALUES " \
+                                      + ", ".join(["(%s, %s, %s, %s, %s)"] * doses)
+                params = []
+                for a in appointments:
+                    params.extend((a.appointment_id, a.date, a.patient_name, a.caregiver_name, a.vaccine_name))
+                cursor.execute(insert_appointments, tuple(params))
+                summary = SummaryDelta()
+                for a in appointments:
+                    summary.booked(a.date, a.vaccine_name)
+                summary.write(cm.backend, cursor)
+                conn.commit()
+            except DatabaseError as e:
+                conn.rollback()
+                Appointment._release(dates, caregivers, True)
+                calendar.invalidate(dates)
+                if not cm.backend.is_retryable(e) or attempt == Appointment.MAX_ATTEMPTS - 1:
+                    raise
+                time.sleep(random.uniform(0, 0.01 * (2 ** attempt)))
+                continue
+            finally:
+                cm.close_connection()
+
+            get_inventory_cache().invalidate()
+            for a in appointments:
+                if strategy == ALPHABETICAL:
+                    index.booked(a.date, a.caregiver_name)
+                calendar.mark_busy([a.date], a.caregiver_name)
+            return Appointment.RESERVED, appointments
+        return Appointment.NO_CAREGIVER, []
+
+    # Yields, in Appointment_id order, up to limit (None for all) Appointments of the patient or
+    # caregiver (role "patient" or "caregiver") with an id greater than after, optionally only
+    # between start and end and for one vaccine. Pages continue from the last id returned (keyset
+    # pagination), so a page costs the same however deep into the history it is. Rows are fetched
+    # FETCH_ROWS at a time and the connection is held until the generator is exhausted or closed.
+    @staticmethod
+    def appointments_for(role, username, start=None, end=None, vaccine_name=None, after=None, limit=None):
+        column = "Patient_name" if role == "patient" else "Caregiver_name"
+        filters = column + " = %s"
+        params = [username]
+        if after is not None:
+            filters += " AND Appointment_id > %d"
+            params.append(after)
+        if start is not None:
+            filters += " AND Date >= %s"
+            params.append(start)
+        if end is not None:
+            filters += " AND Date <= %s"
+            params.append(end)
+        if vaccine_name is not None:
+            filters += " AND Vaccine_name = %s"
+            params.append(vaccine_name)
+        select_appointments = "SELECT Appointment_id, Date, Patient_name, Caregiver_name, Vaccine_name FROM Appointments WHERE " \
+                              + filters + " ORDER BY Appointment_id ASC"
+
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+        if limit is not None:
+            select_appointments = cm.backend.limit(select_appointments, limit)
+        try:
+            cursor.execute(select_appointments, tuple(params))
+            while True:
+                rows = cursor.fetchmany(Appointment.FETCH_ROWS)
+                if len(rows) == 0:
+                    break
+                for row in rows:
+                    yield Appointment(row[0], row[1], row[2], row[3], row[4])
+        except DatabaseError:
+            raise
+        finally:
+            cm.close_connection()
+
+    # hands caregivers picked from the schedule index back after a series fell through
+    @staticmethod
+    def _release(dates, caregivers, taken):
+        if assign_strategy() == ALPHABETICAL:
+            return
+        index = get_schedule_index()
+        for d, c in zip(dates, caregivers):
+            if c is not None:
+                index.release(d, c, taken)
+
+    def __str__(self):
+        return f"(Appointment ID: {self.appointment_id}, Caregiver username: {self.caregiver_name})"
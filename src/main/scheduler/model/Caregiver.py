@@ -3,15 +3,28 @@ sys.path.append("../util/*")
 sys.path.append("../db/*")
 from util.Util import Util
 from db.ConnectionManager import ConnectionManager
-import pymssql
+from db.Backend import DatabaseError
+from db.AsyncExecutor import run_blocking
+from db.InventoryCache import get_inventory_cache
+from db.ScheduleIndex import get_schedule_index
+from db.AvailabilityCalendar import get_availability_calendar
+from db.Summary import SummaryDelta
+import asyncio
+import datetime
+import random
+import time
 
 
 class Caregiver:
-    def __init__(self, username, password=None, salt=None, hash=None):
+    MAX_ATTEMPTS = 5
+
+    def __init__(self, username, password=None, salt=None, hash=None, algorithm=None, iterations=None):
         self.username = username
         self.password = password
         self.salt = salt
         self.hash = hash
+        self.algorithm = algorithm
+        self.iterations = iterations
 
     # getters
     def get(self):
@@ -19,27 +32,40 @@ class Caregiver:
         conn = cm.create_connection()
         cursor = conn.cursor(as_dict=True)
 
-        get_caregiver_details = "SELECT Salt, Hash FROM Caregivers WHERE Username = %s"
+        get_caregiver_details = "SELECT Salt, Hash, Hash_algorithm, Iterations FROM Caregivers WHERE Username = %s"
         try:
             cursor.execute(get_caregiver_details, self.username)
-            for row in cursor:
-                curr_salt = row['Salt']
-                curr_hash = row['Hash']
-                calculated_hash = Util.generate_hash(self.password, curr_salt)
-                if not curr_hash == calculated_hash:
-                    # print("Incorrect password")
-                    cm.close_connection()
-                    return None
-                else:
-                    self.salt = curr_salt
-                    self.hash = calculated_hash
-                    cm.close_connection()
-                    return self
-        except pymssql.Error as e:
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            algorithm, iterations = Util.hash_params(row['Hash_algorithm'], row['Iterations'])
+            if not Util.verify_hash(self.password, row['Salt'], row['Hash'], algorithm, iterations):
+                # print("Incorrect password")
+                return None
+            self.salt = row['Salt']
+            self.hash = row['Hash']
+            self.algorithm = algorithm
+            self.iterations = iterations
+
+            # the password is known now, so upgrade a hash made with an outdated cost
+            if Util.needs_rehash(algorithm, iterations):
+                self.salt = Util.generate_salt()
+                self.algorithm = Util.hash_algorithm()
+                self.iterations = Util.hash_iterations()
+                self.hash = Util.generate_hash(self.password, self.salt, self.algorithm, self.iterations)
+                update_hash = "UPDATE Caregivers SET Salt = %s, Hash = %s, Hash_algorithm = %s, Iterations = %d WHERE Username = %s"
+                cursor.execute(update_hash, (self.salt, self.hash, self.algorithm, self.iterations, self.username))
+                conn.commit()
+            return self
+        except DatabaseError as e:
             raise e
         finally:
             cm.close_connection()
-        return None
+
+    # awaitable counterparts of the methods above and below; each runs the blocking call on the
+    # bounded async executor with its own pooled connection
+    async def get_async(self):
+        return await run_blocking(self.get)
 
     def get_username(self):
         return self.username
@@ -50,20 +76,31 @@ class Caregiver:
     def get_hash(self):
         return self.hash
 
+    def get_algorithm(self):
+        return self.algorithm
+
+    def get_iterations(self):
+        return self.iterations
+
     def save_to_db(self):
         cm = ConnectionManager()
         conn = cm.create_connection()
         cursor = conn.cursor()
 
-        add_caregivers = "INSERT INTO Caregivers VALUES (%s, %s, %s)"
+        add_caregivers = "INSERT INTO Caregivers (Username, Salt, Hash, Hash_algorithm, Iterations) VALUES (%s, %s, %s, %s, %s)"
         try:
-            cursor.execute(add_caregivers, (self.username, self.salt, self.hash))
+            cursor.execute(add_caregivers, (self.username, self.salt, self.hash, self.algorithm, self.iterations))
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
-        except pymssql.Error:
+        except DatabaseError:
             raise
         finally:
             cm.close_connection()
+        get_schedule_index().add_caregiver(self.username)
+        get_availability_calendar().add_caregiver(self.username)
+
+    async def save_to_db_async(self):
+        return await run_blocking(self.save_to_db)
 
     # Insert availability with parameter date d
     def upload_availability(self, d):
@@ -72,12 +109,306 @@ class Caregiver:
         cursor = conn.cursor()
 
         add_availability = "INSERT INTO Availabilities VALUES (%s , %s)"
+        summary = SummaryDelta()
+        summary.blocked(d)
         try:
             cursor.execute(add_availability, (d, self.username))
+            summary.write(cm.backend, cursor)
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
-        except pymssql.Error:
+        except DatabaseError:
             # print("Error occurred when updating caregiver availability")
             raise
         finally:
             cm.close_connection()
+        get_schedule_index().blocked([d], self.username)
+        get_availability_calendar().mark_busy([d], self.username)
+
+    async def upload_availability_async(self, d):
+        return await run_blocking(self.upload_availability, d)
+
+    # Insert availability for many dates in one transaction, skipping dates that already have a row.
+    # Returns the number of rows inserted.
+    def upload_availabilities(self, dates):
+        dates = sorted(set(dates))
+        if len(dates) == 0:
+            return 0
+
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        select_existing = "SELECT Date FROM Availabilities WHERE Caregiver_name = %s AND Date BETWEEN %s AND %s"
+        batch_size = cm.backend.max_batch_rows(2)
+        try:
+            for attempt in range(2):
+                try:
+                    cursor.execute(select_existing, (self.username, dates[0], dates[-1]))
+                    existing = set(row[0] for row in cursor)
+                    new_dates = [d for d in dates if d not in existing]
+                    for i in range(0, len(new_dates), batch_size):
+                        batch = new_dates[i:i + batch_size]
+                        add_availability = "INSERT INTO Availabilities VALUES " + ", ".join(["(%s, %s)"] * len(batch))
+                        params = []
+                        for d in batch:
+                            params.extend((d, self.username))
+                        cursor.execute(add_availability, tuple(params))
+                    summary = SummaryDelta()
+                    for d in new_dates:
+                        summary.blocked(d)
+                    summary.write(cm.backend, cursor)
+                    conn.commit()
+                    get_schedule_index().blocked(new_dates, self.username)
+                    get_availability_calendar().mark_busy(new_dates, self.username)
+                    return len(new_dates)
+                except DatabaseError as e:
+                    # a reservation booked one of the dates in between; read the existing rows again
+                    conn.rollback()
+                    if attempt == 1 or not cm.backend.is_retryable(e):
+                        raise
+        finally:
+            cm.close_connection()
+
+    async def upload_availabilities_async(self, dates):
+        return await run_blocking(self.upload_availabilities, dates)
+
+    # Remove availability for many dates, one batch of dates per statement. Dates with a booked
+    # appointment are kept. Returns the number of rows removed.
+    def remove_availabilities(self, dates):
+        dates = sorted(set(dates))
+        if len(dates) == 0:
+            return 0
+
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        removed = 0
+        summary = SummaryDelta()
+        batch_size = cm.backend.max_batch_rows(1) - 1
+        try:
+            # the dates removed are read first, in the same transaction, so the summary counts them
+            cm.backend.begin(cursor)
+            for i in range(0, len(dates), batch_size):
+                batch = dates[i:i + batch_size]
+                removable = "FROM Availabilities WHERE Caregiver_name = %s AND Date IN (" + ", ".join(["%s"] * len(batch)) + ") " \
+                            "AND NOT EXISTS (SELECT 1 FROM Appointments WHERE Appointments.Caregiver_name = Availabilities.Caregiver_name AND Appointments.Date = Availabilities.Date)"
+                cursor.execute("SELECT Date " + removable, (self.username,) + tuple(batch))
+                for row in cursor.fetchall():
+                    summary.blocked(row[0], -1)
+                cursor.execute("DELETE " + removable, (self.username,) + tuple(batch))
+                removed += cursor.rowcount
+            summary.write(cm.backend, cursor)
+            conn.commit()
+        except DatabaseError:
+            conn.rollback()
+            raise
+        finally:
+            cm.close_connection()
+        # dates with an appointment were kept, so the index reloads these dates rather than guess
+        get_schedule_index().invalidate(dates)
+        get_availability_calendar().invalidate(dates)
+        return removed
+
+    async def remove_availabilities_async(self, dates):
+        return await run_blocking(self.remove_availabilities, dates)
+
+    # The caregiver cannot work from start to end: every date in the range is blocked and each of
+    # their appointments in it moves to the alphabetically first caregiver free that date. The
+    # appointments nobody can take are canceled and their doses returned. All in one transaction.
+    # Returns ([(appointment id, date, new caregiver)], [(appointment id, date)] canceled, dates blocked).
+    def call_out(self, start, end):
+        dates = [start + datetime.timedelta(days=i) for i in range((end - start).days + 1)]
+        if len(dates) == 0:
+            return [], [], 0
+
+        select_existing = "SELECT Date FROM Availabilities WHERE Caregiver_name = %s AND Date BETWEEN %s AND %s"
+        select_appointments = "SELECT Appointment_id, Date, Vaccine_name FROM Appointments WHERE Caregiver_name = %s " \
+                              "AND Date BETWEEN %s AND %s ORDER BY Date"
+        # the caregiver's own row for each date is in Availabilities already, so they never replace themselves
+        select_replacements = "SELECT a.Date, MIN(c.Username) FROM Appointments a, Caregivers c " \
+                              "WHERE a.Caregiver_name = %s AND a.Date BETWEEN %s AND %s AND NOT EXISTS " \
+                              "(SELECT 1 FROM Availabilities v WHERE v.Date = a.Date AND v.Caregiver_name = c.Username) " \
+                              "GROUP BY a.Date"
+        move_appointment = "UPDATE Appointments SET Caregiver_name = %s WHERE Appointment_id = %d"
+        return_doses = "UPDATE Vaccines SET Doses = Doses + %d WHERE Name = %s"
+        for attempt in range(Caregiver.MAX_ATTEMPTS):
+            cm = ConnectionManager()
+            conn = cm.create_connection()
+            cursor = conn.cursor()
+            batch_size = cm.backend.max_batch_rows(2)
+            try:
+                cm.backend.begin(cursor)
+                cursor.execute(select_existing, (self.username, start, end))
+                existing = set(row[0] for row in cursor)
+                new_dates = [d for d in dates if d not in existing]
+                for i in range(0, len(new_dates), batch_size):
+                    batch = new_dates[i:i + batch_size]
+                    add_availability = "INSERT INTO Availabilities VALUES " + ", ".join(["(%s, %s)"] * len(batch))
+                    params = []
+                    for d in batch:
+                        params.extend((d, self.username))
+                    cursor.execute(add_availability, tuple(params))
+
+                cursor.execute(select_appointments, (self.username, start, end))
+                appointments = [(row[0], row[1], row[2]) for row in cursor]
+                cursor.execute(select_replacements, (self.username, start, end))
+                replacements = {row[0]: row[1] for row in cursor}
+
+                # a caregiver has at most one appointment per date, so each replacement is used once
+                moved = [(appointment_id, d, replacements[d]) for appointment_id, d, vaccine_name in appointments
+                         if d in replacements]
+                canceled = [(appointment_id, d, vaccine_name) for appointment_id, d, vaccine_name in appointments
+                            if d not in replacements]
+                # the Availabilities primary key rejects a replacement booked by someone else meanwhile
+                for i in range(0, len(moved), batch_size):
+                    batch = moved[i:i + batch_size]
+                    add_availability = "INSERT INTO Availabilities VALUES " + ", ".join(["(%s, %s)"] * len(batch))
+                    params = []
+                    for appointment_id, d, caregiver in batch:
+                        params.extend((d, caregiver))
+                    cursor.execute(add_availability, tuple(params))
+                if len(moved) > 0:
+                    cursor.executemany(move_appointment, [(caregiver, appointment_id) for appointment_id, d, caregiver in moved])
+
+                batch_size = cm.backend.max_batch_rows(1)
+                for i in range(0, len(canceled), batch_size):
+                    batch = canceled[i:i + batch_size]
+                    delete_appointments = "DELETE FROM Appointments WHERE Appointment_id IN (" + ", ".join(["%d"] * len(batch)) + ")"
+                    cursor.execute(delete_appointments, tuple(appointment_id for appointment_id, d, vaccine_name in batch))
+                doses = {}
+                for appointment_id, d, vaccine_name in canceled:
+                    doses[vaccine_name] = doses.get(vaccine_name, 0) + 1
+                for vaccine_name, count in sorted(doses.items()):
+                    cursor.execute(return_doses, (count, vaccine_name))
+
+                # the caregiver's row stays on every date they had an appointment, now without one
+                summary = SummaryDelta()
+                for d in new_dates:
+                    summary.blocked(d)
+                for appointment_id, d, caregiver in moved:
+                    summary.blocked(d)
+                for appointment_id, d, vaccine_name in canceled:
+                    summary.blocked(d)
+                    summary.canceled(d, vaccine_name)
+                summary.write(cm.backend, cursor)
+                conn.commit()
+            except DatabaseError as e:
+                conn.rollback()
+                if not cm.backend.is_retryable(e) or attempt == Caregiver.MAX_ATTEMPTS - 1:
+                    raise
+                time.sleep(random.uniform(0, 0.01 * (2 ** attempt)))
+                continue
+            finally:
+                cm.close_connection()
+
+            # who is free changed on every date of the range in more ways than the caches track
+            get_schedule_index().invalidate(dates)
+            get_availability_calendar().invalidate(dates)
+            if len(canceled) > 0:
+                get_inventory_cache().invalidate()
+            return moved, [(appointment_id, d) for appointment_id, d, vaccine_name in canceled], len(new_dates)
+
+    # Free caregivers for each of the given dates plus the current dose counts.
+    # Returns ({date: [usernames] or count}, [(vaccine name, doses)]).
+    @staticmethod
+    def search_schedule(dates, count_only=False):
+        # dose counts come from the inventory cache, not from the database
+        return Caregiver.search_caregivers(dates, count_only), get_inventory_cache().all()
+
+    # Same as search_schedule, with the caregivers and the dose counts fetched at the same time
+    @staticmethod
+    async def search_schedule_async(dates, count_only=False):
+        cache = get_inventory_cache()
+        if cache.fresh():
+            # nothing to overlap when the dose counts are already in memory
+            return await run_blocking(Caregiver.search_caregivers, dates, count_only), cache.all()
+        schedule, vaccines = await asyncio.gather(run_blocking(Caregiver.search_caregivers, dates, count_only),
+                                                  run_blocking(cache.all))
+        return schedule, vaccines
+
+    # Free caregivers for each of the given dates, in one query per batch of dates. With count_only
+    # the caregivers are only counted, not listed. Returns {date: [usernames] or count}.
+    @staticmethod
+    def search_caregivers(dates, count_only=False):
+        dates = sorted(set(dates))
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        schedule = {d: 0 if count_only else [] for d in dates}
+        # each date costs two parameters in the derived table below
+        batch_size = cm.backend.max_batch_rows(2)
+        try:
+            for i in range(0, len(dates), batch_size):
+                batch = dates[i:i + batch_size]
+                # the dates travel as a derived table so one statement covers the whole range; the
+                # NOT EXISTS probe is a seek on the (Date, Caregiver_name) primary key
+                days = " UNION ALL ".join(["SELECT %s AS Day, %s AS Date"] * len(batch))
+                params = []
+                for day, d in enumerate(batch):
+                    params.extend((day, d))
+                free = "FROM (" + days + ") d CROSS JOIN Caregivers c " \
+                       "WHERE NOT EXISTS (SELECT 1 FROM Availabilities a WHERE a.Date = d.Date AND a.Caregiver_name = c.Username)"
+                if count_only:
+                    search = "SELECT d.Day, COUNT(*) " + free + " GROUP BY d.Day"
+                else:
+                    search = "SELECT d.Day, c.Username " + free + " ORDER BY d.Day, c.Username"
+                cursor.execute(search, tuple(params))
+                for day, value in cursor:
+                    if count_only:
+                        schedule[batch[day]] = value
+                    else:
+                        schedule[batch[day]].append(value)
+        except DatabaseError:
+            raise
+        finally:
+            cm.close_connection()
+        return schedule
+
+    # Usernames among the given ones that already belong to a caregiver, checked with a few IN queries
+    @staticmethod
+    def existing_usernames(usernames):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        taken = set()
+        usernames = list(usernames)
+        batch_size = cm.backend.max_batch_rows(1)
+        try:
+            for i in range(0, len(usernames), batch_size):
+                batch = usernames[i:i + batch_size]
+                select_usernames = "SELECT Username FROM Caregivers WHERE Username IN (" + ", ".join(["%s"] * len(batch)) + ")"
+                cursor.execute(select_usernames, tuple(batch))
+                taken.update(row[0] for row in cursor)
+        except DatabaseError:
+            raise
+        finally:
+            cm.close_connection()
+        return taken
+
+    # Insert many caregivers with multi-row INSERTs and a single commit
+    @staticmethod
+    def save_many(caregivers):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        batch_size = cm.backend.max_batch_rows(5)
+        try:
+            for i in range(0, len(caregivers), batch_size):
+                batch = caregivers[i:i + batch_size]
+                add_caregivers = "INSERT INTO Caregivers (Username, Salt, Hash, Hash_algorithm, Iterations) VALUES " + ", ".join(["(%s, %s, %s, %s, %s)"] * len(batch))
+                params = []
+                for caregiver in batch:
+                    params.extend((caregiver.username, caregiver.salt, caregiver.hash, caregiver.algorithm, caregiver.iterations))
+                cursor.execute(add_caregivers, tuple(params))
+            conn.commit()
+        except DatabaseError:
+            raise
+        finally:
+            cm.close_connection()
+        for caregiver in caregivers:
+            get_schedule_index().add_caregiver(caregiver.username)
+            get_availability_calendar().add_caregiver(caregiver.username)
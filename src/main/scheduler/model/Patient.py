@@ -3,15 +3,18 @@ sys.path.append("../util/*")
 sys.path.append("../db/*")
 from util.Util import Util
 from db.ConnectionManager import ConnectionManager
-import pymssql
+from db.Backend import DatabaseError
+from db.AsyncExecutor import run_blocking
 
 
 class Patient:
-    def __init__(self, username, password=None, salt=None, hash=None):
+    def __init__(self, username, password=None, salt=None, hash=None, algorithm=None, iterations=None):
         self.username = username
         self.password = password
         self.salt = salt
         self.hash = hash
+        self.algorithm = algorithm
+        self.iterations = iterations
 
     # getters
     def get(self):
@@ -19,28 +22,39 @@ class Patient:
         conn = cm.create_connection()
         cursor = conn.cursor(as_dict=True)
 
-        get_patient_details = "SELECT Salt, Hash FROM Patients WHERE Username = %s"
+        get_patient_details = "SELECT Salt, Hash, Hash_algorithm, Iterations FROM Patients WHERE Username = %s"
         try:
             cursor.execute(get_patient_details, self.username)
-            for row in cursor:
-                curr_salt = row['Salt']
-                curr_hash = row['Hash']
-                calculated_hash = Util.generate_hash(self.password, curr_salt)
-                
-                if not curr_hash == calculated_hash:
-                    print("Incorrect password")
-                    cm.close_connection()
-                    return None
-                else:
-                    self.salt = curr_salt
-                    self.hash = calculated_hash
-                    cm.close_connection()
-                    return self
-        except pymssql.Error as e:
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            algorithm, iterations = Util.hash_params(row['Hash_algorithm'], row['Iterations'])
+            if not Util.verify_hash(self.password, row['Salt'], row['Hash'], algorithm, iterations):
+                print("Incorrect password")
+                return None
+            self.salt = row['Salt']
+            self.hash = row['Hash']
+            self.algorithm = algorithm
+            self.iterations = iterations
+
+            # the password is known now, so upgrade a hash made with an outdated cost
+            if Util.needs_rehash(algorithm, iterations):
+                self.salt = Util.generate_salt()
+                self.algorithm = Util.hash_algorithm()
+                self.iterations = Util.hash_iterations()
+                self.hash = Util.generate_hash(self.password, self.salt, self.algorithm, self.iterations)
+                update_hash = "UPDATE Patients SET Salt = %s, Hash = %s, Hash_algorithm = %s, Iterations = %d WHERE Username = %s"
+                cursor.execute(update_hash, (self.salt, self.hash, self.algorithm, self.iterations, self.username))
+                conn.commit()
+            return self
+        except DatabaseError as e:
             raise e
         finally:
             cm.close_connection()
-        return None
+
+    # awaitable counterparts of get and save_to_db, run on the bounded async executor
+    async def get_async(self):
+        return await run_blocking(self.get)
 
     def get_username(self):
         return self.username
@@ -51,18 +65,70 @@ class Patient:
     def get_hash(self):
         return self.hash
 
+    def get_algorithm(self):
+        return self.algorithm
+
+    def get_iterations(self):
+        return self.iterations
+
     def save_to_db(self):
         cm = ConnectionManager()
         conn = cm.create_connection()
         cursor = conn.cursor()
 
-        add_patients = "INSERT INTO Patients VALUES (%s, %s, %s)"
+        add_patients = "INSERT INTO Patients (Username, Salt, Hash, Hash_algorithm, Iterations) VALUES (%s, %s, %s, %s, %s)"
         try:
-            cursor.execute(add_patients, (self.username, self.salt, self.hash))
+            cursor.execute(add_patients, (self.username, self.salt, self.hash, self.algorithm, self.iterations))
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
-        except pymssql.Error:
+        except DatabaseError:
             raise
         finally:
             cm.close_connection()
 
+    async def save_to_db_async(self):
+        return await run_blocking(self.save_to_db)
+
+    # Usernames among the given ones that already belong to a patient, checked with a few IN queries
+    @staticmethod
+    def existing_usernames(usernames):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        taken = set()
+        usernames = list(usernames)
+        batch_size = cm.backend.max_batch_rows(1)
+        try:
+            for i in range(0, len(usernames), batch_size):
+                batch = usernames[i:i + batch_size]
+                select_usernames = "SELECT Username FROM Patients WHERE Username IN (" + ", ".join(["%s"] * len(batch)) + ")"
+                cursor.execute(select_usernames, tuple(batch))
+                taken.update(row[0] for row in cursor)
+        except DatabaseError:
+            raise
+        finally:
+            cm.close_connection()
+        return taken
+
+    # Insert many patients with multi-row INSERTs and a single commit
+    @staticmethod
+    def save_many(patients):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        batch_size = cm.backend.max_batch_rows(5)
+        try:
+            for i in range(0, len(patients), batch_size):
+                batch = patients[i:i + batch_size]
+                add_patients = "INSERT INTO Patients (Username, Salt, Hash, Hash_algorithm, Iterations) VALUES " + ", ".join(["(%s, %s, %s, %s, %s)"] * len(batch))
+                params = []
+                for patient in batch:
+                    params.extend((patient.username, patient.salt, patient.hash, patient.algorithm, patient.iterations))
+                cursor.execute(add_patients, tuple(params))
+            conn.commit()
+        except DatabaseError:
+            raise
+        finally:
+            cm.close_connection()
@@ -1,7 +1,10 @@
 import sys
 sys.path.append("../db/*")
 from db.ConnectionManager import ConnectionManager
-import pymssql
+from db.Backend import DatabaseError
+from db.InventoryCache import get_inventory_cache
+from db.AsyncExecutor import run_blocking
+from db.Summary import SummaryDelta
 
 
 class Vaccine:
@@ -10,23 +13,39 @@ class Vaccine:
         self.available_doses = available_doses
 
     # getters
+    # served from the in-process inventory cache; it only goes to the database when the cache is cold
     def get(self):
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor()
-
-        get_vaccine = "SELECT Name, Doses FROM Vaccines WHERE Name = %s"
         try:
-            cursor.execute(get_vaccine, self.vaccine_name)
-            for row in cursor:
-                self.available_doses = row[1]
-                return self
-        except pymssql.Error:
+            doses = get_inventory_cache().get(self.vaccine_name)
+        except DatabaseError:
             # print("Error occurred when getting Vaccine")
             raise
-        finally:
-            cm.close_connection()
-        return None
+        if doses is None:
+            return None
+        self.available_doses = doses
+        return self
+
+    # awaitable counterparts of the blocking methods, run on the bounded async executor
+    async def get_async(self):
+        return await run_blocking(self.get)
+
+    # [(name, doses)] for every vaccine, ordered by name
+    @staticmethod
+    def all():
+        return get_inventory_cache().all()
+
+    @staticmethod
+    async def all_async():
+        return await run_blocking(Vaccine.all)
+
+    async def save_to_db_async(self):
+        return await run_blocking(self.save_to_db)
+
+    async def increase_available_doses_async(self, num):
+        return await run_blocking(self.increase_available_doses, num)
+
+    async def decrease_available_doses_async(self, num):
+        return await run_blocking(self.decrease_available_doses, num)
 
     def get_vaccine_name(self):
         return self.vaccine_name
@@ -43,57 +62,69 @@ class Vaccine:
         cursor = conn.cursor()
 
         add_doses = "INSERT INTO VACCINES VALUES (%s, %d)"
+        summary = SummaryDelta()
+        summary.added(self.vaccine_name, self.available_doses)
         try:
             cursor.execute(add_doses, (self.vaccine_name, self.available_doses))
+            summary.write(cm.backend, cursor)
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
-        except pymssql.Error:
+        except DatabaseError:
             # print("Error occurred when insert Vaccines")
             raise
         finally:
             cm.close_connection()
+        get_inventory_cache().invalidate()
 
     # Increment the available doses
+    # The change is applied in the database relative to the stored count, so it never overwrites
+    # a concurrent reservation and the caller does not need to read the current count first.
     def increase_available_doses(self, num):
         if num <= 0:
             raise ValueError("Argument cannot be negative!")
-        self.available_doses += num
 
         cm = ConnectionManager()
         conn = cm.create_connection()
         cursor = conn.cursor()
 
-        update_vaccine_availability = "UPDATE vaccines SET Doses = %d WHERE name = %s"
+        update_vaccine_availability = "UPDATE vaccines SET Doses = Doses + %d WHERE name = %s"
+        summary = SummaryDelta()
+        summary.added(self.vaccine_name, num)
         try:
-            cursor.execute(update_vaccine_availability, (self.available_doses, self.vaccine_name))
+            cursor.execute(update_vaccine_availability, (num, self.vaccine_name))
+            summary.write(cm.backend, cursor)
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
-        except pymssql.Error:
+        except DatabaseError:
             # print("Error occurred when updating vaccine availability")
             raise
         finally:
             cm.close_connection()
+        get_inventory_cache().invalidate()
+        if self.available_doses is not None:
+            self.available_doses += num
 
     # Decrement the available doses
     def decrease_available_doses(self, num):
-        if self.available_doses - num < 0:
-            ValueError("Not enough available doses!")
-        self.available_doses -= num
-
         cm = ConnectionManager()
         conn = cm.create_connection()
         cursor = conn.cursor()
 
-        update_vaccine_availability = "UPDATE vaccines SET Doses = %d WHERE name = %s"
+        update_vaccine_availability = "UPDATE vaccines SET Doses = Doses - %d WHERE name = %s AND Doses >= %d"
         try:
-            cursor.execute(update_vaccine_availability, (self.available_doses, self.vaccine_name))
+            cursor.execute(update_vaccine_availability, (num, self.vaccine_name, num))
+            if cursor.rowcount == 0:
+                raise ValueError("Not enough available doses!")
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
-        except pymssql.Error:
+        except DatabaseError:
             # print("Error occurred when updating vaccine availability")
             raise
         finally:
             cm.close_connection()
+        get_inventory_cache().invalidate()
+        if self.available_doses is not None:
+            self.available_doses -= num
 
     def __str__(self):
         return f"(Vaccine Name: {self.vaccine_name}, Available Doses: {self.available_doses})"
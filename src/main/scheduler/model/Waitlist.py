@@ -0,0 +1,269 @@
+import sys
+sys.path.append("../db/*")
+from db.ConnectionManager import ConnectionManager
+from db.Backend import DatabaseError, get_backend
+from db.InventoryCache import get_inventory_cache
+from db.IdAllocator import get_id_allocator
+from db.ScheduleIndex import get_schedule_index
+from db.AvailabilityCalendar import get_availability_calendar
+from db.Summary import SummaryDelta
+from model.Appointment import Appointment
+from model.Caregiver import Caregiver
+import datetime
+import random
+import time
+
+
+class Waitlist:
+    # A patient waiting for a caregiver and a dose of one vaccine on one date. Entries are served
+    # by priority (higher first) and then in the order they joined. allocate() books as many
+    # waiting entries as the free caregivers and doses allow in one transaction; the patients find
+    # their new appointments in their notifications the next time they log in.
+
+    MAX_ATTEMPTS = 5
+
+    def __init__(self, waitlist_id, date, patient_name, vaccine_name, priority=0):
+        self.waitlist_id = waitlist_id
+        self.date = date
+        self.patient_name = patient_name
+        self.vaccine_name = vaccine_name
+        self.priority = priority
+
+    def save_to_db(self):
+        if self.waitlist_id is None:
+            self.waitlist_id = get_id_allocator("Waitlist", "Waitlist_id").next_id()
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        add_entry = "INSERT INTO Waitlist (Waitlist_id, Date, Patient_name, Vaccine_name, Priority) VALUES (%s, %s, %s, %s, %d)"
+        try:
+            cursor.execute(add_entry, (self.waitlist_id, self.date, self.patient_name, self.vaccine_name, self.priority))
+            conn.commit()
+        except DatabaseError:
+            raise
+        finally:
+            cm.close_connection()
+
+    # True if the patient already waits for this date and vaccine
+    def exists(self):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        select_entry = "SELECT 1 FROM Waitlist WHERE Patient_name = %s AND Date = %s AND Vaccine_name = %s"
+        try:
+            cursor.execute(select_entry, (self.patient_name, self.date, self.vaccine_name))
+            return cursor.fetchone() is not None
+        except DatabaseError:
+            raise
+        finally:
+            cm.close_connection()
+
+    # [(date, vaccine name, priority)] the patient is waiting for, soonest first
+    @staticmethod
+    def entries_for(patient_name):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        select_entries = "SELECT Date, Vaccine_name, Priority FROM Waitlist WHERE Patient_name = %s ORDER BY Date, Vaccine_name"
+        try:
+            cursor.execute(select_entries, patient_name)
+            return [(row[0], row[1], row[2]) for row in cursor]
+        except DatabaseError:
+            raise
+        finally:
+            cm.close_connection()
+
+    # [(date, vaccine name, waiting patients)] from today on
+    @staticmethod
+    def demand():
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        select_demand = "SELECT Date, Vaccine_name, COUNT(*) FROM Waitlist WHERE Date >= %s GROUP BY Date, Vaccine_name ORDER BY Date, Vaccine_name"
+        try:
+            cursor.execute(select_demand, datetime.date.today())
+            return [(row[0], row[1], row[2]) for row in cursor]
+        except DatabaseError:
+            raise
+        finally:
+            cm.close_connection()
+
+    # Book waiting entries from today on, optionally only between start and end and for one vaccine,
+    # in priority order for as long as caregivers and doses last. Returns the booked Appointments.
+    @staticmethod
+    def allocate(start=None, end=None, vaccine=None):
+        for attempt in range(Waitlist.MAX_ATTEMPTS):
+            plan = Waitlist._plan(start, end, vaccine)
+            if len(plan) == 0:
+                return []
+            try:
+                if Waitlist._book(plan):
+                    get_inventory_cache().invalidate()
+                    for entry_id, appointment in plan:
+                        get_schedule_index().booked(appointment.date, appointment.caregiver_name)
+                        get_availability_calendar().mark_busy([appointment.date], appointment.caregiver_name)
+                    return [appointment for entry_id, appointment in plan]
+            except DatabaseError as e:
+                if not get_backend().is_retryable(e) or attempt == Waitlist.MAX_ATTEMPTS - 1:
+                    raise
+            # another reservation or allocation took a caregiver, dose or entry we planned on
+            time.sleep(random.uniform(0, 0.01 * (2 ** attempt)))
+        return []
+
+    # [(waitlist id, Appointment)] matching the waiting entries, in order, to free caregivers and
+    # doses as of now. Reads only; _book checks nothing changed in between.
+    @staticmethod
+    def _plan(start, end, vaccine):
+        today = datetime.date.today()
+        start = today if start is None or start < today else start
+        filters = "Date >= %s"
+        params = [start]
+        if end is not None:
+            filters += " AND Date <= %s"
+            params.append(end)
+        if vaccine is not None:
+            filters += " AND Vaccine_name = %s"
+            params.append(vaccine)
+
+        select_doses = "SELECT Name, Doses FROM Vaccines WHERE Doses > 0"
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(select_doses)
+            doses = {row[0]: row[1] for row in cursor}
+            if vaccine is not None and vaccine not in doses or len(doses) == 0:
+                return []
+            if vaccine is None:
+                # entries for vaccines that ran out cannot be booked, so they are not read at all
+                filters += " AND Vaccine_name IN (" + ", ".join(["%s"] * len(doses)) + ")"
+                params.extend(doses)
+            select_dates = "SELECT DISTINCT Date FROM Waitlist WHERE " + filters
+            select_entries = "SELECT Waitlist_id, Date, Patient_name, Vaccine_name FROM Waitlist WHERE " + filters + \
+                             " ORDER BY Priority DESC, Waitlist_id ASC"
+            cursor.execute(select_dates, tuple(params))
+            dates = [row[0] for row in cursor]
+        except DatabaseError:
+            raise
+        finally:
+            cm.close_connection()
+        if len(dates) == 0:
+            return []
+
+        # free caregivers per date, reversed so pop() hands them out in alphabetical order like reserve
+        free = {d: names[::-1] for d, names in Caregiver.search_caregivers(dates).items() if len(names) > 0}
+        if len(free) == 0:
+            return []
+
+        matches = []
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(select_entries, tuple(params))
+            for entry_id, d, patient_name, vaccine_name in cursor:
+                if doses.get(vaccine_name, 0) <= 0 or d not in free:
+                    continue
+                caregiver = free[d].pop()
+                if len(free[d]) == 0:
+                    del free[d]
+                doses[vaccine_name] -= 1
+                matches.append((entry_id, d, patient_name, caregiver, vaccine_name))
+                if len(free) == 0 or all(n <= 0 for n in doses.values()):
+                    break
+        except DatabaseError:
+            raise
+        finally:
+            cm.close_connection()
+
+        # ids are leased before _book opens its transaction
+        return [(entry_id, Appointment(Appointment.generate_id(), d, patient_name, caregiver, vaccine_name))
+                for entry_id, d, patient_name, caregiver, vaccine_name in matches]
+
+    # Applies a plan in one transaction. Returns False, having rolled back, if any of it no longer holds.
+    @staticmethod
+    def _book(plan):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        used = {}
+        for entry_id, appointment in plan:
+            used[appointment.vaccine_name] = used.get(appointment.vaccine_name, 0) + 1
+        try:
+            try:
+                take_doses = "UPDATE Vaccines SET Doses = Doses - %d WHERE Name = %s AND Doses >= %d"
+                for vaccine_name, count in sorted(used.items()):
+                    cursor.execute(take_doses, (count, vaccine_name, count))
+                    if cursor.rowcount == 0:
+                        conn.rollback()
+                        return False
+
+                batch_size = cm.backend.max_batch_rows(5)
+                for i in range(0, len(plan), batch_size):
+                    batch = plan[i:i + batch_size]
+                    delete_entries = "DELETE FROM Waitlist WHERE Waitlist_id IN (" + ", ".join(["%s"] * len(batch)) + ")"
+                    cursor.execute(delete_entries, tuple(entry_id for entry_id, appointment in batch))
+                    if cursor.rowcount != len(batch):
+                        # another allocation booked some of these entries first
+                        conn.rollback()
+                        return False
+                    # the primary key on Availabilities rejects a caregiver booked since the plan was made
+                    add_availability = "INSERT INTO Availabilities VALUES " + ", ".join(["(%s, %s)"] * len(batch))
+                    params = []
+                    for entry_id, a in batch:
+                        params.extend((a.date, a.caregiver_name))
+                    cursor.execute(add_availability, tuple(params))
+                    insert_appointments = "INSERT INTO Appointments (Appointment_id, Date, Patient_name, Caregiver_name, Vaccine_name) VALUES " \
+                                          + ", ".join(["(%s, %s, %s, %s, %s)"] * len(batch))
+                    params = []
+                    for entry_id, a in batch:
+                        params.extend((a.appointment_id, a.date, a.patient_name, a.caregiver_name, a.vaccine_name))
+                    cursor.execute(insert_appointments, tuple(params))
+                    add_notifications = "INSERT INTO Notifications (Patient_name, Appointment_id) VALUES " + ", ".join(["(%s, %s)"] * len(batch))
+                    params = []
+                    for entry_id, a in batch:
+                        params.extend((a.patient_name, a.appointment_id))
+                    cursor.execute(add_notifications, tuple(params))
+                summary = SummaryDelta()
+                for entry_id, a in plan:
+                    summary.booked(a.date, a.vaccine_name)
+                summary.write(cm.backend, cursor)
+                conn.commit()
+                return True
+            except DatabaseError:
+                conn.rollback()
+                raise
+        finally:
+            cm.close_connection()
+
+    # [(appointment id, date, vaccine name, caregiver name)] booked for the patient from the waitlist
+    # since the last call; the notifications are removed as they are read
+    @staticmethod
+    def take_notifications(patient_name):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        # a notification whose appointment was canceled since has no row in Appointments; it is
+        # removed with the others but not shown
+        select_notifications = "SELECT n.Appointment_id, a.Date, a.Vaccine_name, a.Caregiver_name FROM Notifications n " \
+                               "LEFT JOIN Appointments a ON a.Appointment_id = n.Appointment_id WHERE n.Patient_name = %s ORDER BY n.Appointment_id"
+        try:
+            cursor.execute(select_notifications, patient_name)
+            rows = [(row[0], row[1], row[2], row[3]) for row in cursor]
+            if len(rows) > 0:
+                # only the rows read: one a concurrent booking adds meanwhile waits for the next call
+                delete_notifications = "DELETE FROM Notifications WHERE Patient_name = %s AND Appointment_id IN (" + \
+                                       ", ".join(["%d"] * len(rows)) + ")"
+                cursor.execute(delete_notifications, tuple([patient_name] + [row[0] for row in rows]))
+                conn.commit()
+            return [row for row in rows if row[1] is not None]
+        except DatabaseError:
+            raise
+        finally:
+            cm.close_connection()
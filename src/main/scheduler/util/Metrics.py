@@ -0,0 +1,180 @@
+import bisect
+import http.server
+import os
+import threading
+import time
+
+
+# histogram bucket upper bounds in seconds, from 100us to 10s
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # one count per bucket plus the +Inf bucket; not cumulative until exported
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    # Process-wide latency histograms and counters, exported in the Prometheus text format.
+    # Recording is a dict lookup and a few additions under a lock, cheap enough for every
+    # command and SQL statement. Other modules add gauges at export time through collectors.
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, enabled=True):
+        self.buckets = buckets
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.descriptions = {}
+        self.collectors = []
+
+    def describe(self, name, description):
+        self.descriptions[name] = description
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def inc(self, name, amount=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def timer(self, name, **labels):
+        return _Timer(self, name, labels)
+
+    # collector() returns [(name, "gauge" or "counter", {labels}, value)] and is called on every export
+    def register_collector(self, collector):
+        self.collectors.append(collector)
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.counters = {}
+
+    def render(self):
+        with self.lock:
+            histograms = [(key, list(h.counts), h.sum, h.count) for key, h in self.histograms.items()]
+            counters = list(self.counters.items())
+        samples = {}
+        for (name, labels), value in counters:
+            samples.setdefault((name, "counter"), []).append((dict(labels), value))
+        for collector in self.collectors:
+            for name, kind, labels, value in collector():
+                samples.setdefault((name, kind), []).append((labels, value))
+
+        lines = []
+        for (name, kind) in sorted(samples):
+            self._header(lines, name, kind)
+            for labels, value in samples[(name, kind)]:
+                lines.append(name + _format_labels(labels) + " " + _format_value(value))
+
+        seen = set()
+        for (name, labels), counts, total, count in sorted(histograms, key=lambda h: h[0]):
+            if name not in seen:
+                self._header(lines, name, "histogram")
+                seen.add(name)
+            labels = dict(labels)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                lines.append(name + "_bucket" + _format_labels(dict(labels, le=_format_value(bound))) + " " + str(cumulative))
+            lines.append(name + "_sum" + _format_labels(labels) + " " + _format_value(total))
+            lines.append(name + "_count" + _format_labels(labels) + " " + str(count))
+        return "\n".join(lines) + "\n"
+
+    # serve render() at http://<host>:<port>/metrics from a daemon thread
+    def serve(self, port, host=""):
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def _header(self, lines, name, kind):
+        if name in self.descriptions:
+            lines.append("# HELP " + name + " " + self.descriptions[name])
+        lines.append("# TYPE " + name + " " + kind)
+
+
+class _Timer:
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+def _format_labels(labels):
+    if len(labels) == 0:
+        return ""
+    parts = []
+    for key, value in sorted(labels.items()):
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        parts.append(key + "=\"" + value + "\"")
+    return "{" + ",".join(parts) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    # MetricsEnabled=0 turns recording off; MetricsPort serves /metrics over HTTP
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                _metrics = Metrics(enabled=os.getenv("MetricsEnabled", "1") != "0")
+                if os.getenv("MetricsPort"):
+                    _metrics.serve(int(os.getenv("MetricsPort")))
+    return _metrics
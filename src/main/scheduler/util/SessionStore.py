@@ -0,0 +1,157 @@
+import collections
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from util.Metrics import get_metrics
+
+
+class SessionStore:
+    # Signed, expiring session tokens so a client can resume its login without sending the
+    # password again. A token is "<id>.<expiry>.<signature>" in lowercase hex, the signature being
+    # an HMAC-SHA256 of the id and expiry under the store's secret, so forged or tampered tokens
+    # are rejected before the store is even consulted. The store maps ids to the logged-in user,
+    # holds at most max_sessions of them (the least recently used is evicted first) and forgets a
+    # session once it expires or is revoked by logout. Sessions live in this process only.
+
+    def __init__(self, secret, ttl=1800, max_sessions=10000):
+        self.secret = secret
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.lock = threading.Lock()
+        # id -> (expiry, user), least recently used first
+        self.sessions = collections.OrderedDict()
+
+        # statistics
+        self.issued = 0
+        self.resumed = 0
+        self.rejected = 0
+        self.expired = 0
+        self.evicted = 0
+        self.revoked = 0
+
+    # returns a new token for user, a logged-in Patient or Caregiver
+    def issue(self, user):
+        session_id = secrets.token_hex(16)
+        expiry = int(time.time() + self.ttl)
+        with self.lock:
+            self.sessions[session_id] = (expiry, user)
+            self.issued += 1
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+                self.evicted += 1
+        return session_id + "." + format(expiry, "x") + "." + self._sign(session_id, expiry)
+
+    # the user the token was issued for, or None if it is invalid, expired or revoked
+    def resume(self, token):
+        user = self.validate(token)
+        if user is not None:
+            with self.lock:
+                self.resumed += 1
+        return user
+
+    # like resume, for a session that is already using the token; run before every command
+    def validate(self, token):
+        session_id, expiry = self._verify(token)
+        if session_id is None:
+            with self.lock:
+                self.rejected += 1
+            return None
+        with self.lock:
+            entry = self.sessions.get(session_id)
+            if entry is None:
+                self.rejected += 1
+                return None
+            if time.time() >= expiry:
+                del self.sessions[session_id]
+                self.expired += 1
+                return None
+            self.sessions.move_to_end(session_id)
+            return entry[1]
+
+    def revoke(self, token):
+        session_id, expiry = self._verify(token)
+        if session_id is None:
+            return False
+        with self.lock:
+            if self.sessions.pop(session_id, None) is None:
+                return False
+            self.revoked += 1
+            return True
+
+    def active(self):
+        now = time.time()
+        with self.lock:
+            for session_id in [s for s, (expiry, user) in self.sessions.items() if now >= expiry]:
+                del self.sessions[session_id]
+                self.expired += 1
+            return len(self.sessions)
+
+    def stats(self):
+        active = self.active()
+        with self.lock:
+            return {
+                "active": active,
+                "issued": self.issued,
+                "resumed": self.resumed,
+                "rejected": self.rejected,
+                "expired": self.expired,
+                "evicted": self.evicted,
+                "revoked": self.revoked,
+            }
+
+    def _sign(self, session_id, expiry):
+        message = (session_id + "." + format(expiry, "x")).encode("ascii")
+        return hmac.new(self.secret, message, hashlib.sha256).hexdigest()
+
+    # (id, expiry) of a well-formed token with a valid signature, else (None, None)
+    def _verify(self, token):
+        parts = token.split(".")
+        if len(parts) != 3:
+            return None, None
+        session_id, expiry, signature = parts
+        try:
+            expiry = int(expiry, 16)
+        except ValueError:
+            return None, None
+        if not hmac.compare_digest(self._sign(session_id, expiry), signature):
+            return None, None
+        return session_id, expiry
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store():
+    # SessionSecret signs the tokens (a random secret is used otherwise, so tokens do not
+    # survive a restart); SessionTTL is in seconds; SessionMax bounds the number of sessions
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                secret = os.getenv("SessionSecret")
+                _store = SessionStore(secret.encode("utf-8") if secret else secrets.token_bytes(32),
+                                      ttl=float(os.getenv("SessionTTL", "1800")),
+                                      max_sessions=int(os.getenv("SessionMax", "10000")))
+    return _store
+
+
+def _store_collector():
+    if _store is None:
+        return []
+    stats = _store.stats()
+    return [
+        ("scheduler_sessions_active", "gauge", {}, stats["active"]),
+        ("scheduler_sessions_total", "counter", {"event": "issued"}, stats["issued"]),
+        ("scheduler_sessions_total", "counter", {"event": "resumed"}, stats["resumed"]),
+        ("scheduler_sessions_total", "counter", {"event": "rejected"}, stats["rejected"]),
+        ("scheduler_sessions_total", "counter", {"event": "expired"}, stats["expired"]),
+        ("scheduler_sessions_total", "counter", {"event": "evicted"}, stats["evicted"]),
+        ("scheduler_sessions_total", "counter", {"event": "revoked"}, stats["revoked"]),
+    ]
+
+
+get_metrics().register_collector(_store_collector)
@@ -1,17 +1,125 @@
+import concurrent.futures
+import datetime
 import hashlib
+import hmac
 import os
+import threading
+import time
+from util.Metrics import get_metrics
+
+
+# cost used for new hashes; rows hashed with anything else are upgraded on the next successful login
+HASH_ALGORITHM = os.getenv("HashAlgorithm", "sha256")
+HASH_ITERATIONS = int(os.getenv("HashIterations", "100000"))
+
+# rows written before the cost was stored per user
+LEGACY_ALGORITHM = "sha256"
+LEGACY_ITERATIONS = 100000
+
+# recurrence rules accepted by expand_dates, as sets of weekday numbers (Monday is 0)
+RECURRENCE_RULES = {
+    "daily": {0, 1, 2, 3, 4, 5, 6},
+    "weekdays": {0, 1, 2, 3, 4},
+    "weekends": {5, 6},
+}
+WEEKDAY_NAMES = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+# longest range expand_dates will produce, to catch typos in the year
+MAX_RANGE_DAYS = 3 * 366
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _pbkdf2(password, salt, algorithm, iterations):
+    return hashlib.pbkdf2_hmac(
+        algorithm,
+        password.encode('utf-8'),
+        salt,
+        iterations,
+        dklen=16
+    )
+
+
+def _hash_executor():
+    # PBKDF2 is pure CPU work, so it runs in worker processes to use every core;
+    # HashWorkers=0 keeps it on the calling thread
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                workers = int(os.getenv("HashWorkers", str(os.cpu_count() or 1)))
+                if workers > 0:
+                    _executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    return _executor
 
 
 class Util:
     def generate_salt():
         return os.urandom(16)
 
-    def generate_hash(password, salt):
-        key = hashlib.pbkdf2_hmac(
-            'sha256',
-            password.encode('utf-8'),
-            salt,
-            100000,
-            dklen=16
-        )
+    def generate_hash(password, salt, algorithm=None, iterations=None):
+        start = time.perf_counter()
+        key = Util.submit_hash(password, salt, algorithm, iterations).result()
+        get_metrics().observe("scheduler_password_hash_duration_seconds", time.perf_counter() - start)
         return key
+
+    # Start hashing in the worker pool and return a future, so several passwords can be hashed at once
+    def submit_hash(password, salt, algorithm=None, iterations=None):
+        algorithm = algorithm or HASH_ALGORITHM
+        iterations = iterations or HASH_ITERATIONS
+        executor = _hash_executor()
+        if executor is None:
+            future = concurrent.futures.Future()
+            future.set_result(_pbkdf2(password, salt, algorithm, iterations))
+            return future
+        return executor.submit(_pbkdf2, password, salt, algorithm, iterations)
+
+    # the (algorithm, iterations) a stored hash was made with; NULL columns mean a legacy row
+    def hash_params(algorithm, iterations):
+        return algorithm or LEGACY_ALGORITHM, iterations or LEGACY_ITERATIONS
+
+    def verify_hash(password, salt, hash, algorithm, iterations):
+        calculated_hash = Util.generate_hash(password, salt, algorithm, iterations)
+        return hmac.compare_digest(bytes(hash), calculated_hash)
+
+    def needs_rehash(algorithm, iterations):
+        return algorithm != HASH_ALGORITHM or iterations != HASH_ITERATIONS
+
+    def hash_algorithm():
+        return HASH_ALGORITHM
+
+    def hash_iterations():
+        return HASH_ITERATIONS
+
+    # dates are entered hyphenated in the format mm-dd-yyyy; raises ValueError otherwise
+    def parse_date(text):
+        date_tokens = text.split("-")
+        if len(date_tokens) != 3:
+            raise ValueError("Invalid date: " + text)
+        month = int(date_tokens[0])
+        day = int(date_tokens[1])
+        year = int(date_tokens[2])
+        return datetime.date(year, month, day)
+
+    # All dates from start to end inclusive that match the recurrence rule: daily, weekdays,
+    # weekends, or a comma-separated list of day names such as mon,wed,fri
+    def expand_dates(start, end, rule="daily"):
+        if end < start:
+            raise ValueError("End date is before start date")
+        if (end - start).days >= MAX_RANGE_DAYS:
+            raise ValueError("Date range is too long")
+        if rule in RECURRENCE_RULES:
+            weekdays = RECURRENCE_RULES[rule]
+        else:
+            weekdays = set()
+            for name in rule.split(","):
+                if name[:3] not in WEEKDAY_NAMES:
+                    raise ValueError("Unknown recurrence rule: " + rule)
+                weekdays.add(WEEKDAY_NAMES.index(name[:3]))
+        dates = []
+        d = start
+        while d <= end:
+            if d.weekday() in weekdays:
+                dates.append(d)
+            d += datetime.timedelta(days=1)
+        return dates